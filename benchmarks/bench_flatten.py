@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""Iterative flatten (dfilter.walk) against the recursive _rflatten().
+
+    python benchmarks/bench_flatten.py
+
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dfilter import Dfilter
+from dfilter.walk import iflatten
+
+from datagen import deep
+
+COUNTRIES = os.path.join(os.path.dirname(__file__), '..',
+                         'tests', 'countries.json')
+
+
+def bench(label, func, number):
+    best = min(timeit.repeat(func, number=number, repeat=3))
+    print('{0:<40} {1:>10.2f} ms/call'.format(label, best / number * 1e3))
+    return best
+
+
+def compare(label, data, number):
+    df = Dfilter(data)
+    old = bench('recursive ' + label,
+                lambda: list(df._rflatten(df.data)), number)
+    new = bench('iterative ' + label,
+                lambda: list(iflatten(df.data)), number)
+    print('{0:<40} {1:>10.1f}x'.format('speedup', old / new))
+    bench('flatten() ' + label, df.flatten, number)
+    bench('fold() ' + label, df.fold, number)
+
+
+def main():
+    compare('countries.json', Dfilter().read_json(COUNTRIES).data, 20)
+    compare('depth 50', deep(50), 200)
+    compare('depth 400', deep(400), 5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""Scaling of filter/fields/fetch with the number of worker processes.
+
+    python benchmarks/bench_parallel.py [records]
+
+"""
+
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dfilter import Dfilter
+
+from datagen import records
+
+
+def timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    df = Dfilter(records(count))
+    query = df.compile_query({'*.population': {'$gt': 5 * 10 ** 7},
+                              '*.tags.*': {'$in': ['a', 'b']}})
+    cases = [('filter', lambda w: df.filter(query, workers=w)),
+             ('fields', lambda w: df.fields(['*.name', '*.region'],
+                                            workers=w)),
+             ('fetch', lambda w: df.fetch('*.population', workers=w))]
+    cpus = multiprocessing.cpu_count()
+    workers = sorted(set([1, 2, 4, cpus]))
+    print('{0} records, {1} cpus'.format(count, cpus))
+    for name, func in cases:
+        base = timed(lambda: func(None))
+        print('{0:<8} serial    {1:8.3f}s'.format(name, base))
+        for number in workers[1:]:
+            took = timed(lambda: func(number))
+            print('{0:<8} workers={1:<2} {2:8.3f}s {3:6.2f}x'.format(
+                name, number, took, base / took))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Per-call overhead of spot/fetch/fields/filter on tests/countries.json.
+
+Compares the compiled, cached path plans against the original
+re-parse-every-call implementation of spot(), kept here as a reference.
+
+    python benchmarks/bench_path.py
+
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dfilter import Dfilter
+
+COUNTRIES = os.path.join(os.path.dirname(__file__), '..',
+                         'tests', 'countries.json')
+
+
+def legacy_unpack_step(step, obj):
+    step = str(step)
+    if not (isinstance(obj, list) or isinstance(obj, dict)):
+        return []
+    if step == '*':
+        if isinstance(obj, dict):
+            return obj.keys()
+        return range(len(obj))
+    elif step.isdigit():
+        if isinstance(obj, list):
+            return [int(step)] if int(step) < len(obj) else []
+        return [step, int(step)]
+    elif step.startswith('[') and step.endswith(']'):
+        out = []
+        for s1 in step[1:-1].split(','):
+            out.extend(legacy_unpack_step(s1.strip(), obj))
+        return list(set(out))
+    elif isinstance(obj, dict) and step in obj:
+        return [step]
+    return []
+
+
+def legacy_spot(path, data):
+    objs = [[[], data]]
+    for step in str(path).split('.'):
+        new_objs = []
+        for obj in objs:
+            for ps in legacy_unpack_step(step, obj[1]):
+                if isinstance(obj[1], dict) and ps not in obj[1]:
+                    continue
+                new_objs.append([obj[0] + [ps], obj[1][ps]])
+        objs = new_objs
+    return objs
+
+
+def bench(label, stmt, number):
+    best = min(timeit.repeat(stmt, number=number, repeat=3))
+    print('{0:<40} {1:>10.2f} us/call'.format(label, best / number * 1e6))
+    return best
+
+
+def main():
+    df = Dfilter().read_json(COUNTRIES)
+    data = df.data
+    paths = ['100.name', '*.name', '*.translations.de', '*.language.[0, 1]']
+    for path in paths:
+        old = bench('legacy spot {0!r}'.format(path),
+                    lambda: legacy_spot(path, data), 200)
+        new = bench('compiled spot {0!r}'.format(path),
+                    lambda: list(df.spot(path)), 200)
+        print('{0:<40} {1:>10.1f}x'.format('speedup', old / new))
+    bench("fetch('100.name')", lambda: df.fetch('100.name'), 20000)
+    bench("fields('*.name')", lambda: df.fields('*.name'), 200)
+    bench("filter({'*.name': 'South Africa'})",
+          lambda: df.filter({'*.name': 'South Africa'}), 200)
+    query = df.compile_query({'*.population': {'$gt': 10 ** 7},
+                              '*.region': {'$in': ['Africa', 'Asia']}})
+    bench('filter(compiled population/region)',
+          lambda: df.filter(query), 200)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Synthetic data for the benchmarks.
+
+Every generator is seeded, the same arguments give the same data.
+
+"""
+
+import random
+
+REGIONS = ['Africa', 'Americas', 'Asia', 'Europe', 'Oceania']
+
+
+def records(count, seed=1):
+    """A long list of similar records."""
+    rnd = random.Random(seed)
+    return [{'id': n,
+             'name': 'record{0}'.format(n),
+             'region': rnd.choice(REGIONS),
+             'population': rnd.randint(0, 10 ** 8),
+             'tags': [rnd.choice('abcdef') for t in range(3)]}
+            for n in range(count)]
+
+
+def wide(count, seed=1):
+    """A dict with many top level keys and small values."""
+    rnd = random.Random(seed)
+    return dict([('key{0}'.format(n),
+                  {'value': rnd.randint(0, 1000),
+                   'flag': rnd.random() < 0.5})
+                 for n in range(count)])
+
+
+def deep(depth, width=3):
+    """A dict nested depth levels deep with width leaves per level."""
+    root = node = {}
+    for level in range(depth):
+        for n in range(width):
+            node['leaf{0}'.format(n)] = level
+        node['next'] = {}
+        node = node['next']
+    return root
+
+
+def fanout(groups, members, seed=1):
+    """Three levels of dicts for wildcard heavy paths like '*.*.*.value'."""
+    rnd = random.Random(seed)
+    return dict([('group{0}'.format(g),
+                  dict([('member{0}'.format(m),
+                         {'item': {'value': rnd.randint(0, 1000)}})
+                        for m in range(members)]))
+                 for g in range(groups)])
+
+
+# Number of records, wide keys, depth and fan out per scale.
+SCALES = {'small': {'records': 2000, 'wide': 2000, 'depth': 50,
+                    'groups': 20, 'members': 20},
+          'medium': {'records': 20000, 'wide': 20000, 'depth': 200,
+                     'groups': 60, 'members': 60},
+          'large': {'records': 200000, 'wide': 200000, 'depth': 400,
+                    'groups': 200, 'members': 200}}
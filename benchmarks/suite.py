@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+"""Time and peak memory of the Dfilter operations on synthetic data.
+
+    python benchmarks/suite.py [--scale small|medium|large] [--only regex]
+                               [--repeat N] [--save results.json]
+                               [--compare baseline.json] [--threshold 0.1]
+
+The results are written to stdout as JSON:
+
+    {"python": "2.7.18", "scale": "small",
+     "results": {"fetch records": {"best": 0.0041, "median": 0.0043,
+                                   "peak_kb": 112}, ...}}
+
+best/median are seconds per call. peak_kb is the memory the call needs
+on top of its data, measured with tracemalloc when it is available (3.4
+and later). Else it is the peak resident set size during the call less
+the size before it, read from /proc on Linux after the peak is reset
+through /proc/self/clear_refs; elsewhere peak_kb is null. Every case runs
+in its own forked process, on data built once by the parent, so cases
+don't share caches or garbage.
+
+With --compare the results are checked against a saved run, a table is
+printed on stderr and the exit status is 1 when a case got slower than
+the threshold (0.1 = 10%).
+
+"""
+
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dfilter import Dfilter
+
+import datagen
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+class Data(object):
+
+    """The datasets of a scale, built on first use."""
+
+    def __init__(self, scale):
+        self.sizes = datagen.SCALES[scale]
+        self.cache = {}
+        self.tmp = tempfile.mkdtemp()
+
+    def get(self, name):
+        if name not in self.cache:
+            self.cache[name] = getattr(self, 'make_' + name)()
+        return self.cache[name]
+
+    def make_records(self):
+        return Dfilter(datagen.records(self.sizes['records']))
+
+    def make_wide(self):
+        return Dfilter(datagen.wide(self.sizes['wide']))
+
+    def make_deep(self):
+        return Dfilter(datagen.deep(self.sizes['depth']))
+
+    def make_fanout(self):
+        return Dfilter(datagen.fanout(self.sizes['groups'],
+                                      self.sizes['members']))
+
+    def make_regions(self):
+        return self.get('records').fetch('*.region')
+
+    def make_records_file(self):
+        name = os.path.join(self.tmp, 'records.json')
+        fh = open(name, 'w')
+        json.dump(self.get('records').data, fh)
+        fh.close()
+        return name
+
+    def close(self):
+        shutil.rmtree(self.tmp)
+
+
+FILTERS = [('eq', {'*.region': 'Asia'}),
+           ('ne', {'*.region': {'$ne': 'Asia'}}),
+           ('lt', {'*.population': {'$lt': 10 ** 7}}),
+           ('lte', {'*.population': {'$lte': 10 ** 7}}),
+           ('gt', {'*.population': {'$gt': 9 * 10 ** 7}}),
+           ('gte', {'*.population': {'$gte': 9 * 10 ** 7}}),
+           ('in', {'*.region': {'$in': ['Asia', 'Europe']}}),
+           ('nin', {'*.region': {'$nin': ['Asia', 'Europe']}}),
+           ('all', {'*.tags': {'$all': ['a', 'b']}}),
+           ('mod', {'*.id': {'$mod': [7, 0]}}),
+           ('exists', {'*.tags.2': {'$exists': True}}),
+           ('contains', {'*.name': {'$contains': 'record7'}})]
+
+
+# (name, dataset, function called with the dataset)
+CASES = [
+    ('spot records', 'records', lambda df: list(df.spot('*.tags.1'))),
+    ('spot fanout', 'fanout', lambda df: list(df.spot('*.*.item.value'))),
+    ('fetch records', 'records', lambda df: df.fetch('*.population')),
+    ('fetch fanout', 'fanout', lambda df: df.fetch('*.*.item.value')),
+    ('fetch wide', 'wide', lambda df: df.fetch('*.value')),
+    ('fields records', 'records',
+     lambda df: df.fields(['*.name', '*.region'])),
+    ('fields fanout', 'fanout', lambda df: df.fields('*.*.item')),
+    ('filter wide', 'wide', lambda df: df.filter({'*.value': {'$gt': 500}})),
+    ('filter fanout', 'fanout',
+     lambda df: df.filter({'*.*.item.value': {'$lt': 10}})),
+    ('flatten deep', 'deep', lambda df: df.flatten()),
+    ('flatten records', 'records', lambda df: df.flatten()),
+    ('flat_view get records', 'records',
+     lambda df: [df.flat_view().get('{0}.name'.format(n))
+                 for n in range(0, 1000, 10)]),
+    ('fold deep', 'deep', lambda df: df.fold()),
+    ('fold wide', 'wide', lambda df: df.fold()),
+    ('unique_values records', 'regions', lambda df: df.unique_values()),
+    ('read_json records', 'records_file',
+     lambda name: Dfilter().read_json(name)),
+    ('read_json stream records', 'records_file',
+     lambda name: Dfilter().read_json(name, query={'*.region': 'Asia'})),
+]
+for _op, _query in FILTERS:
+    CASES.append(('filter {0} records'.format(_op), 'records',
+                  (lambda query: lambda df: df.filter(query))(_query)))
+
+
+def _status_kb(field):
+    """Return a kB field of /proc/self/status, eg. 'VmRSS'."""
+    fh = open('/proc/self/status')
+    try:
+        for line in fh:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    finally:
+        fh.close()
+    return None
+
+
+def _reset_peak():
+    """Reset VmHWM to the current resident set size, False if we can't."""
+    try:
+        fh = open('/proc/self/clear_refs', 'w')
+        try:
+            fh.write('5')
+        finally:
+            fh.close()
+    except (IOError, OSError):
+        return False
+    return _status_kb('VmHWM') is not None
+
+
+def measure(func, repeat):
+    """Run a case and return its result dict."""
+    # Memory first, later calls reuse what the first call allocated.
+    if tracemalloc is not None:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    elif _reset_peak():
+        # ru_maxrss can not be reset, a forked child starts with the peak
+        # of the parent, VmHWM can.
+        before = _status_kb('VmRSS')
+        func()
+        peak = _status_kb('VmHWM') - before
+    else:
+        func()
+        peak = None
+    times = []
+    for run in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    times.sort()
+    return {'best': times[0], 'median': times[len(times) // 2],
+            'peak_kb': peak}
+
+
+def run_forked(func, repeat):
+    """Run measure() in a child process, where one is available."""
+    if not hasattr(os, 'fork'):
+        return measure(func, repeat)
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        try:
+            out = json.dumps(measure(func, repeat))
+        except Exception as error:
+            out = json.dumps({'error': repr(error)})
+        os.write(write_end, out.encode('utf-8'))
+        os.close(write_end)
+        os._exit(0)
+    os.close(write_end)
+    chunks = []
+    while True:
+        chunk = os.read(read_end, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(read_end)
+    os.waitpid(pid, 0)
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison table on stderr, return the slower case names."""
+    slower = []
+    old_results = baseline.get('results', {})
+    sys.stderr.write('{0:<28} {1:>10} {2:>10} {3:>8}\n'.format(
+        'case', 'baseline', 'now', 'ratio'))
+    for name in sorted(results):
+        new = results[name].get('best')
+        old = old_results.get(name, {}).get('best')
+        if new is None or not old:
+            sys.stderr.write('{0:<28} {1:>10}\n'.format(name, 'n/a'))
+            continue
+        ratio = new / old
+        flag = ''
+        if ratio > 1 + threshold:
+            slower.append(name)
+            flag = ' slower'
+        sys.stderr.write('{0:<28} {1:>9.2f}ms {2:>8.2f}ms {3:>7.2f}x{4}\n'
+                         .format(name, old * 1e3, new * 1e3, ratio, flag))
+    return slower
+
+
+def parse_args(args):
+    options = {'scale': 'small', 'only': None, 'repeat': 5, 'save': None,
+               'compare': None, 'threshold': 0.1}
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        name = arg.lstrip('-')
+        if not arg.startswith('--') or name not in options or not args:
+            raise SystemExit(__doc__)
+        options[name] = args.pop(0)
+    if options['scale'] not in datagen.SCALES:
+        raise SystemExit('Unknown scale {0!r}'.format(options['scale']))
+    options['repeat'] = int(options['repeat'])
+    options['threshold'] = float(options['threshold'])
+    return options
+
+
+def main(args):
+    options = parse_args(args)
+    data = Data(options['scale'])
+    results = {}
+    try:
+        for name, dataset, case in CASES:
+            if options['only'] and not re.search(options['only'], name):
+                continue
+            # The data is built here once, the children inherit it.
+            func = (lambda value: lambda: case(value))(data.get(dataset))
+            results[name] = run_forked(func, options['repeat'])
+    finally:
+        data.close()
+    report = {'python': platform.python_version(),
+              'scale': options['scale'],
+              'results': results}
+    text = json.dumps(report, indent=1, sort_keys=True)
+    sys.stdout.write(text + '\n')
+    if options['save']:
+        fh = open(options['save'], 'w')
+        fh.write(text)
+        fh.close()
+    if options['compare']:
+        fh = open(options['compare'])
+        baseline = json.load(fh)
+        fh.close()
+        if compare(results, baseline, options['threshold']):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
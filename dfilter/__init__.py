@@ -1 +1,3 @@
 from .dfilter import Dfilter
+from .path import compile_path
+from .query import compile_query
@@ -0,0 +1,239 @@
+"""Group and unwind stages for lazy pipelines.
+
+Group runs every item through incremental accumulators in a single pass,
+only the running state of each group is kept in memory.
+
+    >>> from dfilter import Dfilter
+    >>> df = Dfilter([{'k': 'a', 'n': 1}, {'k': 'b', 'n': 2},
+    ...               {'k': 'a', 'n': 3}])
+    >>> groups = df.group('*.k', {'total': {'$sum': '*.n'}})
+    >>> [(group['_id'], group['total']) for group in groups.values()]
+    [('a', 4), ('b', 2)]
+
+Unwind turns an item with a list into one item per list element.
+
+    >>> Dfilter([{'k': 'a', 'tags': [1, 2]}]).unwind('*.tags').values()
+    [{'k': 'a', 'tags': 1}, {'k': 'a', 'tags': 2}]
+
+"""
+
+import json
+
+from .compat import basestring, is_number
+from .normalize import json_default, shallow_copy
+from .path import is_sequence
+from .sort import _rank
+
+
+class Count(object):
+
+    def __init__(self):
+        self.count = 0
+
+    def add(self, values):
+        self.count += 1
+
+    def result(self):
+        return self.count
+
+
+class Sum(object):
+
+    """Sum of the numbers, other values are ignored."""
+
+    def __init__(self):
+        self.total = 0
+
+    def add(self, values):
+        for value in values:
+            if is_number(value):
+                self.total += value
+
+    def result(self):
+        return self.total
+
+
+class Avg(object):
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, values):
+        for value in values:
+            if is_number(value):
+                self.total += value
+                self.count += 1
+
+    def result(self):
+        if not self.count:
+            return None
+        return self.total / float(self.count)
+
+
+class Min(object):
+
+    """Smallest value, values of mixed types are ordered like sort()."""
+
+    def __init__(self):
+        self.key = None
+
+    def better(self, key):
+        return key < self.key
+
+    def add(self, values):
+        for value in values:
+            key = (_rank(value), value)
+            if self.key is None or self.better(key):
+                self.key = key
+
+    def result(self):
+        if self.key is None:
+            return None
+        return self.key[1]
+
+
+class Max(Min):
+
+    def better(self, key):
+        return key > self.key
+
+
+class Push(object):
+
+    def __init__(self):
+        self.values = []
+
+    def add(self, values):
+        self.values.extend(values)
+
+    def result(self):
+        return self.values
+
+
+ACCUMULATORS = {'count': Count,
+                'sum': Sum,
+                'avg': Avg,
+                'min': Min,
+                'max': Max,
+                'push': Push}
+
+
+def _group_key(value):
+    """Return a hashable key for the group value."""
+    try:
+        hash(value)
+    except TypeError:
+        return ('json', json.dumps(value, sort_keys=True,
+                                   default=json_default))
+    return ('value', type(value) is bool, value)
+
+
+class GroupStage(object):
+
+    """Blocking stage that groups the items on the value of a path.
+
+    Every group becomes one item {'_id': value, name: result, ...}, in
+    the order the groups are first seen. Items without a value are
+    grouped under None, without a path all items are one group.
+
+    :param accumulators: Dict of name: {'$op': operand} where op is one of
+                         count, sum, avg, min, max and push. A string
+                         operand is a path, anything else is a constant,
+                         eg. {'$sum': 1} counts the items.
+
+    """
+
+    def __init__(self, dfilter, by, accumulators=None):
+        self.by = None if by is None else dfilter._plan(by)
+        self.specs = []
+        for name, spec in sorted((accumulators or {}).items()):
+            if not isinstance(spec, dict) or len(spec) != 1:
+                raise ValueError('Accumulator {0!r} needs one operator, '
+                                 'got {1!r}'.format(name, spec))
+            op, operand = list(spec.items())[0]
+            try:
+                accumulator = ACCUMULATORS[op.lstrip('$')]
+            except KeyError:
+                raise ValueError('Unknown accumulator {0!r}'.format(op))
+            if isinstance(operand, basestring):
+                plan = dfilter._plan(operand)
+                operand = None
+            else:
+                plan = None
+            self.specs.append((name, accumulator, plan, [operand]))
+
+    def run(self, items):
+        groups = {}
+        order = []
+        specs = self.specs
+        by = self.by
+        for key, value in items:
+            found = by.values_item(key, value) if by is not None else ()
+            group_id = found[0] if found else None
+            group_key = _group_key(group_id)
+            group = groups.get(group_key)
+            if group is None:
+                group = groups[group_key] = (
+                    group_id, [spec[1]() for spec in specs])
+                order.append(group_key)
+            for spec, accumulator in zip(specs, group[1]):
+                plan = spec[2]
+                if plan is None:
+                    accumulator.add(spec[3])
+                else:
+                    accumulator.add(plan.values_item(key, value))
+        for position, group_key in enumerate(order):
+            group_id, accumulators = groups.pop(group_key)
+            out = {'_id': group_id}
+            for spec, accumulator in zip(specs, accumulators):
+                out[spec[0]] = accumulator.result()
+            yield position, out
+
+
+def _replace(obj, path, new):
+    """Return obj with the value at path replaced, copying the path."""
+    if not path:
+        return new
+    copy = shallow_copy(obj)
+    copy[path[0]] = _replace(obj[path[0]], path[1:], new)
+    return copy
+
+
+class UnwindStage(object):
+
+    """Yield an item for every element of the list at a path.
+
+    Only the first list the path finds is unwound. Items where the path
+    is missing or an empty list are dropped, other values are kept as
+    they are. Dict keys get the element position appended, list items
+    are numbered again.
+
+    """
+
+    def __init__(self, dfilter, path):
+        self.plan = dfilter._plan(path)
+        self.separator = dfilter.chars['separator']
+
+    def run(self, items):
+        plan = self.plan
+        counter = 0
+        for key, value in items:
+            found = plan.run_item(key, value)
+            if not found:
+                continue
+            path, array = found[0]
+            if not is_sequence(array):
+                array = [array]
+                path = None
+            for position, element in enumerate(array):
+                if isinstance(key, basestring):
+                    new_key = u'{0}{1}{2}'.format(key, self.separator,
+                                                  position)
+                else:
+                    new_key = counter
+                    counter += 1
+                if path is None:
+                    yield new_key, value
+                else:
+                    yield new_key, _replace(value, path[1:], element)
@@ -0,0 +1,66 @@
+"""Small bounded caches used by the query machinery."""
+
+
+class LRUCache(object):
+
+    """A bounded mapping that evicts the least recently used entries.
+
+    Every entry remembers when it was last used. Once the cache is full the
+    oldest quarter is evicted in one go, which keeps lookups to a single
+    dictionary access.
+
+    >>> cache = LRUCache(2)
+    >>> cache.put('a', 1)
+    >>> cache.put('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.put('c', 3)
+    >>> cache.get('b') is None
+    True
+
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = max(1, int(maxsize))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._tick = 0
+        self._data = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self._tick += 1
+        entry[1] = self._tick
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value):
+        if key not in self._data and len(self._data) >= self.maxsize:
+            self._evict()
+        self._tick += 1
+        self._data[key] = [value, self._tick]
+
+    def _evict(self):
+        by_age = sorted(self._data.items(), key=lambda item: item[1][1])
+        for key, entry in by_age[:max(1, len(by_age) // 4)]:
+            del self._data[key]
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def info(self):
+        """Return the cache statistics as a dictionary."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._data),
+                'maxsize': self.maxsize}
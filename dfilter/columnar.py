@@ -0,0 +1,230 @@
+"""Columnar evaluation of filters on lists of similar records.
+
+Columnar extracts the value of a path for every item into a NumPy array,
+numbers into a numeric array and anything else into an object array,
+with a second boolean array telling which items have a value. Conditions
+then become vectorized boolean masks that are combined with & and |.
+
+    >>> from dfilter import Dfilter
+    >>> cols = Dfilter([{'n': 1}, {'n': 5}, {'m': 9}]).columnar()
+    >>> mask = (cols['*.n'] > 2) | (cols['*.m'] == 9)
+    >>> cols.select(mask)
+    [{'n': 5}, {'m': 9}]
+
+NumPy is optional, it is only needed when a Columnar is created.
+
+"""
+
+from .compat import is_number
+from .query import ALIASES, And, Condition, Exists, Nor, Or, compile_query
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Integers beyond this can not be stored exactly in a float array.
+MAX_EXACT_FLOAT = 2 ** 53
+
+
+class Column(object):
+
+    """The values of one path, one row per item.
+
+    values  - numpy array, numeric when every value is a number.
+    present - numpy bool array, False for items without a value.
+    multi   - True when an item has more than one value, such columns
+              can not be compared vectorized.
+
+    """
+
+    def __init__(self, found):
+        count = len(found)
+        self.multi = False
+        self.present = numpy.zeros(count, dtype=bool)
+        scalars = [None] * count
+        numeric = True
+        integer = True
+        for row, values in enumerate(found):
+            if not values:
+                continue
+            if len(values) > 1:
+                self.multi = True
+            value = values[0]
+            scalars[row] = value
+            self.present[row] = True
+            if not is_number(value):
+                numeric = integer = False
+            elif isinstance(value, float):
+                integer = False
+            elif abs(value) >= MAX_EXACT_FLOAT:
+                numeric = integer = False
+        self.numeric = numeric
+        if numeric:
+            dtype = numpy.int64 if integer else numpy.float64
+            self.values = numpy.array([0 if v is None else v
+                                       for v in scalars], dtype=dtype)
+        else:
+            self.values = numpy.empty(count, dtype=object)
+            self.values[:] = scalars
+
+    def __len__(self):
+        return len(self.present)
+
+    def _vectorized(self, operand):
+        if self.multi or isinstance(operand, (list, tuple, dict, set)):
+            return False
+        if self.numeric:
+            return is_number(operand)
+        return True
+
+    def compare(self, op, operand):
+        """Return a mask for the operator, None when it can not be done."""
+        op = op.strip('$')
+        op = ALIASES.get(op, op)
+        if op == 'exists':
+            return self.present.copy() if operand else ~self.present
+        if op in ('in', 'nin'):
+            if self.multi or not isinstance(operand, (list, tuple, set,
+                                                      frozenset)):
+                return None
+            operand = list(operand)
+            if self.numeric and all([is_number(o) for o in operand]):
+                mask = numpy.in1d(self.values, operand)
+            elif not self.numeric:
+                try:
+                    lookup = frozenset(operand)
+                    mask = numpy.array([v in lookup for v in self.values],
+                                       dtype=bool)
+                except TypeError:
+                    return None
+            else:
+                return None
+            return (~mask if op == 'nin' else mask) & self.present
+        if op == 'mod':
+            if not (self.numeric and self.values.dtype.kind == 'i'):
+                return None
+            return ((self.values % operand[0]) == operand[1]) & self.present
+        if op not in ('eq', 'ne', 'lt', 'le', 'gt', 'ge') or \
+                not self._vectorized(operand):
+            return None
+        values = self.values
+        if op == 'eq':
+            mask = values == operand
+        elif op == 'ne':
+            mask = values != operand
+        elif op == 'lt':
+            mask = values < operand
+        elif op == 'le':
+            mask = values <= operand
+        elif op == 'gt':
+            mask = values > operand
+        else:
+            mask = values >= operand
+        return numpy.asarray(mask, dtype=bool) & self.present
+
+    def _mask(self, op, operand):
+        mask = self.compare(op, operand)
+        if mask is None:
+            raise TypeError('Can not compare column with {0!r}'.format(
+                operand))
+        return mask
+
+    def __eq__(self, other):
+        return self._mask('eq', other)
+
+    def __ne__(self, other):
+        return self._mask('ne', other)
+
+    def __lt__(self, other):
+        return self._mask('lt', other)
+
+    def __le__(self, other):
+        return self._mask('le', other)
+
+    def __gt__(self, other):
+        return self._mask('gt', other)
+
+    def __ge__(self, other):
+        return self._mask('ge', other)
+
+    def isin(self, operand):
+        return self._mask('in', operand)
+
+
+class Columnar(object):
+
+    """Columns of the items of a Dfilter, built on first use.
+
+    The columns are a snapshot, create a new Columnar after the data
+    changes.
+
+    """
+
+    def __init__(self, dfilter, paths=None):
+        if numpy is None:
+            raise ImportError('The columnar backend needs numpy')
+        self.dfilter = dfilter
+        self.items = list(dfilter.items())
+        self.columns = {}
+        for path in paths or ():
+            self.column(path)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, path):
+        return self.column(path)
+
+    def column(self, path):
+        """Return the Column of a path like '*.population'."""
+        if path not in self.columns:
+            plan = self.dfilter._plan(path)
+            self.columns[path] = Column([plan.values_item(key, value)
+                                         for key, value in self.items])
+        return self.columns[path]
+
+    def _scan(self, node):
+        return numpy.array([node.match_item(key, value)
+                            for key, value in self.items], dtype=bool)
+
+    def _node_mask(self, node):
+        if isinstance(node, Exists):
+            return self.column(node.path).compare('$exists', node.operand)
+        elif isinstance(node, Condition):
+            mask = self.column(node.path).compare(node.op, node.operand)
+            if mask is None:
+                # Operators without a vectorized form are run per item.
+                mask = self._scan(node)
+            return mask
+        elif isinstance(node, Nor):
+            return ~self._combine(node.children, numpy.logical_or, False)
+        elif isinstance(node, Or):
+            return self._combine(node.children, numpy.logical_or, False)
+        elif isinstance(node, And):
+            return self._combine(node.children, numpy.logical_and, True)
+        return self._scan(node)
+
+    def _combine(self, children, func, start):
+        mask = numpy.empty(len(self.items), dtype=bool)
+        mask.fill(start)
+        for child in children:
+            mask = func(mask, self._node_mask(child))
+        return mask
+
+    def mask(self, query):
+        """Return the boolean mask of the items that match the query."""
+        query = compile_query(query, self.dfilter.chars)
+        return self._node_mask(query.root)
+
+    def select(self, mask):
+        """Return a Dfilter with the items where the mask is True."""
+        from .dfilter import odict
+        selected = [self.items[row] for row in numpy.flatnonzero(mask)]
+        if isinstance(self.dfilter.data, list):
+            return self.dfilter._result([item[1] for item in selected])
+        return self.dfilter._result(odict(selected))
+
+    def filter(self, query):
+        """Like Dfilter.filter() but evaluated column by column."""
+        return self.select(self.mask(query))
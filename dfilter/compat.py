@@ -0,0 +1,24 @@
+"""Names that differ between Python 2 and Python 3, defined once."""
+
+try:
+    basestring = basestring
+except NameError:
+    basestring = str
+
+try:
+    text_type = unicode
+    long_type = long
+    integer_types = (int, long)
+except NameError:
+    text_type = str
+    long_type = int
+    integer_types = (int,)
+
+NUMBER_TYPES = integer_types + (float,)
+
+iteritems = getattr(dict, 'iteritems', dict.items)
+
+
+def is_number(value):
+    """True for ints, longs and floats, booleans are not numbers."""
+    return isinstance(value, NUMBER_TYPES) and not isinstance(value, bool)
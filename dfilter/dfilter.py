@@ -1,21 +1,44 @@
 #!/usr/bin/env python
 
+import copy
+import heapq
 import json
-import operator
+
+from . import explain, merkle, parallel
+from .columnar import Columnar
+from .compat import basestring
+from .index import candidates as index_candidates, make_index
+from .normalize import json_default, normalize, shallow_copy
+from .path import (KeyStep, compile_fields, compile_path, compile_step,
+                   is_container)
+from .pipeline import Pipeline
+from .cache import LRUCache
+from .query import Query, binary_operator, compile_query
+from .record import compact
+from .reverse import KeyIndex, ReverseIndex, canonical, join_path
+from .snapshot import Snapshot, write_snapshot
+from .sort import sort_items
+from .stream import JsonLoader, JsonStream, LINES_EXTENSIONS
+from .walk import FlatView, iflatten, iflatten_keys
 
 try:
-    from collections import OrderedDict as odict
+    from collections import OrderedDict
 except ImportError:
     # Python 2.6 has no ordered dict, we use a normal dict.
-    odict = dict
+    OrderedDict = dict
 
 odict = dict
 
+_MISSING = object()
+
 
 class Dfilter(object):
 
     """Do arbitrary queries on a data object (aka dictionary)."""
 
+    __slots__ = ('chars', 'data', '_indexes', '_owned', '_reverse',
+                 '_hashes', '_version', '_results', '_keys')
+
     def __init__(self, data=None, **kwargs):
         self.chars = {'separator': '.',
                       'wildcard': '*',
@@ -23,6 +46,13 @@ class Dfilter(object):
                       'listend': ']',
                       'listsplit': ','}
         self.data = odict()
+        self._indexes = {}
+        self._owned = None
+        self._reverse = ReverseIndex()
+        self._hashes = merkle.HashCache()
+        self._version = 0
+        self._results = None
+        self._keys = None
         self.config(**kwargs)
         self._store(data)
 
@@ -43,13 +73,88 @@ class Dfilter(object):
     def __len__(self):
         return self.data.__len__()
 
-    def clean(self, data=None):
+    def clean(self, data=None, share=False):
+        """Normalize the data like a JSON round trip would.
+
+        Tuples become lists, strings become unicode and dictionary keys
+        become strings, see dfilter.normalize.
+
+        :param share: Keep the parts that are already normal instead of
+                      copying them. The Dfilter then copies on write.
+        :return: self
+
+        """
         if data is None:
             data = self.data
 
-        self.data = json.loads(json.dumps(data))
+        self.data = normalize(data, share=share)
+        self._owned = {} if share else None
+        self._data_changed()
         return self
 
+    def copy(self, cow=True):
+        """Return a copy of this Dfilter.
+
+        :param cow: Share all subtrees and copy them when they are written
+                    to (copy on write), else return a normalized deep copy.
+
+        """
+        if cow:
+            return self._result(shallow_copy(self.data))
+        return Dfilter(normalize(self.data))
+
+    def _result(self, data, fresh=True):
+        """Return a Dfilter that shares the subtrees of data copy on write.
+
+        :param fresh: True when the top level container of data is new.
+
+        """
+        result = Dfilter()
+        if isinstance(data, dict):
+            # Kept as it is, so an ordered dictionary keeps its order.
+            result.data = data
+        else:
+            result._store(data)
+        result._owned = {}
+        if fresh or result.data is not data:
+            result._owned[id(result.data)] = result.data
+        # This Dfilter shares its subtrees now as well and has to copy
+        # them on write. Only a new top level container is not shared.
+        owned = self._owned
+        self._owned = {}
+        if fresh and (owned is None or id(self.data) in owned):
+            self._owned[id(self.data)] = self.data
+        return result
+
+    def _writable(self, path):
+        """Return the container at the path, ready to be changed.
+
+        Containers along the path that are shared with other Dfilter
+        objects are copied first (copy on write).
+
+        :param path: List of keys from the top level.
+
+        """
+        owned = self._owned
+        obj = self.data
+        if owned is None:
+            for key in path:
+                obj = obj[key]
+            return obj
+        hashes = self._hashes
+        if id(obj) not in owned:
+            hashes.discard(obj, children=False)
+            obj = self.data = shallow_copy(obj)
+            owned[id(obj)] = obj
+        for key in path:
+            child = obj[key]
+            if id(child) not in owned:
+                hashes.discard(child, children=False)
+                child = obj[key] = shallow_copy(child)
+                owned[id(child)] = child
+            obj = child
+        return obj
+
     def config(self, **kwargs):
         """Configure the Dfilter object.
 
@@ -71,6 +176,8 @@ class Dfilter(object):
                 candidate = str(kwargs[char])[0]
                 if candidate not in chars:
                     self.chars[char] = candidate
+        if self._results is not None:
+            self._results.clear()
         data_loaded = False
         if self.data:
             data_loaded = True
@@ -95,17 +202,36 @@ class Dfilter(object):
                 yield [item] + name, value
 
     def _iflatten(self, data):
-        """Place holder for a future supper fast implementation of flatten."""
-        return self._rflatten(data)
+        """Iterate over key-path and value without recursion.
+
+        Same as _rflatten() but the key-path is a tuple, see dfilter.walk.
+
+        :return: Iterator of tuple and value.
+
+        """
+        return iflatten(data)
 
     def flatten(self):
         """Flatten data to a 1-d dictionary."""
         out_data = odict()
-        for path, value in self._iflatten(self.data):
-            out_data[self.chars['separator'
-                                ].join([str(p) for p in path])] = value
+        for key, value in iflatten_keys(self.data, self.chars['separator']):
+            out_data[key] = value
         return Dfilter(out_data)
 
+    def flat_view(self):
+        """Return a lazy read only mapping with the keys of flatten().
+
+        Nothing is copied: view[key] walks the data along the key and
+        iterating streams the keys. The view always shows the current
+        data. dict(view) gives the dictionary flatten() holds.
+
+        >>> view = Dfilter({'a': {'b': [1, 2]}}).flat_view()
+        >>> view['a.b.1'], list(view)
+        (2, ['a.b.0', 'a.b.1'])
+
+        """
+        return FlatView(lambda: self.data, self.chars['separator'])
+
     def fold(self, as_str=False):
         """Values becomes the key of a 1-d dictionary and keys are lists.
 
@@ -113,37 +239,238 @@ class Dfilter(object):
 
         """
         out_data = odict()
-        for path, value in self._iflatten(self.data):
-            if as_str:
-                path_str = self.chars['separator'].join([str(p) for p in path])
+        if as_str:
+            separator = self.chars['separator']
+            for path_str, value in iflatten_keys(self.data, separator):
                 if value in out_data:
-                    if isinstance(out_data[value], str):
-                        out_data[value] = [out_data[value], path_str]
-                    else:
+                    if isinstance(out_data[value], list):
                         out_data[value].append(path_str)
+                    else:
+                        out_data[value] = [out_data[value], path_str]
                 else:
                     out_data[value] = path_str
-            else:
+        else:
+            for path, value in self._iflatten(self.data):
                 if value not in out_data:
                     out_data[value] = []
-                out_data[value].append(path)
+                out_data[value].append(list(path))
         return Dfilter(out_data)
 
-    def read_json(self, fh):
+    def locate(self, value, as_str=False):
+        """Return the paths where a leaf value occurs.
+
+        Unlike fold() the lookup is done on a reverse index that is built
+        once and kept until the data changes. Unhashable values can be
+        located too and the result is always a list.
+
+        :param as_str: Return the paths joined by the separator.
+        :return: List of paths, a path is a list of keys (or a string).
+
+        >>> Dfilter({'a': {'b': 3}, 'c': [3, 4]}).locate(3, as_str=True)
+        ['a.b', 'c.0']
+        >>> Dfilter({'a': {'b': 3}}).locate(5)
+        []
+
+        """
+        if not self._reverse.built:
+            self._reverse.build(self.data)
+        if as_str:
+            return self._reverse.locate(value, self.chars['separator'])
+        return self._reverse.locate(value)
+
+    def read_json(self, fh, query=None, fields=None, lines=None):
         """Read a file containing JSON formatted data.
 
+        With a query and/or fields the file is streamed, see stream_json(),
+        and only the selected items are kept in memory.
+
         :param fh: File handle or filename.
+        :param query: Filter dict, only keep the matching items.
+        :param fields: Only keep these fields of the items.
+        :param lines: True for JSON Lines, by default .jsonl and .ndjson
+                      filenames are read as JSON Lines.
 
         """
-        close_file = False
-        if isinstance(fh, str):
-            fh = open(fh, 'r')
-        self._store(json.loads(fh.read()))
-        if close_file:
-            fh.close()
+        if lines is None and isinstance(fh, basestring):
+            lines = fh.lower().endswith(LINES_EXTENSIONS)
+        if query is None and fields is None and not lines:
+            close_file = False
+            if isinstance(fh, basestring):
+                fh = open(fh, 'r')
+                close_file = True
+            self._store(json.loads(fh.read()))
+            if close_file:
+                fh.close()
+            return self
+
+        stream = JsonStream(fh, lines)
+        items = self._iter_stream(stream, query, fields)
+        if stream.kind == 'list':
+            self._store([item[1] for item in items])
+        else:
+            self._store(odict(items))
+        return self
 
+    def save_snapshot(self, filename):
+        """Write the data to a binary snapshot file, see open_snapshot().
+
+        :return: self
+
+        """
+        write_snapshot(self.data, filename)
         return self
 
+    def open_snapshot(self, filename):
+        """Use the data of a snapshot file made with save_snapshot().
+
+        The file is mapped into memory and nothing is read until it is
+        used: the top level items are lazy SnapshotDict/SnapshotList
+        views that decode a node when it is looked at. Processes that open
+        the same file share its memory. Changes are copied on write, the
+        file is never written to. snapshot.decode() turns a view into
+        plain dictionaries and lists.
+
+        :return: self
+
+        """
+        data = Snapshot(filename).root()
+        self.data = data
+        self._owned = {id(data): data}
+        self._data_changed()
+        return self
+
+    def compact(self):
+        """Store the dictionaries in the data as records to save memory.
+
+        Dictionaries with the same keys share one schema of the keys, a
+        record only holds a tuple of the values, see dfilter.record.
+        Records are read only dict like objects: filter(), spot(), fetch()
+        and items() work as before, set(), update() and delete() copy a
+        record to a dict before they change it.
+
+        >>> Dfilter([{'n': 1, 'm': 2}, {'m': 3, 'n': 4}]).compact().fetch('*.n')
+        [1, 4]
+
+        :return: self
+
+        """
+        data = self.data = compact(self.data)
+        self._owned = {id(data): data}
+        self._data_changed()
+        return self
+
+    def stream_json(self, fh, query=None, fields=None, lines=None):
+        """Iterate over the (key, value) items of a JSON file.
+
+        The top level array or object (or the lines of a JSON Lines file)
+        is decoded one item at a time, so memory use is bound by the
+        biggest item and not the size of the file. Nothing is stored.
+
+        :param fh: File handle or filename.
+        :param query: Filter dict, only yield the matching items.
+        :param fields: Only yield these fields of the items.
+        :param lines: True for JSON Lines, see read_json().
+        :return: Iterator of (key, value), keys are list positions for
+                 arrays and JSON Lines.
+
+        """
+        return self._iter_stream(JsonStream(fh, lines), query, fields)
+
+    def json_loader(self, lines=False, query=None, fields=None):
+        """Return a loader that JSON data can be pushed to in chunks.
+
+        For data that arrives bit by bit, eg. from an event loop: every
+        loader.feed(chunk) parses what it can without blocking and stores
+        the completed items, loader.close() ends the data.
+
+            loader = df.json_loader(query={'*.age': {'$gt': 20}})
+            for chunk in chunks:
+                loader.feed(chunk)
+            loader.close()
+
+        :param lines: True for JSON Lines.
+        :param query: Filter dict, only keep the matching items.
+        :param fields: Only keep these fields of the items.
+
+        """
+        return JsonLoader(self, lines, query, fields)
+
+    def ifilter(self, query, batch=None):
+        """Iterate over the (key, value) items that match the query.
+
+        With a batch size the matches come in lists, one (maybe empty)
+        list for every batch of items looked at. A caller in an event loop
+        can give other work a turn between the lists.
+
+        >>> list(Dfilter([{'n': 1}, {'n': 2}, {'n': 3}]).ifilter(
+        ...     {'*.n': {'$ne': 2}}, batch=2))
+        [[(0, {'n': 1})], [(2, {'n': 3})]]
+
+        """
+        query = compile_query(query, self.chars)
+        match_item = query.match_item
+
+        def process(key, value):
+            if match_item(key, value):
+                return key, value
+        return self._scan(process, batch)
+
+    def ifields(self, fields, batch=None):
+        """Iterate over the (key, value) items with only the fields.
+
+        Like fields(), with batches like ifilter().
+
+        """
+        project_item = self._field_trie(fields).project_item
+
+        def process(key, value):
+            projected = project_item(key, value)
+            if key in projected:
+                return key, projected[key]
+        return self._scan(process, batch)
+
+    def _scan(self, process, batch):
+        """Yield what process(key, value) returns for the items, but None.
+
+        With a batch size yield a list of the results for every batch.
+
+        """
+        if not batch:
+            for key, value in self.items():
+                found = process(key, value)
+                if found is not None:
+                    yield found
+            return
+        out = []
+        count = 0
+        for key, value in self.items():
+            found = process(key, value)
+            if found is not None:
+                out.append(found)
+            count += 1
+            if count == batch:
+                yield out
+                out = []
+                count = 0
+        if count:
+            yield out
+
+    def _iter_stream(self, stream, query, fields):
+        if query is not None:
+            query = compile_query(query, self.chars)
+        trie = None
+        if fields is not None:
+            trie = self._field_trie(fields)
+        for key, value in stream:
+            if query is not None and not query.match_item(key, value):
+                continue
+            if trie is not None:
+                projected = trie.project_item(key, value)
+                if key not in projected:
+                    continue
+                value = projected[key]
+            yield key, value
+
     def _store(self, data):
         """Internal method to store the new data."""
         ## I really want to do json.loads(json.dumps(data))
@@ -153,8 +480,310 @@ class Dfilter(object):
             self.data = data
             #self.data.update(dict([(str(n[0]), n[1])
             #                       for n in enumerate(data)]))
+        self._data_changed()
+
+    def _data_changed(self):
+        """Internal method to drop everything derived from the data."""
+        self._version += 1
+        for indexes in self._indexes.values():
+            for index in indexes:
+                index.invalidate()
+        self._reverse.invalidate()
+        self._hashes.clear()
+        if self._keys is not None:
+            self._keys.invalidate()
+        if self._results is not None:
+            self._results.clear()
+
+    @property
+    def version(self):
+        """Number that changes every time the data is changed."""
+        return self._version
+
+    def set(self, path, value):
+        """Set the value at a path.
+
+        The path uses the syntax of spot(), every match of a wildcard or
+        a choice is set. A missing last key of a dictionary is added,
+        list positions have to exist.
+
+        >>> Dfilter([{'n': 1}, {'m': 2}]).set('*.n', 0).values()
+        [{'n': 0}, {'m': 2, 'n': 0}]
+
+        :return: self
+
+        """
+        container = isinstance(value, (dict, list))
+        for parent_path, key in self._targets(path, create=True):
+            if container:
+                # Every match gets its own copy of a container, later
+                # writes do not change the value of the caller.
+                self._assign(parent_path, key, copy.deepcopy(value))
+            else:
+                self._assign(parent_path, key, value)
+        self._version += 1
+        return self
+
+    def update(self, path, func):
+        """Replace every value at the path with func(value).
+
+        func should return a new value and not change the one it gets,
+        that value may be shared with other Dfilter objects.
+
+        >>> Dfilter([{'n': 1}, {'n': 2}]).update('*.n', lambda n: n * 10
+        ...                                      ).values()
+        [{'n': 10}, {'n': 20}]
+
+        :return: self
+
+        """
+        for parent_path, key in self._targets(path):
+            obj = self.data
+            for step in parent_path:
+                obj = obj[step]
+            self._assign(parent_path, key, func(obj[key]))
+        self._version += 1
+        return self
+
+    def delete(self, path):
+        """Remove every value at the path.
+
+        >>> Dfilter({'a': [1, 2, 3]}).delete('a.[0, 2]').data
+        {'a': [2]}
+
+        :return: self
+
+        """
+        order = []
+        parents = {}
+        for parent_path, key in self._targets(path):
+            marker = tuple(parent_path)
+            if marker not in parents:
+                parents[marker] = []
+                order.append(marker)
+            parents[marker].append(key)
+        for marker in order:
+            # From the back, so list positions still to delete stay put.
+            for key in sorted(set(parents[marker]), reverse=True):
+                self._remove(list(marker), key)
+        self._version += 1
+        return self
+
+    def _targets(self, path, create=False):
+        """Return the (parent path, key) pairs a path points at."""
+        plan = self._plan(path)
+        last = plan.steps[-1]
+        keys = last.new_keys if create else last.keys
+        targets = [(parent_path, key)
+                   for parent_path, parent in plan.parents(self.data)
+                   for key in keys(parent)]
+        # A '**' can match inside another match, the inner ones go first
+        # so the outer paths still point at the same places.
+        targets.sort(key=lambda target: -len(target[0]))
+        return targets
+
+    def _index_values(self, key):
+        """Return [index, values] of the built indexes for an item.
+
+        Values is None when there is no item with the key yet.
+
+        """
+        out = []
+        exists = isinstance(self.data, list) or key in self.data
+        for indexes in self._indexes.values():
+            for index in indexes:
+                if index.built:
+                    out.append([index, index.values(key, self.data[key])
+                                if exists else None])
+        return out
+
+    def _reindex(self, key, before):
+        """Update the indexes for an item after it changed."""
+        for index, old_values in before:
+            new_values = index.values(key, self.data[key])
+            try:
+                if old_values is None:
+                    index.append_item(key, new_values)
+                else:
+                    index.update_item(index.position(key), old_values,
+                                      new_values)
+            except TypeError:
+                # Values that can not be compared in a sorted index.
+                index.invalidate()
+
+    def _assign(self, parent_path, key, value):
+        item_key = parent_path[0] if parent_path else key
+        before = self._index_values(item_key)
+        parent = self._writable(parent_path)
+        prefix = tuple(parent_path) + (key,)
+        reverse = self._reverse
+        if isinstance(parent, list) or key in parent:
+            if reverse.built:
+                reverse.remove(prefix, parent[key])
+            self._hashes.discard(parent[key])
+        parent[key] = value
+        if reverse.built:
+            reverse.add(prefix, value)
+        self._hashes.forget(self.data, parent_path)
+        if self._keys is not None:
+            self._keys.invalidate()
+        self._reindex(item_key, before)
+
+    def _remove(self, parent_path, key):
+        reverse = self._reverse
+        if not parent_path:
+            # Positions of the items after it change, rebuild indexes.
+            if reverse.built:
+                if isinstance(self.data, dict):
+                    reverse.remove((key,), self.data[key])
+                else:
+                    reverse.invalidate()
+            self._hashes.discard(self.data[key])
+            del self._writable([])[key]
+            self._hashes.forget(self.data, [])
+            if self._keys is not None:
+                self._keys.invalidate()
+            for indexes in self._indexes.values():
+                for index in indexes:
+                    index.invalidate()
+            return
+        item_key = parent_path[0]
+        before = self._index_values(item_key)
+        parent = self._writable(parent_path)
+        prefix = tuple(parent_path)
+        self._hashes.discard(parent[key])
+        if reverse.built and isinstance(parent, list):
+            # The paths of the later list elements shift.
+            reverse.remove(prefix, parent)
+            del parent[key]
+            reverse.add(prefix, parent)
+        else:
+            if reverse.built:
+                reverse.remove(prefix + (key,), parent[key])
+            del parent[key]
+        self._hashes.forget(self.data, parent_path)
+        if self._keys is not None:
+            self._keys.invalidate()
+        self._reindex(item_key, before)
+
+    def enable_cache(self, maxsize=128):
+        """Keep the results of filter(), fetch() and fields().
+
+        Results are kept on the normalized query and the version of the
+        data, so set(), update() and delete() make them stale and
+        read_json() or clean() drop them. The least recently used results
+        are dropped when there are more than maxsize. Every call returns a
+        copy on write of the kept result, changes to it do not reach the
+        cache. Changes made directly to the data are not seen.
+
+        :return: self
+
+        """
+        self._results = LRUCache(maxsize)
+        return self
+
+    def disable_cache(self):
+        self._results = None
+        return self
+
+    def cache_info(self):
+        """Return the hits, misses, evictions and size of the cache."""
+        if self._results is None:
+            return None
+        return self._results.info()
+
+    def _cached(self, key, compute):
+        """Return compute(), from the result cache when it is enabled."""
+        cache = self._results
+        if cache is None:
+            return compute()
+        key = key + (self._version,)
+        found = cache.get(key, _MISSING)
+        if found is _MISSING:
+            found = compute()
+            cache.put(key, found)
+        if isinstance(found, Dfilter):
+            return found.copy()
+        return found
+
+    def create_index(self, path, kind='hash'):
+        """Create an index that filter() uses when a test matches the path.
+
+        The path is relative to the top level, like filter paths, eg. '*.age'.
+
+        Index kinds:
+            hash   - Used for $eq and $in.
+            sorted - Used for $eq, $in, $lt, $lte, $gt and $gte.
+            text   - Used for $text, see create_text_index().
+
+        Indexes are kept up to date by set(), update() and delete() and
+        rebuilt after the data is replaced with read_json() or clean().
+        Changes made directly to the data are not seen.
+
+        :return: self
+
+        """
+        index = make_index(path, kind, dict(self.chars))
+        indexes = [i for i in self._indexes.get(path, []) if i.kind != kind]
+        indexes.append(index.build(self.data))
+        self._indexes[path] = indexes
+        return self
+
+    def create_text_index(self, path):
+        """Create an inverted word index for $text tests on the path.
 
-    def fields(self, fields):
+        eg.: create_text_index('*.name') then filter({'*.name': {'$text':
+        'south africa'}}) looks up the items holding both words.
+
+        :return: self
+
+        """
+        return self.create_index(path, kind='text')
+
+    def create_key_index(self):
+        """Index the dictionaries holding every key name.
+
+        spot() and fetch() of paths like '**.id' then go straight to the
+        dictionaries holding 'id' instead of walking all the data. The
+        index is built on first use and again after the data changed.
+
+        :return: self
+
+        """
+        self._keys = KeyIndex()
+        return self
+
+    def drop_key_index(self):
+        self._keys = None
+        return self
+
+    def _located(self, plan):
+        """Return the [path, value] pairs of plan, from the key index.
+
+        Returns None when the key index can not answer the plan.
+
+        """
+        index = self._keys
+        if index is None or not plan.head.descendant or \
+                len(plan.steps) < 2 or type(plan.steps[1]) is not KeyStep:
+            return None
+        if not index.built:
+            index.build(self.data)
+        name = plan.steps[1].name
+        # '**' selects from one level down, like '*', so not the top.
+        found = [[path + [name], obj[name]]
+                 for path, obj in index.containers(name) if path]
+        return plan.run_from(found, 2)
+
+    def drop_index(self, path, kind=None):
+        """Remove the index (or all indexes when kind is None) of the path."""
+        indexes = [i for i in self._indexes.pop(path, [])
+                   if kind is not None and i.kind != kind]
+        if indexes:
+            self._indexes[path] = indexes
+        return self
+
+    def fields(self, fields, workers=None):
         """Return only the selected fields. Preserving list order.
 
         eg.: {'a':1, 'b': {'c': ['1', {'d': '3'}, 2]}}
@@ -167,57 +796,60 @@ class Dfilter(object):
         fields = ['b.c.1.d']  # Not the convertsion of list to dict.
         >> {'b': {'c': {1: {'d': '3'}}}}
 
+        :param workers: Split the work over this number of processes.
         :return: Dfilter object.
 
         """
-        if isinstance(fields, str):
-            fields = [fields]
-
-        #if isinstance(self.data, dict):
-        new_data = {}
-        for field in fields:
-            for item in self.spot(field):
-                key_data = new_data
-                for key in item[0][:-1]:
-                    if key not in key_data:
-                        key_data[key] = {}
-                    key_data = key_data[key]
-                key_data[item[0][-1]] = item[1]
-
+        return self._cached(('fields', canonical(fields)),
+                            lambda: self._fields(fields, workers))
+
+    def _fields(self, fields, workers):
+        trie = self._field_trie(fields)
+        if workers and workers > 1:
+            found = self._parallel('fields', trie, workers)
+            if isinstance(self.data, list):
+                return self._result([item[1] for item in found])
+            return self._result(odict(found))
         if isinstance(self.data, list):
-            return Dfilter([new_data[n] for n in new_data])
-        #    new_data = []
-        #    for field in fields:
-        #        for item in self.spot(field):
-        #            #key_data = new_data
-        #            #for key in item[0][:-1]:
-        #            #    if key not in key_data:
-        #            #        key_data[key] = {}
-        #            #    key_data = key_data[key]
-        #            #key_data[item[0][-1]] = item[1]
-        #            new_data.append(item[1])
-        #else:
-        #    return None
+            new_data = []
+            for key, value in enumerate(self.data):
+                projected = trie.project_item(key, value)
+                if key in projected:
+                    new_data.append(projected[key])
         else:
-            return Dfilter(new_data)
+            new_data = odict()
+            for key in self.data:
+                new_data.update(trie.project_item(key, self.data[key]))
+        return self._result(new_data)
+
+    def _parallel(self, task, compiled, workers):
+        """Run a task of dfilter.parallel and merge the results in order.
+
+        :return: List of values for fetch, else list of (key, value).
+
+        """
+        items = list(self.items())
+        merged = []
+        for start, found in parallel.run(task, compiled, items, workers):
+            if task == 'fetch':
+                merged.extend(found)
+            elif task == 'filter':
+                merged.extend([items[start + p] for p in found])
+            else:
+                merged.extend([(items[start + p][0], value)
+                               for p, value in found])
+        return merged
+
+    def _field_trie(self, fields):
+        """Return the compiled PathTrie of a field or a list of fields."""
+        return compile_fields(fields, self.chars)
 
     def _filter_func(self, name):
-        name = name.strip('$')
-        if hasattr(operator, name):
-            return getattr(operator, name)
-        elif name == 'in':
-            return lambda a, b: a in b
-        elif name == 'nin':
-            return lambda a, b: a not in b
-        elif name == 'all':
-            return lambda a, b: all([a in bb for bb in b])
-        elif name == 'mod':
-            return lambda a, b: a % b[0] == b[1]
-        elif name == 'exists':
-            return lambda a, b: (b and a is not None) or (a is None and not b)
-        else:
-            # Hope nobody ever gets here.
-            return lambda a, b: False
+        return binary_operator(name)
+
+    def _plan(self, path):
+        """Return the compiled plan of the path for the configured chars."""
+        return compile_path(path, self.chars)
 
     def _Ifetch(self, data, path):
         #return dpath.util.search(data, path, yielded=True,
@@ -225,12 +857,13 @@ class Dfilter(object):
         return self.spot(path, data=data)
 
     def _evaluate(self, data, path, oper, comp):
-        for item in self._Ifetch(data, path):
-            if self._filter_func(oper)(item[1], comp):
+        func = self._filter_func(oper)
+        for value in self._plan(path).values(data):
+            if func(value, comp):
                 return True
         return False
 
-    def fetch(self, query, default=None):
+    def fetch(self, query, default=None, workers=None):
         """Smarter get.
 
         eg.: {'a': 1, 'b': {'c': ['1', {'d': '3'}, 2]}}
@@ -241,56 +874,224 @@ class Dfilter(object):
         query = 'b.c.*.d'
         >> 3
 
+        With workers the items are searched by that number of processes.
+
         """
         #return dpath.util.search(self.data, query,
         #                         separator=self.chars['separator'])
-        from_spot = self.spot(query)
-        if not from_spot:
-            return default
-        items = list([i[1] for i in self.spot(query)])
+        return self._cached(('fetch', query, canonical(default)),
+                            lambda: self._fetch(query, default, workers))
+
+    def _fetch(self, query, default, workers):
+        plan = self._plan(query)
+        found = self._located(plan)
+        if found is not None:
+            items = [pair[1] for pair in found]
+        elif workers and workers > 1:
+            items = self._parallel('fetch', plan, workers)
+        else:
+            items = plan.values(self.data)
+        return self._fetched(items, default)
+
+    def fetch_many(self, paths, default=None):
+        """Fetch several paths in one walk over the data.
+
+        Paths that start with the same steps share the walk over them.
+
+        >>> df = Dfilter({'a': {'b': 1, 'c': [2, 3]}})
+        >>> found = df.fetch_many(['a.b', 'a.c.*', 'a.x'], default=0)
+        >>> found['a.b'], found['a.c.*'].values(), found['a.x']
+        (1, [2, 3], 0)
+
+        :return: Dict of path: what fetch() returns for the path.
+
+        """
+        if isinstance(paths, basestring):
+            paths = [paths]
+        found = self._field_trie(paths).values(self.data)
+        return dict([(path, self._fetched(items, default))
+                     for path, items in zip(paths, found)])
+
+    def _fetched(self, items, default):
         if len(items) == 0:
             return default
         elif len(items) == 1:
-            if type(items[0]) in [list, dict]:
-                return Dfilter(items[0])
+            if isinstance(items[0], (dict, list)):
+                return self._result(items[0], fresh=False)
+            elif is_container(items[0]):
+                # Records and other read only containers, the result gets
+                # a dict or list of their children.
+                return self._result(shallow_copy(items[0]))
             else:
                 return items[0]
         else:
-            return Dfilter(items)
-
-    def filter(self, query):
-        """Query is a filter dict like in mongodb."""
-        tests = []
-        for key in query:
-            print key
-            value = query[key]
-            if isinstance(value, str) or isinstance(value, unicode):
-                op = '$eq'
-                val = value
-            else:
-                op = [n for n in value if n.startswith('$')]
-                if len(op) > 0:
-                    op = op[0]
-                    val = value[op]
-                else:
-                    print "NOP", value, op
-            if key and op:
-                tests.append((key, op, val))
+            return self._result(items)
 
-        selected_items = []
-        if isinstance(self.data, list):
-            sequence = range(len(self.data))
+    def lazy(self):
+        """Return a lazy Pipeline over the items of this Dfilter.
+
+        Stages are only run when the pipeline is iterated or collected,
+        in one pass, and limit()/first() stop as soon as they are met.
+
+        eg.: df.lazy().filter({'*.age': {'$lt': 50}}).fields('*.name'
+                                                           ).limit(10).collect()
+
+        """
+        return Pipeline(self)
+
+    def lazy_json(self, fh, lines=None):
+        """Return a lazy Pipeline over the items of a JSON file.
+
+        The file is streamed, see stream_json(), so a pipeline that
+        filters, groups or counts uses memory for the current item and the
+        groups only. The pipeline reads the file once and can only be run
+        once.
+
+        eg.: df.lazy_json('big.jsonl').group('*.country',
+                                             {'n': {'$count': {}}}).collect()
+
+        """
+        stream = JsonStream(fh, lines)
+        return Pipeline(self, lambda: stream, stream.kind)
+
+    def group(self, by, accumulators=None):
+        """Group the items on the value of a path, in a single pass.
+
+        Returns a list with a {'_id': value, name: result, ...} dict per
+        group, see aggregate.GroupStage for the accumulators.
+
+        >>> df = Dfilter({'a': {'k': 1}, 'b': {'k': 2}, 'c': {'k': 1}})
+        >>> sorted([(g['_id'], g['n']) for g in
+        ...         df.group('*.k', {'n': {'$count': {}}}).values()])
+        [(1, 2), (2, 1)]
+
+        """
+        return self.lazy().group(by, accumulators).collect()
+
+    def unwind(self, path):
+        """Return an item for every element of the list at the path.
+
+        >>> Dfilter([{'tags': ['a', 'b']}]).unwind('*.tags').values()
+        [{'tags': 'a'}, {'tags': 'b'}]
+
+        """
+        return self.lazy().unwind(path).collect()
+
+    def aggregate(self, stages):
+        """Run a Mongo style list of stages, see Pipeline.aggregate().
+
+        eg.: df.aggregate([{'$unwind': '*.tags'},
+                           {'$group': {'_id': '*.tags', 'n': {'$sum': 1}}},
+                           {'$sort': '-*.n'}, {'$limit': 10}])
+
+        """
+        return self.lazy().aggregate(stages).collect()
+
+    def columnar(self, paths=None):
+        """Return a Columnar view for vectorized filters, needs numpy.
+
+        Meant for lists of records that share their keys, values of a path
+        like '*.population' are stored in one NumPy array. See
+        dfilter.columnar.
+
+        :param paths: Paths to build columns for now, others are built
+                      when first used.
+
+        """
+        return Columnar(self, paths)
+
+    def compile_query(self, query):
+        """Compile a filter dict so it can be reused, see filter().
+
+        The compiled query uses the configured chars and is not bound to
+        this data, it can be used on other Dfilter objects as well.
+
+        """
+        return compile_query(query, self.chars)
+
+    def filter(self, query, workers=None):
+        """Query is a filter dict like in mongodb.
+
+        eg.: {'*.name': 'foo', '*.age': {'$lt': 50}}
+
+        Supported operators: $eq, $ne, $lt, $lte, $gt, $gte, $in, $nin,
+        $all, $mod, $exists, $contains, $regex (with $options), $text,
+        $not, $and, $or and $nor.
+
+        $regex searches strings with a python regular expression. $text
+        matches strings that hold every word of the operand, ignoring
+        case.
+
+        Indexes made with create_index() are used when they match a test.
+        With enable_cache() repeated filters are answered from the cache,
+        unless explain hooks are set.
+
+        :param query: Filter dict or a query from compile_query().
+        :param workers: Split the scan over this number of processes.
+        :return: Dfilter object.
+
+        """
+        recorder = explain.recorder()
+        if recorder is not None:
+            result = self._filter(query, workers, recorder)
+            explain.emit(recorder.result)
+            return result
+        if isinstance(query, Query):
+            key = canonical((query.query, query.chars))
+        else:
+            key = canonical(query)
+        return self._cached(('filter', key),
+                            lambda: self._filter(query, workers))
+
+    def explain(self, query):
+        """Run the filter with counters and return a report dict.
+
+        The report holds the number of items, index candidates and
+        matches, the time of the compile, index, match and result stages
+        and the plan: the compiled query tree with per node the nodes
+        visited, the candidates after every path step and the predicate
+        calls. See explain.py.
+
+        """
+        recorder = explain.Recorder(trace=True)
+        self._filter(query, None, recorder)
+        return recorder.result
+
+    def _filter(self, query, workers=None, recorder=None):
+        query = compile_query(query, self.chars)
+        keys = None
+        if recorder is not None:
+            recorder.lap('compile')
+        if self._indexes:
+            keys = index_candidates(query, self._indexes, self.data)
+            if recorder is not None:
+                recorder.lap('index')
+        candidates = None if keys is None else len(keys)
+        if recorder is not None and recorder.trace:
+            match_item = recorder.match_function(query)
+            if keys is None:
+                keys = [item[0] for item in self.items()]
+            selected_items = [k for k in keys if match_item(k, self.data[k])]
+        elif keys is None and workers and workers > 1:
+            selected_items = [item[0] for item in
+                              self._parallel('filter', query, workers)]
+        elif keys is None:
+            selected_items = list(query.select(self.data))
         else:
-            sequence = self.data.keys()
-        for item in sequence:
-            if all([self._evaluate({item: self.data[item]},
-                                   test[0], test[1], test[2])
-                    for test in tests]):
-                selected_items.append(item)
+            selected_items = [k for k in keys
+                              if query.match_item(k, self.data[k])]
+        if recorder is not None:
+            recorder.lap('match')
         if isinstance(self.data, list):
-            return Dfilter([self.data[k] for k in selected_items])
+            result = self._result([self.data[k] for k in selected_items])
         else:
-            return Dfilter(odict([(k, self.data[k]) for k in selected_items]))
+            result = self._result(odict([(k, self.data[k])
+                                         for k in selected_items]))
+        if recorder is not None:
+            recorder.lap('result')
+            recorder.result = recorder.report(
+                query, len(self.data), candidates, len(selected_items))
+        return result
 
     def count(self):
         count = 0
@@ -302,7 +1103,7 @@ class Dfilter(object):
         return self.data.__repr__()
 
     def __str__(self):
-        return json.dumps(self.data, indent=4)
+        return json.dumps(self.data, indent=4, default=json_default)
         #return str(self.data)
 
     def values(self, sort=False):
@@ -358,12 +1159,66 @@ class Dfilter(object):
         ['dan', 'phil']
 
         """
-        values = set(self.values())
+        values = self.values()
+        try:
+            values = set(values)
+        except TypeError:
+            # Dictionaries and lists are told apart by their digests.
+            values = merkle.unique(values, self._hashes)
         if sort:
             return sorted(list(values))
         else:
             return list(values)
 
+    def digest(self):
+        """Return the structural hash of the data as a hex string.
+
+        Equal data gives an equal digest, whatever the dictionary order.
+        Digests of subtrees are cached until they are changed.
+
+        """
+        return self._hashes.hexdigest(self.data)
+
+    def equals(self, other):
+        """Return True when other (a Dfilter or data) holds equal data.
+
+        >>> Dfilter({'a': [1, {'b': 2}]}).equals({'a': [1, {'b': 2}]})
+        True
+
+        """
+        if isinstance(other, Dfilter):
+            other_hashes, other = other._hashes, other.data
+        else:
+            other_hashes = merkle.HashCache()
+        return self._hashes.digest(self.data) == other_hashes.digest(other)
+
+    def diff(self, other, as_str=False):
+        """Return the changes that turn this data into the other data.
+
+        Every change is a dict with the path, the op (add, remove or
+        change) and the old and/or new value. Subtrees that are equal in
+        both are skipped on their digests.
+
+        >>> changes = Dfilter({'a': 1, 'b': [1, 2]}).diff({'a': 1, 'b': [1, 3]},
+        ...                                                as_str=True)
+        >>> [(c['path'], c['op'], c['old'], c['new']) for c in changes]
+        [('b.1', 'change', 2, 3)]
+
+        :param other: Dfilter or data.
+        :param as_str: Return the paths joined by the separator.
+
+        """
+        if isinstance(other, Dfilter):
+            other_hashes, other = other._hashes, other.data
+        else:
+            other_hashes = merkle.HashCache()
+        changes = merkle.diff(self.data, other, self._hashes, other_hashes)
+        if as_str:
+            for change in changes:
+                change['path'] = join_path(change['path'],
+                                           self.chars['separator'])
+        return changes
+
     def limit(self, number=100):
         """Return the up to the number of items.
 
@@ -432,12 +1287,45 @@ class Dfilter(object):
             else:
                 items = dict(self.data.items()[start:end])
 
-        return Dfilter(items)
+        return self._result(items)
+
+    def sort(self, fields=None, func=None, limit=None):
+        """Return the items sorted on the values of fields.
 
-    def sort(self, fields=None, func=None):
-        #TODO(Martin): Order based on fields not keys.
-        return Dfilter(odict([(k, self.data[k])
-                              for k in sorted(self.data)]))
+        Fields are paths like '*.age', a leading '-' sorts that field
+        descending. Items without a value for a field sort last. Without
+        fields a dict is sorted on its keys and a list on its values, or
+        on func(value) when a func is given.
+
+        Params
+        ------
+            fields: string or list of strings
+            func: Function that returns the sort key of a value.
+            limit: Only return this many items, selected without sorting
+                   all of them.
+
+        >>> Dfilter([{'n': 3}, {'n': 1}, {'n': 2}]).sort('*.n').values()
+        [{'n': 1}, {'n': 2}, {'n': 3}]
+        >>> Dfilter([{'n': 3}, {'n': 1}, {'n': 2}]).sort('-*.n', limit=1)
+        [{'n': 3}]
+
+        """
+        if fields is not None:
+            items = sort_items(self.items(), fields, self.chars, limit)
+        else:
+            if func is not None:
+                sort_key = lambda item: func(item[1])
+            elif isinstance(self.data, list):
+                sort_key = lambda item: item[1]
+            else:
+                sort_key = lambda item: item[0]
+            if limit is not None:
+                items = heapq.nsmallest(limit, self.items(), key=sort_key)
+            else:
+                items = sorted(self.items(), key=sort_key)
+        if isinstance(self.data, list):
+            return self._result([item[1] for item in items])
+        return self._result(OrderedDict(items))
 
     def get(self, key, default=None):
         """Return the value for the given key or the default value.
@@ -521,72 +1409,55 @@ class Dfilter(object):
         else:
             return enumerate(self.data)
 
+    def __getstate__(self):
+        # Digests are cached by id, they are hashed again after loading.
+        return dict([(name, getattr(self, name)) for name in self.__slots__
+                     if name != '_hashes'])
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._hashes = merkle.HashCache()
+        if self._owned is not None:
+            # The owned containers are new objects with new ids.
+            self._owned = dict([(id(obj), obj)
+                                for obj in self._owned.values()])
+
     def __getattr__(self, name):
         # Being a bit more restrictive at the moment.
         # Only support reading from internal DB.
         #if hasattr(self.data, name):
         if name in ['get', 'keys']:
             return getattr(self.data, name)
+        raise AttributeError(name)
 
     def _unpack_step(self, step, obj):
-        step = str(step)
-        cwildcard = '*'
-        clistopen = '['
-        clistclose = ']'
-        clistseparator = ','
-        if not (isinstance(obj, list) or isinstance(obj, dict)):
-            return []
-        if step == cwildcard:
-            if isinstance(obj, dict):
-                return obj.keys()
-            elif isinstance(obj, list):
-                return range(len(obj))
-            else:
-                return []
-        elif step.isdigit():
-            if isinstance(obj, list):
-                istep = int(step)
-                return [int(step)] if istep < len(obj) else []
-            else:
-                return [step, int(step)]
-        elif step.startswith(clistopen) and step.endswith(clistclose):
-            out = []
-            for s1 in step[1:-1].split(clistseparator):
-                for s2 in self._unpack_step(s1.strip(), obj):
-                    out.append(s2)
-            return list(set(out))
-        else:
-            if isinstance(obj, dict) and step in obj:
-                return [step]
-            else:
-                return []
+        """Return the keys of obj selected by a single path step.
+
+        For '**' the key paths (lists) of everything below obj.
+
+        """
+        step = compile_step(step, self.chars)
+        if step.descendant:
+            return step.paths(obj)
+        return step.keys(obj)
 
     def spot(self, path, data=None):
+        """Iterate over the [path, value] pairs that match the path.
+
+        The path is compiled once and cached, see dfilter.path. A '**'
+        step selects everything below, at any depth, eg. '**.id' finds
+        every 'id' key.
+
+        """
         if data is None:
+            found = self._located(self._plan(path))
+            if found is not None:
+                return iter(found)
             data = self.data
-        separator = self.chars['separator']
-        path = str(path).split(separator)
-        objs = [[[], data]]
-        for step in path:
-            new_objs = []
-            for obj in objs:
-                if not obj or len(obj) < 2:
-                    continue
-                potential_steps = self._unpack_step(step, obj[1])
-                for ps in potential_steps:
-                    if isinstance(obj[1], dict):
-                        if ps not in obj[1]:
-                            continue
-                        new_objs.append([obj[0] + [ps], obj[1][ps]])
-                    elif isinstance(obj[1], list):
-                        new_objs.append([obj[0] + [ps], obj[1][ps]])
-            objs = new_objs
-        for obj in objs:
-            yield obj
+        return iter(self._plan(path).run(data))
 
 ### Sugestions:
-# Unwind: Dict with lists, become lists with dicts.
-# Group: add a extra layer to dict where similar dicts are in the dict...
 # skip:
 # limit:
 
@@ -0,0 +1,200 @@
+"""Explain how a filter runs and report filter metrics to hooks.
+
+Dfilter.explain(query) runs the filter with counters on every node of
+the compiled query and returns a report dict:
+
+    >>> from dfilter import Dfilter
+    >>> df = Dfilter({'a': {'n': 1}, 'b': {'n': 5}, 'c': {'m': 2}})
+    >>> report = df.explain({'*.n': {'$gt': 2}})
+    >>> report['matched'], report['plan']['predicate_calls']
+    (1, 2)
+    >>> [step['candidates'] for step in report['plan']['steps']]
+    [3, 2]
+
+Hooks are called with the same report after every filter(). Without
+hooks filter() runs as it always did, the only cost is one test of the
+hooks list:
+
+    >>> reports = []
+    >>> add_hook(reports.append)
+    >>> result = df.filter({'*.n': 5})
+    >>> remove_hook(reports.append)
+    >>> reports[0]['matched'], 'plan' in reports[0]
+    (1, False)
+
+Hooks added with trace=True get the per node counters too, and make
+every filter() run the slower instrumented match.
+
+"""
+
+import copy
+import time
+
+from .query import And, Condition, Exists, Nor, Or
+
+try:
+    timer = time.perf_counter
+except AttributeError:
+    timer = time.time
+
+# (callback, trace) pairs.
+hooks = []
+
+
+def add_hook(callback, trace=False):
+    """Call callback(report) after every filter().
+
+    :param trace: Also count nodes, candidates and predicate calls.
+
+    """
+    hooks.append((callback, trace))
+
+
+def remove_hook(callback):
+    hooks[:] = [hook for hook in hooks if hook[0] != callback]
+
+
+class ConditionTrace(object):
+
+    """Count the work of a Condition, mirrors Condition.match_item()."""
+
+    def __init__(self, node):
+        self.node = node
+        self.plan = node.plan
+        self.candidates = [0] * len(node.plan.steps)
+        self.evaluated = 0
+        self.matched = 0
+        self.nodes_visited = 0
+        self.predicate_calls = 0
+
+    def match_item(self, key, value):
+        self.evaluated += 1
+        found = []
+        plan = self.plan
+        if plan.head.matches_key(key):
+            found = [value]
+            if plan.head.descendant:
+                found = [pair[1] for pair in plan._item(key, value)]
+            self.candidates[0] += 1
+            self.nodes_visited += 1
+            for position, step in enumerate(plan.tail):
+                found = step.walk_values(found)
+                self.candidates[position + 1] += len(found)
+                self.nodes_visited += len(found)
+                if not found:
+                    break
+        node = self.node
+        if isinstance(node, Exists):
+            result = bool(found) == bool(node.operand)
+        else:
+            result = False
+            for item in found:
+                self.predicate_calls += 1
+                if node.predicate(item):
+                    result = True
+                    break
+        if result:
+            self.matched += 1
+        return result
+
+    def report(self):
+        node = self.node
+        return {'node': type(node).__name__,
+                'path': node.path,
+                'op': node.op,
+                'operand': node.operand,
+                'evaluated': self.evaluated,
+                'matched': self.matched,
+                'nodes_visited': self.nodes_visited,
+                'predicate_calls': self.predicate_calls,
+                'steps': [{'step': repr(step), 'candidates': count}
+                          for step, count in zip(self.plan.steps,
+                                                 self.candidates)]}
+
+
+class GroupTrace(object):
+
+    """Count the work of And/Or/Nor, the node logic is reused as is."""
+
+    def __init__(self, node):
+        self.node = copy.copy(node)
+        self.children = [trace(child) for child in node.children]
+        self.node.children = self.children
+        self.evaluated = 0
+        self.matched = 0
+
+    def match_item(self, key, value):
+        self.evaluated += 1
+        result = self.node.match_item(key, value)
+        if result:
+            self.matched += 1
+        return result
+
+    def report(self):
+        children = [child.report() for child in self.children]
+        return {'node': type(self.node).__name__,
+                'evaluated': self.evaluated,
+                'matched': self.matched,
+                'nodes_visited': sum([c['nodes_visited'] for c in children]),
+                'predicate_calls': sum([c['predicate_calls']
+                                        for c in children]),
+                'children': children}
+
+
+def trace(node):
+    """Return the counting wrapper of a compiled query node."""
+    if isinstance(node, Condition):
+        return ConditionTrace(node)
+    elif isinstance(node, (And, Or, Nor)):
+        return GroupTrace(node)
+    raise TypeError('Can not trace {0!r}'.format(node))
+
+
+class Recorder(object):
+
+    """Collect the timings (and with trace the counters) of one filter."""
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.tracer = None
+        self.result = None
+        self.times = {}
+        self.started = self.last = timer()
+
+    def lap(self, stage):
+        """Add the time since the previous lap to the stage."""
+        now = timer()
+        self.times[stage] = self.times.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def match_function(self, query):
+        """Return the match_item() to use for the compiled query."""
+        if not self.trace:
+            return query.match_item
+        self.tracer = trace(query.root)
+        return self.tracer.match_item
+
+    def report(self, query, items, candidates, matched):
+        times = dict(self.times)
+        times['total'] = self.last - self.started
+        out = {'query': query.query,
+               'items': items,
+               'candidates': candidates,
+               'matched': matched,
+               'used_index': candidates is not None,
+               'time': times}
+        if self.tracer is not None:
+            out['plan'] = self.tracer.report()
+        return out
+
+
+def recorder():
+    """Return a Recorder when hooks are set, None when there are none."""
+    if not hooks:
+        return None
+    return Recorder(trace=any([hook[1] for hook in hooks]))
+
+
+def emit(report):
+    for callback, trace_hook in list(hooks):
+        callback(report)
@@ -0,0 +1,276 @@
+"""Secondary indexes on the top level items of a Dfilter.
+
+An index maps the values found by a path (relative to the top level, like
+a filter path '*.age') to the positions of the items holding them.
+
+    HashIndex   - answers $eq and $in.
+    SortedIndex - answers $eq, $in, $lt, $lte, $gt and $gte with bisect.
+    TextIndex   - answers $text, maps the words of strings to positions.
+
+"""
+
+from bisect import bisect_left, bisect_right, insort
+
+from .path import DEFAULT_CHARS, compile_path
+from .query import ALIASES, And, Condition, Exists, tokenize
+
+
+def _items(data):
+    if isinstance(data, list):
+        return list(enumerate(data))
+    return [(key, data[key]) for key in data]
+
+
+class HashIndex(object):
+
+    kind = 'hash'
+    operators = ('eq', 'in')
+
+    def __init__(self, path, chars=None):
+        self.path = path
+        self.chars = chars
+        self.plan = compile_path(path, chars)
+        self.keys = None
+        self.table = None
+        self.key_positions = None
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, self.path)
+
+    @property
+    def built(self):
+        return self.keys is not None
+
+    def invalidate(self):
+        self.keys = None
+        self.table = None
+        self.key_positions = None
+
+    def position(self, key):
+        """Return the position of the item with the key."""
+        if self.key_positions is None:
+            self.key_positions = dict([(k, position) for position, k
+                                       in enumerate(self.keys)])
+        return self.key_positions[key]
+
+    def values(self, key, value):
+        """Return the indexed values of an item."""
+        return self.plan.values_item(key, value)
+
+    def append_item(self, key, values):
+        """Add a new last item with its indexed values."""
+        self.keys.append(key)
+        if self.key_positions is not None:
+            self.key_positions[key] = len(self.keys) - 1
+        self.update_item(len(self.keys) - 1, (), values)
+
+    def update_item(self, position, old_values, new_values):
+        """Move the item at position from its old to its new values."""
+        table = self.table
+        for found in old_values:
+            try:
+                positions = table.get(found)
+            except TypeError:
+                continue
+            if positions and position in positions:
+                positions.remove(position)
+                if not positions:
+                    del table[found]
+        for found in new_values:
+            try:
+                positions = table.setdefault(found, [])
+            except TypeError:
+                continue
+            if position not in positions:
+                insort(positions, position)
+
+    def build(self, data):
+        items = _items(data)
+        self.keys = [key for key, value in items]
+        self.key_positions = None
+        self.table = table = {}
+        values = self.values
+        for position, (key, value) in enumerate(items):
+            for found in values(key, value):
+                try:
+                    positions = table.setdefault(found, [])
+                except TypeError:
+                    # Unhashable values can not be equal to a hashable
+                    # operand, they are left out of the index.
+                    continue
+                if not positions or positions[-1] != position:
+                    positions.append(position)
+        return self
+
+    def _equal(self, operand):
+        try:
+            return self.table.get(operand, [])
+        except TypeError:
+            return None
+
+    def lookup(self, op, operand):
+        """Return a set of positions that may match, None if unknown."""
+        if op == 'eq':
+            found = self._equal(operand)
+            return None if found is None else set(found)
+        elif op == 'in' and isinstance(operand, (list, tuple, set,
+                                                 frozenset)):
+            out = set()
+            for item in operand:
+                found = self._equal(item)
+                if found is None:
+                    return None
+                out.update(found)
+            return out
+        return None
+
+
+class SortedIndex(HashIndex):
+
+    kind = 'sorted'
+    operators = ('eq', 'in', 'lt', 'le', 'gt', 'ge')
+
+    def build(self, data):
+        items = _items(data)
+        self.keys = [key for key, value in items]
+        self.key_positions = None
+        entries = []
+        values_item = self.plan.values_item
+        for position, (key, value) in enumerate(items):
+            for found in values_item(key, value):
+                entries.append((found, position))
+        entries.sort(key=lambda entry: entry[0])
+        self.table = [entry[0] for entry in entries]
+        self.positions = [entry[1] for entry in entries]
+        return self
+
+    def invalidate(self):
+        HashIndex.invalidate(self)
+        self.positions = None
+
+    def update_item(self, position, old_values, new_values):
+        table = self.table
+        positions = self.positions
+        for found in old_values:
+            start = bisect_left(table, found)
+            end = bisect_right(table, found)
+            for entry in range(start, end):
+                if positions[entry] == position:
+                    del table[entry]
+                    del positions[entry]
+                    break
+        for found in new_values:
+            entry = bisect_right(table, found)
+            table.insert(entry, found)
+            positions.insert(entry, position)
+
+    def _range(self, start, end):
+        return set(self.positions[start:end])
+
+    def _equal(self, operand):
+        return self._range(bisect_left(self.table, operand),
+                           bisect_right(self.table, operand))
+
+    def lookup(self, op, operand):
+        values = self.table
+        try:
+            if op == 'lt':
+                return self._range(0, bisect_left(values, operand))
+            elif op == 'le':
+                return self._range(0, bisect_right(values, operand))
+            elif op == 'gt':
+                return self._range(bisect_right(values, operand), None)
+            elif op == 'ge':
+                return self._range(bisect_left(values, operand), None)
+            elif op == 'eq':
+                return self._equal(operand)
+            elif op == 'in' and isinstance(operand, (list, tuple, set,
+                                                     frozenset)):
+                out = set()
+                for item in operand:
+                    out.update(self._equal(item))
+                return out
+        except TypeError:
+            pass
+        return None
+
+
+class TextIndex(HashIndex):
+
+    """Inverted index from the words of the strings to sorted positions."""
+
+    kind = 'text'
+    operators = ('text',)
+
+    def values(self, key, value):
+        words = []
+        for found in self.plan.values_item(key, value):
+            words.extend(tokenize(found))
+        return words
+
+    def lookup(self, op, operand):
+        if op != 'text':
+            return None
+        words = set(tokenize(operand))
+        if not words:
+            return None
+        table = self.table
+        postings = sorted([table.get(word, ()) for word in words], key=len)
+        # Intersect from the shortest posting list, stop once empty.
+        out = set(postings[0])
+        for positions in postings[1:]:
+            if not out:
+                break
+            out.intersection_update(positions)
+        return out
+
+
+INDEX_KINDS = {'hash': HashIndex, 'sorted': SortedIndex, 'text': TextIndex}
+
+
+def make_index(path, kind='hash', chars=None):
+    if kind not in INDEX_KINDS:
+        raise ValueError('Unknown index kind {0!r}, use one of {1}'.format(
+            kind, ', '.join(sorted(INDEX_KINDS))))
+    return INDEX_KINDS[kind](path, chars)
+
+
+def top_conditions(query):
+    """Return the conditions that every matching item has to pass."""
+    root = query.root
+    if isinstance(root, Condition):
+        return [root]
+    elif type(root) is And:
+        return [c for c in root.children if isinstance(c, Condition)]
+    return []
+
+
+def candidates(query, indexes, data):
+    """Return the keys of items that may match the query, in data order.
+
+    Returns None when none of the indexes can answer a condition.
+
+    """
+    positions = None
+    keys = None
+    chars = query.chars or DEFAULT_CHARS
+    for condition in top_conditions(query):
+        if isinstance(condition, Exists):
+            continue
+        op = condition.op.strip('$')
+        op = ALIASES.get(op, op)
+        for index in indexes.get(condition.path, ()):
+            if op not in index.operators or \
+                    (index.chars or DEFAULT_CHARS) != chars:
+                continue
+            if not index.built:
+                index.build(data)
+            found = index.lookup(op, condition.operand)
+            if found is None:
+                continue
+            positions = found if positions is None else positions & found
+            keys = index.keys
+            break
+    if positions is None:
+        return None
+    return [keys[position] for position in sorted(positions)]
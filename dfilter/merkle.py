@@ -0,0 +1,218 @@
+"""Structural (Merkle) hashes of nested data.
+
+The digest of a container is the sha1 of the digests of its children, so
+values that compare equal get the same digest, whatever their nesting or
+dictionary order. Digests of containers are cached on the container, by
+id, and reused until the container is forgotten. Comparing two trees
+that share most of their subtrees only hashes the parts that differ.
+
+The cache holds a strong reference to every hashed container (dicts and
+lists can not be weakly referenced), which keeps the id from being
+reused. A container stays in memory while its digest is cached, so the
+owner drops the digests of what it replaces, removes or copies on write
+with discard(), and clear() drops them all.
+
+    >>> hashes = HashCache()
+    >>> a = {'x': [1, {'y': 2}], 'z': None}
+    >>> hashes.digest(a) == hashes.digest({'z': None, 'x': [1.0, {'y': 2}]})
+    True
+    >>> unique([{'n': 1}, [1], {'n': 1}, [1]], hashes)
+    [{'n': 1}, [1]]
+    >>> changes = diff({'x': [1, 2], 'z': 0}, {'x': [1, 3], 'w': 0},
+    ...                hashes, hashes)
+    >>> sorted([(change['op'], change['path']) for change in changes])
+    [('add', ['w']), ('change', ['x', 1]), ('remove', ['z'])]
+
+"""
+
+import hashlib
+
+from . import path
+from .compat import integer_types, text_type
+
+
+def _is_container(value):
+    return isinstance(value, (path.MAPPINGS, path.SEQUENCES, tuple, set,
+                              frozenset))
+
+
+def _sha1(*parts):
+    sha = hashlib.sha1()
+    for part in parts:
+        sha.update(part)
+    return sha.digest()
+
+
+def scalar_digest(value):
+    """Return the digest of a leaf, equal leaves get equal digests."""
+    if value is None:
+        return _sha1(b'n')
+    elif value is True:
+        return _sha1(b't')
+    elif value is False:
+        return _sha1(b'f')
+    elif isinstance(value, float) and value.is_integer():
+        # 1.0 == 1, so they get the same digest.
+        value = int(value)
+    if isinstance(value, integer_types):
+        return _sha1(b'i', str(value).encode('ascii'))
+    elif isinstance(value, float):
+        return _sha1(b'd', repr(value).encode('ascii'))
+    elif isinstance(value, text_type):
+        return _sha1(b's', value.encode('utf-8'))
+    elif isinstance(value, bytes):
+        return _sha1(b's', value)
+    return _sha1(b'o', repr(value).encode('utf-8'))
+
+
+class HashCache(object):
+
+    """Digests of containers, kept until they are forgotten or cleared."""
+
+    def __init__(self):
+        # id(container) -> (container, digest), the reference keeps the
+        # id from being reused.
+        self.table = {}
+
+    def clear(self):
+        self.table = {}
+
+    def forget(self, data, keys):
+        """Drop the digests of data and the containers along the keys."""
+        table = self.table
+        obj = data
+        table.pop(id(obj), None)
+        for key in keys:
+            obj = obj[key]
+            table.pop(id(obj), None)
+
+    def discard(self, value, children=True):
+        """Drop the digest of a container and of the containers in it.
+
+        :param children: False to only drop the digest of value, eg. for
+                         a container replaced by a shallow copy.
+
+        """
+        table = self.table
+        stack = [value]
+        while stack:
+            obj = stack.pop()
+            if self._cached(obj) is None:
+                # Containers below are only cached with their parent.
+                continue
+            del table[id(obj)]
+            if children:
+                stack.extend([child for child in
+                              (obj.values() if isinstance(obj, path.MAPPINGS)
+                               else obj) if _is_container(child)])
+
+    def _cached(self, obj):
+        entry = self.table.get(id(obj))
+        if entry is not None and entry[0] is obj:
+            return entry[1]
+        return None
+
+    def _open(self, obj):
+        """Return [keys, children iterator, digests] for a container."""
+        if isinstance(obj, path.MAPPINGS):
+            items = list(obj.items())
+            return [[key for key, value in items],
+                    iter([value for key, value in items]), []]
+        return [None, iter(obj), []]
+
+    def _close(self, obj, keys, digests):
+        if keys is not None:
+            pairs = sorted([scalar_digest(key) + found
+                            for key, found in zip(keys, digests)])
+            return _sha1(b'D', *pairs)
+        elif isinstance(obj, (set, frozenset)):
+            return _sha1(b'S', *sorted(digests))
+        return _sha1(b'L', *digests)
+
+    def digest(self, value):
+        """Return the digest of value, with a stack for any depth."""
+        if not _is_container(value):
+            return scalar_digest(value)
+        found = self._cached(value)
+        if found is not None:
+            return found
+        table = self.table
+        stack = [(value, self._open(value))]
+        while True:
+            obj, state = stack[-1]
+            for child in state[1]:
+                if _is_container(child):
+                    found = self._cached(child)
+                    if found is None:
+                        stack.append((child, self._open(child)))
+                        break
+                    state[2].append(found)
+                else:
+                    state[2].append(scalar_digest(child))
+            else:
+                found = self._close(obj, state[0], state[2])
+                table[id(obj)] = (obj, found)
+                stack.pop()
+                if not stack:
+                    return found
+                stack[-1][1][2].append(found)
+
+    def hexdigest(self, value):
+        return ''.join(['{0:02x}'.format(byte)
+                        for byte in bytearray(self.digest(value))])
+
+
+def unique(values, hashes):
+    """Return values without duplicates, in order, hashable or not."""
+    seen = set()
+    out = []
+    for value in values:
+        found = hashes.digest(value)
+        if found not in seen:
+            seen.add(found)
+            out.append(value)
+    return out
+
+
+def diff(old, new, old_hashes, new_hashes):
+    """Return the changes from old to new as a list of dicts.
+
+    A change is {'path': [keys], 'op': 'add', 'new': value},
+    {'path': [keys], 'op': 'remove', 'old': value} or
+    {'path': [keys], 'op': 'change', 'old': value, 'new': value}.
+    Subtrees with equal digests are skipped without looking into them.
+
+    """
+    out = []
+    stack = [([], old, new)]
+    while stack:
+        keys, a, b = stack.pop()
+        if old_hashes.digest(a) == new_hashes.digest(b):
+            continue
+        if isinstance(a, path.MAPPINGS) and isinstance(b, path.MAPPINGS):
+            changes = []
+            for key in a.keys():
+                if key in b:
+                    changes.append((keys + [key], a[key], b[key]))
+                else:
+                    out.append({'path': keys + [key], 'op': 'remove',
+                                'old': a[key]})
+            for key in b.keys():
+                if key not in a:
+                    out.append({'path': keys + [key], 'op': 'add',
+                                'new': b[key]})
+            stack.extend(reversed(changes))
+        elif isinstance(a, path.SEQUENCES) and \
+                isinstance(b, path.SEQUENCES):
+            common = min(len(a), len(b))
+            for position in range(common, len(a)):
+                out.append({'path': keys + [position], 'op': 'remove',
+                            'old': a[position]})
+            for position in range(common, len(b)):
+                out.append({'path': keys + [position], 'op': 'add',
+                            'new': b[position]})
+            stack.extend([(keys + [position], a[position], b[position])
+                          for position in reversed(range(common))])
+        else:
+            out.append({'path': keys, 'op': 'change', 'old': a, 'new': b})
+    return out
@@ -0,0 +1,212 @@
+"""Normalize and copy data the way a JSON round trip would.
+
+normalize(data) returns the same as json.loads(json.dumps(data)) but
+walks the data once instead of writing and parsing a JSON document:
+tuples become lists, byte strings become unicode and dictionary keys
+become strings like JSON object keys.
+
+    >>> normalize({None: ('a', 2.5)})
+    {u'null': [u'a', 2.5]}
+    >>> normalize([(1, {2: 'x'})])
+    [[1, {u'2': u'x'}]]
+
+"""
+
+import json
+
+from . import path
+from .compat import basestring, integer_types, iteritems, long_type, text_type
+
+INFINITY = float('inf')
+
+
+def _float_key(key):
+    if key != key:
+        return u'NaN'
+    elif key == INFINITY:
+        return u'Infinity'
+    elif key == -INFINITY:
+        return u'-Infinity'
+    return text_type(repr(key))
+
+
+def _key(key):
+    if isinstance(key, text_type):
+        return key
+    elif isinstance(key, basestring):
+        return key.decode('utf-8')
+    elif key is True:
+        return u'true'
+    elif key is False:
+        return u'false'
+    elif key is None:
+        return u'null'
+    elif isinstance(key, float):
+        return _float_key(key)
+    elif isinstance(key, integer_types):
+        return text_type(key)
+    raise TypeError('key {0!r} is not a string'.format(key))
+
+
+# Types that are copied as they are.
+_PLAIN = frozenset([text_type, int, long_type, float, bool, type(None)])
+
+
+def _scalar(value):
+    if isinstance(value, text_type):
+        return text_type(value)
+    elif isinstance(value, basestring):
+        return value.decode('utf-8')
+    elif isinstance(value, bool):
+        return bool(value)
+    elif isinstance(value, integer_types):
+        return int(value)
+    elif isinstance(value, float):
+        return float(value)
+    raise TypeError('{0!r} is not JSON serializable'.format(value))
+
+
+class _Normalizer(object):
+
+    """Walk the data once and copy (or share) what is already normal."""
+
+    def __init__(self):
+        self.active = set()
+        self.keys = {}
+        self.normal = set()
+
+    def is_normal(self, value):
+        """True when value is already what a JSON round trip returns."""
+        kind = type(value)
+        if kind in _PLAIN:
+            return True
+        elif kind is dict:
+            for k, v in iteritems(value):
+                if type(k) is not text_type:
+                    return False
+                if type(v) not in _PLAIN and not self.is_normal(v):
+                    return False
+        elif kind is list:
+            for v in value:
+                if type(v) not in _PLAIN and not self.is_normal(v):
+                    return False
+        else:
+            return False
+        self.normal.add(id(value))
+        return True
+
+    def key(self, key):
+        try:
+            return self.keys[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return _key(key)
+        new_key = self.keys[key] = _key(key)
+        return new_key
+
+    def copy(self, value):
+        kind = type(value)
+        if kind in _PLAIN:
+            return value
+        elif kind is str:
+            return value.decode('utf-8')
+        elif isinstance(value, dict):
+            return self.copy_dict(value)
+        elif isinstance(value, (list, tuple)):
+            return self.copy_list(value)
+        elif isinstance(value, path.MAPPINGS):
+            return self.copy_dict(dict(value.items()))
+        elif isinstance(value, path.SEQUENCES):
+            return self.copy_list(list(value))
+        return _scalar(value)
+
+    def _enter(self, value):
+        marker = id(value)
+        if marker in self.active:
+            raise ValueError('Circular reference detected')
+        self.active.add(marker)
+        return marker
+
+    def copy_dict(self, value):
+        if id(value) in self.normal:
+            return value
+        marker = self._enter(value)
+        plain = _PLAIN
+        key = self.key
+        copy = self.copy
+        out = {}
+        for k, v in iteritems(value):
+            if type(k) is not text_type:
+                k = key(k)
+            kind = type(v)
+            if kind in plain:
+                out[k] = v
+            elif kind is str:
+                out[k] = v.decode('utf-8')
+            else:
+                out[k] = copy(v)
+        self.active.discard(marker)
+        return out
+
+    def copy_list(self, value):
+        if id(value) in self.normal:
+            return value
+        marker = self._enter(value)
+        plain = _PLAIN
+        copy = self.copy
+        out = []
+        append = out.append
+        for v in value:
+            kind = type(v)
+            if kind in plain:
+                append(v)
+            elif kind is str:
+                append(v.decode('utf-8'))
+            else:
+                append(copy(v))
+        self.active.discard(marker)
+        return out
+
+
+def normalize(data, share=False):
+    """Return data as a JSON round trip would return it.
+
+    :param share: Return subtrees that are already normal as they are,
+                  instead of copying them.
+
+    """
+    normalizer = _Normalizer()
+    if share:
+        try:
+            normalizer.is_normal(data)
+        except RuntimeError:
+            # Too deep (or circular), copy() reports circular data.
+            normalizer.normal.clear()
+    return normalizer.copy(data)
+
+
+def shallow_copy(obj):
+    """Return a new container with the same children."""
+    if isinstance(obj, dict):
+        # copy() keeps the type, eg. of an OrderedDict.
+        return obj.copy()
+    elif isinstance(obj, list):
+        return list(obj)
+    elif isinstance(obj, path.MAPPINGS):
+        return dict(obj.items())
+    return list(obj)
+
+
+def json_default(obj):
+    """json.dumps() default for the registered dict and list like types."""
+    if isinstance(obj, path.MAPPINGS):
+        return dict(obj.items())
+    elif isinstance(obj, path.SEQUENCES):
+        return list(obj)
+    raise TypeError('{0!r} is not JSON serializable'.format(obj))
+
+
+def normalize_json(data):
+    """The reference implementation of normalize()."""
+    return json.loads(json.dumps(data))
@@ -0,0 +1,98 @@
+"""Run filter, fields and fetch over a pool of worker processes.
+
+The items are split into chunks and every worker runs a compiled query
+(or compiled path plans) over its chunks. Where the platform can fork,
+the workers read the items from the memory they inherit from the parent
+and only chunk offsets are sent to them. Otherwise the chunks themselves
+are pickled.
+
+Workers send back positions (filter) or values (fields, fetch), which
+are merged in chunk order, so lists keep their order and dictionaries
+their key order.
+
+"""
+
+import itertools
+import multiprocessing
+import os
+
+CHUNKS_PER_WORKER = 4
+
+# Items shared with forked workers, by token.
+_shared = {}
+_tokens = itertools.count()
+
+
+def _filter_chunk(query, items):
+    match_item = query.match_item
+    return [position for position, (key, value) in enumerate(items)
+            if match_item(key, value)]
+
+
+def _fields_chunk(trie, items):
+    out = []
+    for position, (key, value) in enumerate(items):
+        projected = trie.project_item(key, value)
+        if key in projected:
+            out.append((position, projected[key]))
+    return out
+
+
+def _fetch_chunk(plan, items):
+    values = []
+    for key, value in items:
+        values.extend(plan.values_item(key, value))
+    return values
+
+
+TASKS = {'filter': _filter_chunk,
+         'fields': _fields_chunk,
+         'fetch': _fetch_chunk}
+
+
+def _run_chunk(args):
+    task, compiled, token, start, end, items = args
+    if items is None:
+        items = _shared[token][start:end]
+    return start, TASKS[task](compiled, items)
+
+
+def chunk_bounds(length, parts):
+    """Split range(length) in up to parts (start, end) pairs.
+
+    >>> chunk_bounds(10, 3)
+    [(0, 4), (4, 8), (8, 10)]
+
+    """
+    size = max(1, -(-length // max(1, parts)))
+    return [(start, min(start + size, length))
+            for start in range(0, length, size)]
+
+
+def run(task, compiled, items, workers):
+    """Run the task over the items with a pool of workers.
+
+    :param task: 'filter', 'fields' or 'fetch'.
+    :param compiled: Compiled query, list of plans or a plan (picklable).
+    :param items: List of (key, value) pairs.
+    :return: List of (chunk start, chunk result) in item order.
+
+    """
+    bounds = chunk_bounds(len(items), workers * CHUNKS_PER_WORKER)
+    token = next(_tokens)
+    fork = hasattr(os, 'fork')
+    if fork:
+        _shared[token] = items
+    try:
+        pool = multiprocessing.Pool(workers)
+        try:
+            tasks = [(task, compiled, token, start, end,
+                      None if fork else items[start:end])
+                     for start, end in bounds]
+            results = pool.map(_run_chunk, tasks, 1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _shared.pop(token, None)
+    return sorted(results, key=lambda result: result[0])
@@ -0,0 +1,476 @@
+"""Compile path strings into reusable plans.
+
+A path like ``'*.friend.[0, 1]'`` is split and parsed once into a
+:class:`PathPlan`. Plans are cached on the path and the configured
+characters, so repeated queries only pay for walking the data.
+
+"""
+
+from .cache import LRUCache
+from .compat import basestring
+
+DEFAULT_CHARS = {'separator': '.',
+                 'wildcard': '*',
+                 'liststart': '[',
+                 'listend': ']',
+                 'listsplit': ','}
+
+_plan_cache = LRUCache(1024)
+
+# Types the steps walk like dictionaries and like lists, see
+# register_container().
+MAPPINGS = (dict,)
+SEQUENCES = (list,)
+
+
+def register_container(mapping=None, sequence=None):
+    """Let paths walk into a dict like or list like type.
+
+    A mapping type needs keys(), items(), ``in`` and ``[key]``, a
+    sequence type needs ``len()``, iteration and ``[position]``.
+
+    """
+    global MAPPINGS, SEQUENCES
+    if mapping is not None and mapping not in MAPPINGS:
+        MAPPINGS = MAPPINGS + (mapping,)
+    if sequence is not None and sequence not in SEQUENCES:
+        SEQUENCES = SEQUENCES + (sequence,)
+
+
+def is_container(obj):
+    """True for dictionaries, lists and the registered containers."""
+    return isinstance(obj, MAPPINGS + SEQUENCES)
+
+
+def is_mapping(obj):
+    return isinstance(obj, MAPPINGS)
+
+
+def is_sequence(obj):
+    return isinstance(obj, SEQUENCES)
+
+
+class Step(object):
+
+    """Base of all path steps.
+
+    A step knows which keys it selects from a single object, keys(), and
+    how to advance a whole level of [path, object] pairs, walk().
+
+    """
+
+    # True for steps that select more than one level.
+    descendant = False
+
+    def keys(self, obj):
+        return []
+
+    def new_keys(self, obj):
+        """Like keys() but with the keys a set() would add to obj."""
+        return self.keys(obj)
+
+    def matches_key(self, key):
+        return False
+
+    def walk(self, objs):
+        keys = self.keys
+        return [[path + [key], obj[key]]
+                for path, obj in objs for key in keys(obj)]
+
+    def walk_values(self, objs):
+        keys = self.keys
+        return [obj[key] for obj in objs for key in keys(obj)]
+
+
+class KeyStep(Step):
+
+    """Select a named key of a dictionary."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def walk(self, objs):
+        name = self.name
+        return [[path + [name], obj[name]] for path, obj in objs
+                if isinstance(obj, MAPPINGS) and name in obj]
+
+    def walk_values(self, objs):
+        name = self.name
+        return [obj[name] for obj in objs
+                if isinstance(obj, MAPPINGS) and name in obj]
+
+    def keys(self, obj):
+        if isinstance(obj, MAPPINGS) and self.name in obj:
+            return [self.name]
+        return []
+
+    def new_keys(self, obj):
+        if isinstance(obj, MAPPINGS):
+            return [self.name]
+        return []
+
+    def matches_key(self, key):
+        return key == self.name
+
+    def __repr__(self):
+        return 'KeyStep({0!r})'.format(self.name)
+
+
+class IndexStep(Step):
+
+    """Select a list position, or a digit key of a dictionary."""
+
+    def __init__(self, text):
+        self.text = text
+        self.index = int(text)
+
+    def keys(self, obj):
+        if isinstance(obj, SEQUENCES):
+            return [self.index] if self.index < len(obj) else []
+        elif isinstance(obj, MAPPINGS):
+            return [k for k in (self.text, self.index) if k in obj]
+        return []
+
+    def new_keys(self, obj):
+        if isinstance(obj, MAPPINGS):
+            return self.keys(obj) or [self.text]
+        return self.keys(obj)
+
+    def matches_key(self, key):
+        return key == self.text or key == self.index
+
+    def __repr__(self):
+        return 'IndexStep({0!r})'.format(self.text)
+
+
+class WildcardStep(Step):
+
+    """Select every key of a dictionary or every position of a list."""
+
+    def keys(self, obj):
+        if isinstance(obj, MAPPINGS):
+            return list(obj.keys())
+        elif isinstance(obj, SEQUENCES):
+            return list(range(len(obj)))
+        return []
+
+    def matches_key(self, key):
+        return True
+
+    def __repr__(self):
+        return 'WildcardStep()'
+
+
+class DescendantStep(WildcardStep):
+
+    """Select everything below an object, at any depth, eg. ``**.id``.
+
+    keys() is one level like a wildcard, walk() repeats it until the
+    leaves and returns what it finds depth first, in document order.
+
+    """
+
+    descendant = True
+
+    def walk(self, objs):
+        keys = self.keys
+        out = []
+        for path, obj in objs:
+            stack = [(path, obj, iter(keys(obj)))]
+            while stack:
+                path, obj, children = stack[-1]
+                for key in children:
+                    child = [path + [key], obj[key]]
+                    out.append(child)
+                    stack.append((child[0], child[1], iter(keys(child[1]))))
+                    break
+                else:
+                    stack.pop()
+        return out
+
+    def walk_values(self, objs):
+        return [pair[1] for pair in self.walk([[[], obj] for obj in objs])]
+
+    def paths(self, obj):
+        """Return the key paths of everything below obj."""
+        return [pair[0] for pair in self.walk([[[], obj]])]
+
+    def __repr__(self):
+        return 'DescendantStep()'
+
+
+class ChoiceStep(Step):
+
+    """Select the union of a list of steps, eg. ``[a, 3, *]``."""
+
+    def __init__(self, steps):
+        self.steps = tuple(steps)
+
+    def keys(self, obj):
+        out = []
+        for step in self.steps:
+            out.extend(step.keys(obj))
+        return list(set(out))
+
+    def new_keys(self, obj):
+        out = []
+        for step in self.steps:
+            out.extend(step.new_keys(obj))
+        return list(set(out))
+
+    def matches_key(self, key):
+        for step in self.steps:
+            if step.matches_key(key):
+                return True
+        return False
+
+    def __repr__(self):
+        return 'ChoiceStep({0!r})'.format(list(self.steps))
+
+
+class PathPlan(object):
+
+    """A compiled path, ready to be run against data."""
+
+    def __init__(self, path, steps):
+        self.path = path
+        self.steps = tuple(steps)
+        self.head = self.steps[0]
+        self.tail = self.steps[1:]
+
+    def __repr__(self):
+        return 'PathPlan({0!r})'.format(self.path)
+
+    def _walk(self, objs, steps):
+        for step in steps:
+            objs = step.walk(objs)
+            if not objs:
+                break
+        return objs
+
+    def run(self, data):
+        """Return a list of [path, value] pairs found in data."""
+        return self._walk([[[], data]], self.steps)
+
+    def run_from(self, objs, start):
+        """Run the steps from start on, on the [path, value] pairs objs."""
+        return self._walk(objs, self.steps[start:])
+
+    def _item(self, key, value):
+        """Return the [path, value] pairs the head selects in an item."""
+        objs = [[[key], value]]
+        if self.head.descendant:
+            # The item itself is one level below the top, like for '*'.
+            objs.extend(self.head.walk(objs))
+        return objs
+
+    def run_item(self, key, value):
+        """Like run() on ``{key: value}`` without building the dictionary."""
+        if not self.head.matches_key(key):
+            return []
+        return self._walk(self._item(key, value), self.tail)
+
+    def _values(self, objs, steps):
+        for step in steps:
+            objs = step.walk_values(objs)
+            if not objs:
+                break
+        return objs
+
+    def parents(self, data):
+        """Return [path, object] pairs of what the last step selects from."""
+        return self._walk([[[], data]], self.steps[:-1])
+
+    def values(self, data):
+        """Return a list of the values found in data."""
+        return self._values([data], self.steps)
+
+    def values_item(self, key, value):
+        """Like values() on ``{key: value}`` without building the dictionary."""
+        if not self.head.matches_key(key):
+            return []
+        if self.head.descendant:
+            return self._values([pair[1] for pair in self._item(key, value)],
+                                self.tail)
+        return self._values([value], self.tail)
+
+
+def compile_step(step, chars=None):
+    """Parse a single step of a path."""
+    if chars is None:
+        chars = DEFAULT_CHARS
+    if not isinstance(step, basestring):
+        step = str(step)
+    if step == chars['wildcard']:
+        return WildcardStep()
+    elif step == chars['wildcard'] * 2:
+        return DescendantStep()
+    elif step.isdigit():
+        return IndexStep(step)
+    elif step.startswith(chars['liststart']) and \
+            step.endswith(chars['listend']):
+        return ChoiceStep([compile_step(s.strip(), chars)
+                           for s in step[1:-1].split(chars['listsplit'])])
+    else:
+        return KeyStep(step)
+
+
+def compile_path(path, chars=None):
+    """Return a (cached) PathPlan for the path.
+
+    >>> compile_path('a.*.[0, 2]').steps
+    (KeyStep('a'), WildcardStep(), ChoiceStep([IndexStep('0'), IndexStep('2')]))
+    >>> compile_path('**.id').values({'a': {'id': 1, 'b': [{'id': 2}]}})
+    [1, 2]
+
+    """
+    if isinstance(path, PathPlan):
+        return path
+    if not isinstance(path, basestring):
+        path = str(path)
+    if chars is None:
+        chars = DEFAULT_CHARS
+    cache_key = (path, chars['separator'], chars['wildcard'],
+                 chars['liststart'], chars['listend'], chars['listsplit'])
+    plan = _plan_cache.get(cache_key)
+    if plan is None:
+        plan = PathPlan(path, [compile_step(step, chars)
+                               for step in path.split(chars['separator'])])
+        _plan_cache.put(cache_key, plan)
+    return plan
+
+
+class TrieNode(object):
+
+    """A step of a PathTrie with the plans that end at it."""
+
+    def __init__(self):
+        self.ends = []
+        self.children = []
+        self.by_step = {}
+        self.loop = None
+
+    def child(self, step):
+        marker = repr(step)
+        node = self.by_step.get(marker)
+        if node is None:
+            node = self.by_step[marker] = TrieNode()
+            self.children.append((step, node))
+            if step.descendant:
+                # A node that repeats the step one level further down.
+                node.loop = TrieNode()
+                node.loop.children.append((step, node))
+        return node
+
+
+class PathTrie(object):
+
+    """Several paths merged on their shared leading steps.
+
+    fields() and fetch_many() walk the trie once per item, so a prefix
+    (and the keys a wildcard in it expands to) is only walked once for
+    all the paths that share it.
+
+    """
+
+    def __init__(self, plans):
+        self.plans = list(plans)
+        self.root = TrieNode()
+        for number, plan in enumerate(self.plans):
+            node = self.root
+            for step in plan.steps:
+                node = node.child(step)
+            node.ends.append(number)
+
+    def __repr__(self):
+        return 'PathTrie({0!r})'.format([plan.path for plan in self.plans])
+
+    def _fill(self, node, obj, out):
+        """Copy what the children of node select from obj into out."""
+        found = False
+        full = set()
+        # Whole values first, paths below them add nothing.
+        for step, child in node.children:
+            if child.ends:
+                for key in step.keys(obj):
+                    out[key] = obj[key]
+                    full.add(key)
+                    found = True
+        for step, child in node.children:
+            if child.ends:
+                continue
+            for key in step.keys(obj):
+                if key in full:
+                    continue
+                sub = out.get(key)
+                if sub is None:
+                    sub = {}
+                    if self._fill_node(child, obj[key], sub):
+                        out[key] = sub
+                        found = True
+                elif self._fill_node(child, obj[key], sub):
+                    found = True
+        return found
+
+    def _fill_node(self, node, obj, out):
+        found = self._fill(node, obj, out)
+        if node.loop is not None and self._fill(node.loop, obj, out):
+            found = True
+        return found
+
+    def project_item(self, key, value):
+        """Return {key: value reduced to the paths found}.
+
+        Lists on the way become dictionaries keyed on position. An empty
+        dictionary is returned when none of the paths is found.
+
+        """
+        children = [(step, child) for step, child in self.root.children
+                    if step.matches_key(key)]
+        for step, child in children:
+            if child.ends:
+                return {key: value}
+        out = {}
+        found = False
+        for step, child in children:
+            if self._fill_node(child, value, out):
+                found = True
+        if found:
+            return {key: out}
+        return {}
+
+    def values(self, data):
+        """Return a list of the values found in data for every path."""
+        out = [[] for plan in self.plans]
+        stack = [(self.root, [data])]
+        while stack:
+            node, objs = stack.pop()
+            for step, child in node.children:
+                found = step.walk_values(objs)
+                if not found:
+                    continue
+                for number in child.ends:
+                    out[number].extend(found)
+                if child.children:
+                    stack.append((child, found))
+        return out
+
+
+_trie_cache = LRUCache(256)
+
+
+def compile_fields(paths, chars=None):
+    """Return a (cached) PathTrie of a path or a list of paths."""
+    if isinstance(paths, PathTrie):
+        return paths
+    if isinstance(paths, basestring):
+        paths = [paths]
+    if chars is None:
+        chars = DEFAULT_CHARS
+    cache_key = (tuple(paths), chars['separator'], chars['wildcard'],
+                 chars['liststart'], chars['listend'], chars['listsplit'])
+    trie = _trie_cache.get(cache_key)
+    if trie is None:
+        trie = PathTrie([compile_path(path, chars) for path in paths])
+        _trie_cache.put(cache_key, trie)
+    return trie
@@ -0,0 +1,257 @@
+"""Lazy query pipelines.
+
+A Pipeline records filter/fields/skip/limit stages and runs them in a
+single pass over the items of a Dfilter when it is iterated or collected.
+Limits stop reading items as soon as they are reached. A sort followed by
+a limit only keeps the top items in a heap instead of sorting them all.
+Group and unwind stages, see aggregate.py, are also run in the same pass.
+
+    >>> from dfilter import Dfilter
+    >>> df = Dfilter([{'n': n} for n in range(1000)])
+    >>> df.lazy().filter({'*.n': {'$gt': 10}}).fields('*.n').limit(2).collect()
+    [{'n': 11}, {'n': 12}]
+
+"""
+
+from .aggregate import GroupStage, UnwindStage
+from .query import compile_query
+from .sort import sort_items
+
+
+class FilterStage(object):
+
+    def __init__(self, dfilter, query):
+        self.query = compile_query(query, dfilter.chars)
+
+    def process(self, item):
+        if self.query.match_item(item[0], item[1]):
+            return item
+        return None
+
+
+class FieldsStage(object):
+
+    def __init__(self, dfilter, fields):
+        self.trie = dfilter._field_trie(fields)
+
+    def process(self, item):
+        projected = self.trie.project_item(item[0], item[1])
+        if item[0] in projected:
+            return item[0], projected[item[0]]
+        return None
+
+
+class SkipStage(object):
+
+    def __init__(self, dfilter, number):
+        self.number = number
+        self.count = 0
+
+    def process(self, item):
+        if self.count < self.number:
+            self.count += 1
+            return None
+        return item
+
+
+class LimitStage(object):
+
+    def __init__(self, dfilter, number):
+        self.number = number
+        self.count = 0
+
+    @property
+    def done(self):
+        return self.count >= self.number
+
+    def process(self, item):
+        if self.count >= self.number:
+            return None
+        self.count += 1
+        return item
+
+
+class SortStage(object):
+
+    """Blocking stage, it needs all items before the first is known."""
+
+    def __init__(self, dfilter, fields):
+        self.fields = fields
+        self.chars = dfilter.chars
+        self.limit = None
+
+    def run(self, items):
+        return sort_items(items, self.fields, self.chars, self.limit)
+
+
+def fuse(items, stages):
+    """Run the streaming stages over the items in one loop."""
+    limits = [stage for stage in stages if isinstance(stage, LimitStage)]
+    if any([limit.done for limit in limits]):
+        return
+    for item in items:
+        for stage in stages:
+            item = stage.process(item)
+            if item is None:
+                break
+        else:
+            yield item
+        for limit in limits:
+            if limit.done:
+                return
+
+
+class Pipeline(object):
+
+    """A lazy chain of query stages over the items of a Dfilter.
+
+    Build one with Dfilter.lazy(). Every method returns a new Pipeline,
+    nothing runs until the pipeline is iterated, collected or counted.
+
+    """
+
+    stage_types = {'filter': FilterStage,
+                   'fields': FieldsStage,
+                   'skip': SkipStage,
+                   'limit': LimitStage,
+                   'sort': SortStage,
+                   'group': GroupStage,
+                   'unwind': UnwindStage}
+
+    def __init__(self, dfilter, source=None, kind=None, stages=()):
+        self.dfilter = dfilter
+        if source is None:
+            source = dfilter.items
+            kind = 'list' if isinstance(dfilter.data, list) else 'dict'
+        self.source = source
+        self.kind = kind
+        self.stages = tuple(stages)
+
+    def __repr__(self):
+        return 'Pipeline({0})'.format(', '.join(
+            ['{0}({1!r})'.format(name, args[0] if len(args) == 1 else args)
+             for name, args in self.stages]))
+
+    def _add(self, name, *args):
+        return Pipeline(self.dfilter, self.source, self.kind,
+                        self.stages + ((name, args),))
+
+    def filter(self, query):
+        """Only keep the items matching the filter dict."""
+        return self._add('filter', query)
+
+    def fields(self, fields):
+        """Only keep the selected fields of the items."""
+        return self._add('fields', fields)
+
+    def skip(self, number):
+        """Drop the first number of items."""
+        return self._add('skip', int(number))
+
+    def limit(self, number=100):
+        """Stop after the number of items."""
+        return self._add('limit', int(number))
+
+    def first(self, number=1):
+        """Alias for limit but default is to return 1 item."""
+        return self._add('limit', int(number))
+
+    def sort(self, fields):
+        """Sort the items on fields, see Dfilter.sort()."""
+        return self._add('sort', fields)
+
+    def group(self, by, accumulators=None):
+        """Group the items on the value of the by path, see GroupStage.
+
+        The pipeline then has one {'_id': value, ...} item per group.
+
+        """
+        return Pipeline(self.dfilter, self.source, 'list',
+                        self.stages + (('group', (by, accumulators)),))
+
+    def unwind(self, path):
+        """Yield an item for every element of the list at the path."""
+        return self._add('unwind', path)
+
+    def aggregate(self, stages):
+        """Add Mongo style stages, eg. [{'$match': {...}}, {'$limit': 5}].
+
+        Stages are $match, $project, $unwind, $group, $sort, $skip and
+        $limit. The $group dict holds the by path as '_id' and the
+        accumulators.
+
+        """
+        pipeline = self
+        for stage in stages:
+            if len(stage) != 1:
+                raise ValueError('A stage needs one operator, got '
+                                 '{0!r}'.format(stage))
+            op, operand = list(stage.items())[0]
+            name = self.aggregate_stages.get(op)
+            if name is None:
+                raise ValueError('Unknown stage {0!r}'.format(op))
+            if name == 'group':
+                accumulators = dict(operand)
+                by = accumulators.pop('_id', None)
+                pipeline = pipeline.group(by, accumulators)
+            else:
+                pipeline = getattr(pipeline, name)(operand)
+        return pipeline
+
+    aggregate_stages = {'$match': 'filter',
+                        '$project': 'fields',
+                        '$unwind': 'unwind',
+                        '$group': 'group',
+                        '$sort': 'sort',
+                        '$skip': 'skip',
+                        '$limit': 'limit'}
+
+    def _build(self, name, args):
+        return self.stage_types[name](self.dfilter, *args)
+
+    def _top(self, position):
+        """Number of items needed after a stage, None when all are."""
+        skipped = 0
+        for name, args in self.stages[position + 1:]:
+            if name == 'skip':
+                skipped += args[0]
+            elif name == 'limit':
+                return skipped + args[0]
+            else:
+                return None
+        return None
+
+    def __iter__(self):
+        items = iter(self.source())
+        streaming = []
+        for position, (name, args) in enumerate(self.stages):
+            stage = self._build(name, args)
+            if hasattr(stage, 'limit'):
+                stage.limit = self._top(position)
+            if hasattr(stage, 'process'):
+                streaming.append(stage)
+            else:
+                # Stages with run() take the items of the stages before
+                # them as one iterator, blocking stages read all of them.
+                if streaming:
+                    items = fuse(items, streaming)
+                    streaming = []
+                items = stage.run(items)
+        if streaming:
+            items = fuse(items, streaming)
+        return iter(items)
+
+    def collect(self):
+        """Run the pipeline and return the result as a Dfilter."""
+        from .dfilter import OrderedDict
+        if self.kind == 'list':
+            return self.dfilter._result([item[1] for item in self])
+        # Ordered, so the order of a sort stage is kept.
+        return self.dfilter._result(OrderedDict(list(self)))
+
+    def count(self):
+        """Run the pipeline and return the number of items."""
+        count = 0
+        for item in self:
+            count += 1
+        return count
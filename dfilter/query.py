@@ -0,0 +1,360 @@
+"""Compile mongodb like filter dictionaries into predicate trees.
+
+    >>> query = compile_query({'*.age': {'$lt': 50}, '*.name': 'foo'})
+    >>> query.match_item('foo', {'name': 'foo', 'age': 10})
+    True
+    >>> query.match_item('bar', {'name': 'bar', 'age': 70})
+    False
+
+A compiled query holds no reference to any data, it can be reused on any
+number of datasets and it can be pickled.
+
+"""
+
+import operator
+import re
+
+from .cache import LRUCache
+from .compat import basestring
+from .path import compile_path, is_sequence
+
+
+def _in(a, b):
+    return a in b
+
+
+def _nin(a, b):
+    return a not in b
+
+
+def _all(a, b):
+    try:
+        return all([bb in a for bb in b])
+    except TypeError:
+        return False
+
+
+def _mod(a, b):
+    return a % b[0] == b[1]
+
+
+def _never(a, b):
+    return False
+
+
+# Patterns of $regex, compiled once.
+_patterns = LRUCache(256)
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def compile_pattern(pattern):
+    """Return the compiled regular expression, from the cache if possible."""
+    if not isinstance(pattern, basestring):
+        return pattern
+    compiled = _patterns.get(pattern)
+    if compiled is None:
+        compiled = re.compile(pattern)
+        _patterns.put(pattern, compiled)
+    return compiled
+
+
+def tokenize(value):
+    """Return the lower case words of a string, [] for other values.
+
+    >>> tokenize(u'South Africa, ZA')
+    [u'south', u'africa', u'za']
+
+    """
+    if not isinstance(value, basestring):
+        return []
+    return [token.lower() for token in TOKEN.findall(value)]
+
+
+def _regex(a, b):
+    return isinstance(a, basestring) and \
+        compile_pattern(b).search(a) is not None
+
+
+def _text(a, b):
+    words = set(tokenize(b))
+    return bool(words) and words.issubset(tokenize(a))
+
+
+ALIASES = {'lte': 'le', 'gte': 'ge'}
+
+_functions = {'in': _in, 'nin': _nin, 'all': _all, 'mod': _mod,
+              'regex': _regex, 'text': _text}
+
+
+def binary_operator(name):
+    """Return the function(value, operand) of an operator like '$lt'."""
+    name = name.strip('$')
+    name = ALIASES.get(name, name)
+    if name in _functions:
+        return _functions[name]
+    elif hasattr(operator, name):
+        return getattr(operator, name)
+    # Unknown operators never match.
+    return _never
+
+
+class Compare(object):
+
+    """Predicate that compares a value with a fixed operand."""
+
+    def __init__(self, func, operand):
+        self.func = func
+        self.operand = operand
+
+    def __call__(self, value):
+        return self.func(value, self.operand)
+
+
+class In(object):
+
+    """Membership predicate that looks up hashable values in a frozenset."""
+
+    negate = False
+
+    def __init__(self, operand):
+        self.items = operand
+        self.set = None
+        if isinstance(operand, (list, tuple, set, frozenset)):
+            self.items = list(operand)
+            try:
+                self.set = frozenset(operand)
+            except TypeError:
+                pass
+
+    def __call__(self, value):
+        if self.set is not None:
+            try:
+                return (value in self.set) != self.negate
+            except TypeError:
+                # Unhashable values, eg. lists, fall back to a scan.
+                pass
+        return (value in self.items) != self.negate
+
+
+class NotIn(In):
+
+    negate = True
+
+
+class All(object):
+
+    """True when the value holds every item of the operand."""
+
+    def __init__(self, operand):
+        self.items = list(operand)
+        try:
+            self.set = frozenset(self.items)
+        except TypeError:
+            self.set = None
+
+    def __call__(self, value):
+        if self.set is not None and (is_sequence(value) or
+                                     isinstance(value, tuple)):
+            try:
+                return self.set.issubset(value)
+            except TypeError:
+                pass
+        return _all(value, self.items)
+
+
+class Regex(object):
+
+    """True for strings the pattern is found in."""
+
+    def __init__(self, operand):
+        self.pattern = compile_pattern(operand)
+
+    def __call__(self, value):
+        return isinstance(value, basestring) and \
+            self.pattern.search(value) is not None
+
+
+class Text(object):
+
+    """True for strings that hold every word of the operand."""
+
+    def __init__(self, operand):
+        self.words = frozenset(tokenize(operand))
+
+    def __call__(self, value):
+        return bool(self.words) and self.words.issubset(tokenize(value))
+
+
+def make_predicate(op, operand):
+    """Return a one argument predicate for the operator and operand."""
+    name = ALIASES.get(op.strip('$'), op.strip('$'))
+    if name == 'in':
+        return In(operand)
+    elif name == 'nin':
+        return NotIn(operand)
+    elif name == 'all':
+        return All(operand)
+    elif name == 'regex':
+        return Regex(operand)
+    elif name == 'text':
+        return Text(operand)
+    return Compare(binary_operator(name), operand)
+
+
+class Condition(object):
+
+    """Test one path of an item: any value found must pass the predicate."""
+
+    def __init__(self, path, op, operand, chars=None):
+        self.path = path
+        self.op = op
+        self.operand = operand
+        self.plan = compile_path(path, chars)
+        self.predicate = make_predicate(op, operand)
+
+    def __repr__(self):
+        return 'Condition({0!r}, {1!r}, {2!r})'.format(self.path, self.op,
+                                                       self.operand)
+
+    def match_item(self, key, value):
+        predicate = self.predicate
+        for found in self.plan.values_item(key, value):
+            if predicate(found):
+                return True
+        return False
+
+
+class Exists(Condition):
+
+    """Test that a path is (or is not) present in an item."""
+
+    def __init__(self, path, operand, chars=None):
+        self.path = path
+        self.op = '$exists'
+        self.operand = operand
+        self.plan = compile_path(path, chars)
+
+    def match_item(self, key, value):
+        return bool(self.plan.values_item(key, value)) == bool(self.operand)
+
+
+class And(object):
+
+    def __init__(self, children):
+        self.children = list(children)
+
+    def __repr__(self):
+        return 'And({0!r})'.format(self.children)
+
+    def match_item(self, key, value):
+        for child in self.children:
+            if not child.match_item(key, value):
+                return False
+        return True
+
+
+class Or(And):
+
+    def __repr__(self):
+        return 'Or({0!r})'.format(self.children)
+
+    def match_item(self, key, value):
+        for child in self.children:
+            if child.match_item(key, value):
+                return True
+        return False
+
+
+class Nor(And):
+
+    def __repr__(self):
+        return 'Nor({0!r})'.format(self.children)
+
+    def match_item(self, key, value):
+        for child in self.children:
+            if child.match_item(key, value):
+                return False
+        return True
+
+
+class Query(object):
+
+    """A compiled filter query."""
+
+    def __init__(self, query, chars=None):
+        self.query = query
+        self.chars = chars
+        self.root = self._compile(query)
+        self.match_item = self.root.match_item
+
+    def __repr__(self):
+        return 'Query({0!r})'.format(self.root)
+
+    def __getstate__(self):
+        return {'query': self.query, 'chars': self.chars, 'root': self.root}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.match_item = self.root.match_item
+
+    def _compile(self, query):
+        if isinstance(query, (list, tuple)):
+            return And([self._compile(q) for q in query])
+        children = []
+        for key in query:
+            value = query[key]
+            if key == '$and':
+                children.append(And([self._compile(q) for q in value]))
+            elif key == '$or':
+                children.append(Or([self._compile(q) for q in value]))
+            elif key == '$nor':
+                children.append(Nor([self._compile(q) for q in value]))
+            else:
+                children.extend(self._conditions(key, value))
+        if len(children) == 1:
+            return children[0]
+        return And(children)
+
+    def _conditions(self, path, value):
+        if not isinstance(value, dict):
+            return [Condition(path, '$eq', value, self.chars)]
+        ops = [n for n in value
+               if isinstance(n, basestring) and n.startswith('$')]
+        if not ops:
+            return [Condition(path, '$eq', value, self.chars)]
+        out = []
+        for op in ops:
+            if op == '$options':
+                continue
+            elif op == '$regex' and '$options' in value and \
+                    isinstance(value[op], basestring):
+                # Flags like mongodb, eg. {'$regex': 'ab', '$options': 'i'}.
+                pattern = '(?' + value['$options'] + ')' + value[op]
+                out.append(Condition(path, op, pattern, self.chars))
+            elif op == '$exists':
+                out.append(Exists(path, value[op], self.chars))
+            elif op == '$not':
+                out.append(Nor([And(self._conditions(path, value[op]))]))
+            else:
+                out.append(Condition(path, op, value[op], self.chars))
+        return out
+
+    def select(self, data):
+        """Iterate over the keys (or list positions) of matching items."""
+        match_item = self.match_item
+        if isinstance(data, list):
+            for position, value in enumerate(data):
+                if match_item(position, value):
+                    yield position
+        else:
+            for key in data:
+                if match_item(key, data[key]):
+                    yield key
+
+
+def compile_query(query, chars=None):
+    """Return a compiled Query, compiled queries are returned as is."""
+    if isinstance(query, Query):
+        return query
+    return Query(query, chars)
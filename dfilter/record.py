@@ -0,0 +1,149 @@
+"""Compact storage for many dictionaries with the same keys.
+
+A list of records like [{'name': ..., 'age': ...}, ...] holds a hash
+table and the key strings in every dictionary. compact() replaces every
+dictionary with a Record: a schema, shared by all dictionaries with the
+same keys, and a tuple of the values.
+
+    >>> data = compact([{'name': 'foo', 'age': 10}, {'age': 70, 'name': 'bar'}])
+    >>> data[1]['name'], sorted(data[1].keys())
+    ('bar', ['age', 'name'])
+    >>> data[0].schema is data[1].schema
+    True
+    >>> data[0] == {'name': 'foo', 'age': 10}
+    True
+
+Records are read only dict like objects, paths, filters and the walkers
+see them as dictionaries. Dfilter copies a record to a dict when it is
+changed with set(), update() or delete().
+
+"""
+
+from . import path
+
+
+class Schema(object):
+
+    """The keys of a record shape and the position of every key."""
+
+    __slots__ = ('keys', 'positions')
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.positions = dict([(key, position)
+                               for position, key in enumerate(keys)])
+
+    def __repr__(self):
+        return 'Schema({0!r})'.format(self.keys)
+
+
+class Record(object):
+
+    """Read only dict like view of a schema and a tuple of values."""
+
+    __slots__ = ('schema', 'fields')
+
+    __hash__ = None
+
+    def __init__(self, schema, fields):
+        self.schema = schema
+        self.fields = fields
+
+    def _position(self, key):
+        try:
+            return self.schema.positions.get(key)
+        except TypeError:
+            return None
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __contains__(self, key):
+        return self._position(key) is not None
+
+    def __getitem__(self, key):
+        position = self._position(key)
+        if position is None:
+            raise KeyError(key)
+        return self.fields[position]
+
+    def get(self, key, default=None):
+        position = self._position(key)
+        if position is None:
+            return default
+        return self.fields[position]
+
+    def keys(self):
+        return list(self.schema.keys)
+
+    def __iter__(self):
+        return iter(self.schema.keys)
+
+    def values(self):
+        return list(self.fields)
+
+    def items(self):
+        return list(zip(self.schema.keys, self.fields))
+
+    iteritems = items
+
+    def __eq__(self, other):
+        if isinstance(other, Record) and other.schema is self.schema:
+            return self.fields == other.fields
+        if not isinstance(other, path.MAPPINGS):
+            return False
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __reduce__(self):
+        # Pickled and deep copied as a plain dict.
+        return dict, (self.items(),)
+
+    def __repr__(self):
+        return 'Record({0!r})'.format(dict(self.items()))
+
+
+path.register_container(Record)
+
+
+class Compactor(object):
+
+    """Turn dictionaries into records, one schema per set of keys."""
+
+    def __init__(self):
+        self.schemas = {}
+
+    def schema(self, keys):
+        try:
+            keys = tuple(sorted(keys))
+        except TypeError:
+            keys = tuple(keys)
+        found = self.schemas.get(keys)
+        if found is None:
+            found = self.schemas[keys] = Schema(keys)
+        return found
+
+    def record(self, obj):
+        schema = self.schema(obj.keys())
+        return Record(schema, tuple([self.value(obj[key])
+                                     for key in schema.keys]))
+
+    def value(self, value):
+        if isinstance(value, dict):
+            return self.record(value)
+        elif isinstance(value, list):
+            return [self.value(item) for item in value]
+        return value
+
+
+def compact(data):
+    """Return the top level container with its dictionaries as records."""
+    compactor = Compactor()
+    if isinstance(data, dict):
+        return dict([(key, compactor.value(value))
+                     for key, value in data.items()])
+    elif isinstance(data, list):
+        return [compactor.value(value) for value in data]
+    return data
@@ -0,0 +1,150 @@
+"""Reverse indexes: from leaf values and from key names to their paths.
+
+The index is built once with iflatten() and answers locate(value) with a
+dict lookup. Values are looked up on their canonical key, so unhashable
+values (sets, tuples holding lists, ...) work too and True is not 1.
+
+    >>> index = ReverseIndex().build({'a': [1, True], 'b': {'c': 1}})
+    >>> index.locate(1)
+    [['a', 0], ['b', 'c']]
+    >>> index.locate(True, separator='.')
+    ['a.1']
+    >>> index.locate('missing')
+    []
+
+"""
+
+from .compat import NUMBER_TYPES, basestring, iteritems
+from .path import DescendantStep, is_mapping, is_sequence
+from .walk import iflatten
+
+
+def canonical(value):
+    """Return a hashable key, equal for values that compare equal.
+
+    Booleans are kept apart from the numbers 0 and 1, containers become
+    tuples of the canonical keys of their items.
+
+    """
+    if value is None or isinstance(value, basestring):
+        return value
+    elif isinstance(value, bool):
+        return ('bool', value)
+    elif isinstance(value, NUMBER_TYPES):
+        return value
+    elif is_mapping(value):
+        items = iteritems(value) if isinstance(value, dict) else \
+            value.items()
+        return ('dict', tuple(sorted([(canonical(k), canonical(v))
+                                      for k, v in items])))
+    elif is_sequence(value) or isinstance(value, tuple):
+        return ('list', tuple([canonical(v) for v in value]))
+    elif isinstance(value, (set, frozenset)):
+        return ('set', frozenset([canonical(v) for v in value]))
+    try:
+        hash(value)
+    except TypeError:
+        return ('repr', type(value).__name__, repr(value))
+    return ('object', value)
+
+
+def join_path(path, separator):
+    return separator.join([key if isinstance(key, basestring) else str(key)
+                           for key in path])
+
+
+class ReverseIndex(object):
+
+    """Map of canonical leaf value to the paths (tuples) of the leaf."""
+
+    def __init__(self):
+        self.table = None
+
+    @property
+    def built(self):
+        return self.table is not None
+
+    def invalidate(self):
+        self.table = None
+
+    def build(self, data):
+        self.table = {}
+        self.add((), data)
+        return self
+
+    def add(self, prefix, value):
+        """Add the leaves of value, found under the path prefix."""
+        table = self.table
+        for path, leaf in iflatten(value):
+            key = canonical(leaf)
+            paths = table.get(key)
+            if paths is None:
+                table[key] = [prefix + path]
+            else:
+                paths.append(prefix + path)
+
+    def remove(self, prefix, value):
+        """Remove the leaves of value, found under the path prefix."""
+        table = self.table
+        for path, leaf in iflatten(value):
+            key = canonical(leaf)
+            paths = table.get(key)
+            if paths is None:
+                continue
+            try:
+                paths.remove(prefix + path)
+            except ValueError:
+                continue
+            if not paths:
+                del table[key]
+
+    def locate(self, value, separator=None):
+        """Return the paths of value as lists, or strings with a separator."""
+        paths = self.table.get(canonical(value), ())
+        if separator is None:
+            return [list(path) for path in paths]
+        return [join_path(path, separator) for path in paths]
+
+
+class KeyIndex(object):
+
+    """Map of key name to the [path, dictionary] pairs holding the key.
+
+    Answers paths like '**.id' without walking the whole data, the pairs
+    are in the order DescendantStep walks them.
+
+        >>> index = KeyIndex().build({'a': {'id': 1}, 'b': [{'id': 2}]})
+        >>> [pair[0] for pair in index.containers('id')]
+        [['a'], ['b', 0]]
+
+    """
+
+    def __init__(self):
+        self.table = None
+
+    @property
+    def built(self):
+        return self.table is not None
+
+    def invalidate(self):
+        self.table = None
+
+    def build(self, data):
+        self.table = table = {}
+        top = [[[], data]]
+        for pair in top + DescendantStep().walk(top):
+            if not hasattr(pair[1], 'keys'):
+                continue
+            for key in pair[1].keys():
+                pairs = table.get(key)
+                if pairs is None:
+                    table[key] = [pair]
+                else:
+                    pairs.append(pair)
+        return self
+
+    def containers(self, key):
+        try:
+            return self.table.get(key, [])
+        except TypeError:
+            return []
@@ -0,0 +1,358 @@
+"""A dataset kept as a directory of JSON and JSON Lines shards.
+
+Every shard (.json, .jsonl, .ndjson, .jsonlines) holds a list or a
+dictionary of items. For the zoned paths (filter paths like '*.region')
+a zone map is kept per shard in a sidecar file in the directory: the
+number of values, the min and max when all values are numbers or all are
+strings, and a sketch of the distinct values (the values themselves when
+there are few, else a bloom filter). The sidecar is updated when a shard
+changes.
+
+filter() tests the conditions every match has to pass against the zone
+maps and skips the shards that can not hold a match. The other shards
+are loaded on first use, read by a pool of threads so the file reads
+overlap, and their items are matched by a pool of worker processes (see
+dfilter.parallel), as matching is Python code that holds the GIL.
+
+    >>> import json, os, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> for name, region in [('a.json', 'Asia'), ('b.json', 'Africa')]:
+    ...     fh = open(os.path.join(directory, name), 'w')
+    ...     json.dump([{'region': region, 'n': len(region)}], fh)
+    ...     fh.close()
+    >>> sharded = ShardedDfilter(directory, ['*.region', '*.n'])
+    >>> sharded.plan({'*.region': 'Africa'}), sharded.plan({'*.n': {'$lt': 5}})
+    (['b.json'], ['a.json'])
+    >>> sharded.filter({'*.n': {'$gt': 5}}).values()
+    [{u'region': u'Africa', u'n': 6}]
+    >>> sharded.loaded()
+    ['b.json']
+    >>> import shutil; shutil.rmtree(directory)
+
+"""
+
+import hashlib
+import json
+import os
+from multiprocessing.pool import ThreadPool
+
+from .compat import NUMBER_TYPES, basestring
+from . import parallel
+from .dfilter import Dfilter
+from .index import top_conditions
+from .path import compile_path
+from .query import ALIASES, Exists, compile_query
+from .stream import LINES_EXTENSIONS
+
+SIDECAR = '.dfilter-zones.json'
+EXTENSIONS = ('.json',) + LINES_EXTENSIONS
+# Distinct values kept as they are, more go into a bloom filter.
+DISTINCT_LIMIT = 64
+BLOOM_BITS = 8192
+BLOOM_HASHES = 4
+
+
+def _kind(value):
+    if isinstance(value, bool):
+        return 'bool'
+    elif isinstance(value, NUMBER_TYPES):
+        return 'number'
+    elif isinstance(value, basestring):
+        return 'string'
+    elif value is None:
+        return 'null'
+    return None
+
+
+def sketch_key(value):
+    """Return the sketch key of a scalar, equal for values that are ==."""
+    if isinstance(value, bool):
+        value = int(value)
+    elif isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return json.dumps(value)
+
+
+def _bloom_positions(key):
+    digest = bytearray(hashlib.sha1(key.encode('utf-8')).digest())
+    return [((digest[4 * n] << 24) | (digest[4 * n + 1] << 16) |
+             (digest[4 * n + 2] << 8) | digest[4 * n + 3]) % BLOOM_BITS
+            for n in range(BLOOM_HASHES)]
+
+
+class Zone(object):
+
+    """What the values of one path in one shard can be."""
+
+    def __init__(self, state=None):
+        state = state or {}
+        self.count = state.get('count', 0)
+        self.kind = state.get('kind')
+        self.min = state.get('min')
+        self.max = state.get('max')
+        self.distinct = state.get('distinct')
+        bloom = state.get('bloom')
+        self.bloom = None if bloom is None else bytearray.fromhex(bloom)
+
+    def state(self):
+        return {'count': self.count, 'kind': self.kind, 'min': self.min,
+                'max': self.max, 'distinct': self.distinct,
+                'bloom': None if self.bloom is None else
+                ''.join(['{0:02x}'.format(byte) for byte in self.bloom])}
+
+    @classmethod
+    def build(cls, values):
+        zone = cls()
+        kinds = set()
+        keys = set()
+        for value in values:
+            zone.count += 1
+            kind = _kind(value)
+            kinds.add(kind)
+            if kind is None:
+                continue
+            keys.add(sketch_key(value))
+            if kind in ('number', 'string'):
+                if zone.min is None or value < zone.min:
+                    zone.min = value
+                if zone.max is None or value > zone.max:
+                    zone.max = value
+        # A range only helps when all values can be compared.
+        if len(kinds) == 1 and list(kinds)[0] in ('number', 'string'):
+            zone.kind = list(kinds)[0]
+        else:
+            zone.min = zone.max = None
+        if len(keys) <= DISTINCT_LIMIT:
+            zone.distinct = sorted(keys)
+        else:
+            zone.bloom = bytearray(BLOOM_BITS // 8)
+            for key in keys:
+                for position in _bloom_positions(key):
+                    zone.bloom[position // 8] |= 1 << (position % 8)
+        return zone
+
+    def may_hold(self, value):
+        """False when no value of the zone can be equal to value."""
+        if _kind(value) is None:
+            return True
+        key = sketch_key(value)
+        if self.distinct is not None:
+            return key in self.distinct
+        for position in _bloom_positions(key):
+            if not self.bloom[position // 8] & (1 << (position % 8)):
+                return False
+        return True
+
+    def _comparable(self, operand):
+        return self.kind is not None and _kind(operand) == self.kind
+
+    def _may_equal(self, operand):
+        if self._comparable(operand) and \
+                not self.min <= operand <= self.max:
+            return False
+        return self.may_hold(operand)
+
+    def may_match(self, op, operand):
+        """False when no value of the zone can pass the condition."""
+        if op not in ('eq', 'in', 'lt', 'le', 'gt', 'ge'):
+            return True
+        if not self.count:
+            # A condition needs a value to pass.
+            return False
+        if op == 'eq':
+            return self._may_equal(operand)
+        elif op == 'in':
+            if not isinstance(operand, (list, tuple, set, frozenset)):
+                return True
+            for item in operand:
+                if self._may_equal(item):
+                    return True
+            return False
+        elif not self._comparable(operand):
+            return True
+        elif op == 'lt':
+            return self.min < operand
+        elif op == 'le':
+            return self.min <= operand
+        elif op == 'gt':
+            return self.max > operand
+        return self.max >= operand
+
+
+def _shard_items(data):
+    if isinstance(data, list):
+        return enumerate(data)
+    return data.items()
+
+
+class ShardedDfilter(object):
+
+    """Filter a directory of JSON shards, skipping shards on zone maps.
+
+    :param directory: The directory with the shards.
+    :param paths: Filter paths to keep zone maps of, eg. ['*.region'].
+    :param workers: Number of threads that read shards and of worker
+                    processes that match their items.
+
+    """
+
+    def __init__(self, directory, paths=(), workers=4):
+        self.directory = directory
+        if isinstance(paths, basestring):
+            paths = [paths]
+        self.paths = list(paths)
+        self.workers = workers
+        self.shards = []
+        self.zones = {}
+        self._loaded = {}
+        self.refresh()
+
+    def __repr__(self):
+        return 'ShardedDfilter({0!r}, {1} shards)'.format(self.directory,
+                                                          len(self.shards))
+
+    @property
+    def sidecar(self):
+        return os.path.join(self.directory, SIDECAR)
+
+    def _read_sidecar(self):
+        try:
+            fh = open(self.sidecar)
+        except IOError:
+            return {}
+        try:
+            return json.load(fh).get('shards', {})
+        except ValueError:
+            return {}
+        finally:
+            fh.close()
+
+    def _write_sidecar(self, shards):
+        temporary = self.sidecar + '.tmp'
+        fh = open(temporary, 'w')
+        try:
+            json.dump({'version': 1, 'shards': shards}, fh, sort_keys=True)
+        finally:
+            fh.close()
+        os.rename(temporary, self.sidecar)
+
+    def refresh(self):
+        """Find the shards and update the zone maps of changed shards.
+
+        :return: self
+
+        """
+        # Hidden files, like the sidecar, are not shards.
+        names = sorted([name for name in os.listdir(self.directory)
+                        if name.lower().endswith(EXTENSIONS) and
+                        not name.startswith('.')])
+        saved = self._read_sidecar()
+        shards = {}
+        changed = False
+        for name in names:
+            stat = os.stat(os.path.join(self.directory, name))
+            entry = saved.get(name)
+            if entry is None or entry['mtime'] != stat.st_mtime or \
+                    entry['size'] != stat.st_size or \
+                    [p for p in self.paths if p not in entry['zones']]:
+                entry = self._zone_entry(name, stat)
+                self._loaded.pop(name, None)
+                changed = True
+            shards[name] = entry
+        if changed or sorted(saved) != names:
+            self._write_sidecar(shards)
+        self.shards = names
+        self.zones = dict([(name, dict([(p, Zone(state)) for p, state
+                                        in shards[name]['zones'].items()]))
+                           for name in names])
+        self.kinds = dict([(name, shards[name]['kind']) for name in names])
+        return self
+
+    def _zone_entry(self, name, stat):
+        data = Dfilter().read_json(os.path.join(self.directory, name)).data
+        zones = {}
+        for path in self.paths:
+            values_item = compile_path(path).values_item
+            values = []
+            for key, value in _shard_items(data):
+                values.extend(values_item(key, value))
+            zones[path] = Zone.build(values).state()
+        return {'mtime': stat.st_mtime, 'size': stat.st_size,
+                'kind': 'list' if isinstance(data, list) else 'dict',
+                'zones': zones}
+
+    def load(self, name):
+        """Return the Dfilter of a shard, read on first use."""
+        found = self._loaded.get(name)
+        if found is None:
+            found = Dfilter().read_json(os.path.join(self.directory, name))
+            self._loaded[name] = found
+        return found
+
+    def loaded(self):
+        """Return the names of the shards that are in memory."""
+        return sorted(self._loaded)
+
+    def unload(self):
+        self._loaded = {}
+        return self
+
+    def plan(self, query):
+        """Return the names of the shards that may hold a match."""
+        conditions = []
+        for condition in top_conditions(compile_query(query)):
+            if isinstance(condition, Exists) or \
+                    condition.path not in self.paths:
+                continue
+            op = condition.op.strip('$')
+            conditions.append((condition.path, ALIASES.get(op, op),
+                               condition.operand))
+        out = []
+        for name in self.shards:
+            zones = self.zones[name]
+            for path, op, operand in conditions:
+                if not zones[path].may_match(op, operand):
+                    break
+            else:
+                out.append(name)
+        return out
+
+    def filter(self, query, workers=None):
+        """Filter all shards, see Dfilter.filter().
+
+        The matches of list shards are joined in one list, in shard name
+        order; those of dictionary shards are merged in one dictionary.
+
+        :param workers: Number of threads and worker processes, default
+                        the workers given to the constructor.
+        :return: Dfilter object.
+
+        """
+        query = compile_query(query)
+        kinds = set([self.kinds[name] for name in self.shards])
+        if len(kinds) > 1:
+            raise ValueError('Shards hold lists and dictionaries')
+        names = self.plan(query)
+        workers = workers or self.workers
+        found = []
+        if workers and workers > 1 and len(names) > 1:
+            pool = ThreadPool(min(workers, len(names)))
+            try:
+                shards = pool.map(self.load, names)
+            finally:
+                pool.close()
+                pool.join()
+            items = []
+            for shard in shards:
+                items.extend(shard.items())
+            for start, positions in parallel.run('filter', query, items,
+                                                 workers):
+                found.extend([items[start + p] for p in positions])
+        else:
+            for name in names:
+                found.extend(self.load(name).filter(query).items())
+        if kinds == set(['dict']):
+            data = dict(found)
+        else:
+            data = [value for key, value in found]
+        return Dfilter()._result(data)
@@ -0,0 +1,373 @@
+"""Binary snapshots of data, opened with mmap and decoded lazily.
+
+A snapshot stores the data as a tree of nodes. Containers hold offset
+tables of their children, and dictionary keys are interned in one key
+table. Opening a snapshot maps the file and decodes nothing but the key
+table. SnapshotDict and SnapshotList decode a node only when it is
+looked at, so spot()/fetch() only touch the pages of the nodes on their
+paths. Processes that open the same snapshot share its pages through
+the page cache.
+
+    >>> import os, tempfile
+    >>> name = os.path.join(tempfile.mkdtemp(), 'data.snap')
+    >>> write_snapshot({'a': [1, {'b': u'x'}], 'c': None}, name)
+    >>> root = Snapshot(name).root()
+    >>> root['a'][1]['b'], len(root['a'])
+    (u'x', 2)
+    >>> decode(root['a'])
+    [1, {u'b': u'x'}]
+
+Format, little endian:
+
+    header  'DFSNAP01', u64 offset of the key table, u64 offset of the root
+    node    a tag byte and its payload:
+            n t f         None, True, False
+            i <int64>     integer
+            b <u32> <..>  integer that does not fit 64 bits, as digits
+            d <float64>   float
+            s <u32> <..>  UTF-8 string
+            L <u32 count> <u64 offset> * count
+            D <u32 count> <u32 key id> * count <u64 offset> * count, sorted
+                          on key id
+    keys    <u32 count> then <u32 length> <UTF-8> per key, the id of a
+            key is its position
+
+"""
+
+import mmap
+import struct
+from bisect import bisect_left
+
+from . import path
+from .compat import integer_types, iteritems, text_type
+from .normalize import _key
+
+MAGIC = b'DFSNAP01'
+HEADER = struct.Struct('<8sQQ')
+INT64 = struct.Struct('<q')
+FLOAT = struct.Struct('<d')
+COUNT = struct.Struct('<I')
+MIN_INT64 = -2 ** 63
+MAX_INT64 = 2 ** 63 - 1
+
+
+def _is_container(value):
+    return isinstance(value, (path.MAPPINGS, path.SEQUENCES, tuple))
+
+
+class SnapshotWriter(object):
+
+    """Write the nodes of data children first, so offsets are known."""
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.offset = HEADER.size
+        self.keys = []
+        self.key_ids = {}
+
+    def _write(self, *parts):
+        offset = self.offset
+        for part in parts:
+            self.fh.write(part)
+            self.offset += len(part)
+        return offset
+
+    def key_id(self, key):
+        if not isinstance(key, text_type):
+            key = _key(key)
+        key_id = self.key_ids.get(key)
+        if key_id is None:
+            key_id = self.key_ids[key] = len(self.keys)
+            self.keys.append(key)
+        return key_id
+
+    def scalar(self, value):
+        if value is None:
+            return self._write(b'n')
+        elif value is True:
+            return self._write(b't')
+        elif value is False:
+            return self._write(b'f')
+        elif isinstance(value, integer_types):
+            if MIN_INT64 <= value <= MAX_INT64:
+                return self._write(b'i', INT64.pack(value))
+            digits = str(value).encode('ascii')
+            return self._write(b'b', COUNT.pack(len(digits)), digits)
+        elif isinstance(value, float):
+            return self._write(b'd', FLOAT.pack(value))
+        elif isinstance(value, text_type):
+            value = value.encode('utf-8')
+        elif not isinstance(value, bytes):
+            raise TypeError('{0!r} can not be stored in a snapshot'.format(
+                value))
+        return self._write(b's', COUNT.pack(len(value)), value)
+
+    def _open(self, obj):
+        """Return [ids, children iterator, offsets] for a container."""
+        if isinstance(obj, path.MAPPINGS):
+            entries = sorted([(self.key_id(k), v) for k, v in obj.items()],
+                             key=lambda entry: entry[0])
+            return [[entry[0] for entry in entries],
+                    iter([entry[1] for entry in entries]), []]
+        return [None, iter(obj), []]
+
+    def _close(self, ids, offsets):
+        count = COUNT.pack(len(offsets))
+        table = struct.pack('<{0}Q'.format(len(offsets)), *offsets)
+        if ids is None:
+            return self._write(b'L', count, table)
+        return self._write(b'D', count,
+                           struct.pack('<{0}I'.format(len(ids)), *ids), table)
+
+    def node(self, value):
+        """Write value and return its offset, with a stack for any depth."""
+        if not _is_container(value):
+            return self.scalar(value)
+        stack = [(value, self._open(value))]
+        while True:
+            obj, state = stack[-1]
+            for child in state[1]:
+                if _is_container(child):
+                    stack.append((child, self._open(child)))
+                    break
+                state[2].append(self.scalar(child))
+            else:
+                offset = self._close(state[0], state[2])
+                stack.pop()
+                if not stack:
+                    return offset
+                stack[-1][1][2].append(offset)
+
+    def write(self, data):
+        self.fh.write(HEADER.pack(MAGIC, 0, 0))
+        root = self.node(data)
+        keys_offset = self._write(COUNT.pack(len(self.keys)))
+        for key in self.keys:
+            key = key.encode('utf-8')
+            self._write(COUNT.pack(len(key)), key)
+        self.fh.seek(0)
+        self.fh.write(HEADER.pack(MAGIC, keys_offset, root))
+
+
+def write_snapshot(data, filename):
+    """Write data to a snapshot file."""
+    fh = open(filename, 'wb')
+    try:
+        SnapshotWriter(fh).write(data)
+    finally:
+        fh.close()
+
+
+class Snapshot(object):
+
+    """An opened snapshot file."""
+
+    def __init__(self, filename):
+        fh = open(filename, 'rb')
+        try:
+            self.buffer = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fh.close()
+        magic, keys_offset, self.root_offset = HEADER.unpack_from(
+            self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError('{0} is not a snapshot'.format(filename))
+        self.keys = []
+        count, = COUNT.unpack_from(self.buffer, keys_offset)
+        offset = keys_offset + COUNT.size
+        for position in range(count):
+            size, = COUNT.unpack_from(self.buffer, offset)
+            offset += COUNT.size
+            self.keys.append(self.buffer[offset:offset + size].decode('utf-8'))
+            offset += size
+        self.key_ids = dict([(key, key_id)
+                             for key_id, key in enumerate(self.keys)])
+
+    def node(self, offset):
+        """Decode a scalar, or return a lazy proxy of a container."""
+        buf = self.buffer
+        tag = buf[offset:offset + 1]
+        if tag == b'D':
+            return SnapshotDict(self, offset)
+        elif tag == b'L':
+            return SnapshotList(self, offset)
+        elif tag == b's':
+            size, = COUNT.unpack_from(buf, offset + 1)
+            start = offset + 1 + COUNT.size
+            return buf[start:start + size].decode('utf-8')
+        elif tag == b'i':
+            return INT64.unpack_from(buf, offset + 1)[0]
+        elif tag == b'd':
+            return FLOAT.unpack_from(buf, offset + 1)[0]
+        elif tag == b'n':
+            return None
+        elif tag == b't':
+            return True
+        elif tag == b'f':
+            return False
+        elif tag == b'b':
+            size, = COUNT.unpack_from(buf, offset + 1)
+            start = offset + 1 + COUNT.size
+            return int(buf[start:start + size])
+        raise ValueError('Bad snapshot node at {0}'.format(offset))
+
+    def root(self):
+        """Return the top level container with lazy children."""
+        root = self.node(self.root_offset)
+        if isinstance(root, SnapshotDict):
+            return dict(root.items())
+        elif isinstance(root, SnapshotList):
+            return list(root)
+        return root
+
+
+class SnapshotList(object):
+
+    """Read only list like view of a snapshot node."""
+
+    __slots__ = ('snapshot', 'count', 'table')
+
+    __hash__ = None
+
+    def __init__(self, snapshot, offset):
+        self.snapshot = snapshot
+        self.count, = COUNT.unpack_from(snapshot.buffer, offset + 1)
+        self.table = offset + 1 + COUNT.size
+
+    def _offsets(self):
+        return struct.unpack_from('<{0}Q'.format(self.count),
+                                  self.snapshot.buffer, self.table)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[n] for n in range(*position.indices(self.count))]
+        if position < 0:
+            position += self.count
+        if not 0 <= position < self.count:
+            raise IndexError('snapshot list index out of range')
+        offset, = struct.unpack_from('<Q', self.snapshot.buffer,
+                                     self.table + 8 * position)
+        return self.snapshot.node(offset)
+
+    def __iter__(self):
+        node = self.snapshot.node
+        for offset in self._offsets():
+            yield node(offset)
+
+    def __eq__(self, other):
+        return decode(self) == decode(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __reduce__(self):
+        # Pickled, eg. for worker processes, as a plain list.
+        return list, (decode(self),)
+
+    def __repr__(self):
+        return 'SnapshotList({0} items)'.format(self.count)
+
+
+class SnapshotDict(object):
+
+    """Read only dict like view of a snapshot node."""
+
+    __slots__ = ('snapshot', 'count', 'ids_start', 'table', '_ids')
+
+    __hash__ = None
+
+    def __init__(self, snapshot, offset):
+        self.snapshot = snapshot
+        self.count, = COUNT.unpack_from(snapshot.buffer, offset + 1)
+        self.ids_start = offset + 1 + COUNT.size
+        self.table = self.ids_start + COUNT.size * self.count
+        self._ids = None
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            self._ids = struct.unpack_from('<{0}I'.format(self.count),
+                                           self.snapshot.buffer,
+                                           self.ids_start)
+        return self._ids
+
+    def _position(self, key):
+        try:
+            key_id = self.snapshot.key_ids.get(key)
+        except TypeError:
+            return None
+        if key_id is None:
+            return None
+        ids = self.ids
+        position = bisect_left(ids, key_id)
+        if position < self.count and ids[position] == key_id:
+            return position
+        return None
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self._position(key) is not None
+
+    def __getitem__(self, key):
+        position = self._position(key)
+        if position is None:
+            raise KeyError(key)
+        offset, = struct.unpack_from('<Q', self.snapshot.buffer,
+                                     self.table + 8 * position)
+        return self.snapshot.node(offset)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def keys(self):
+        keys = self.snapshot.keys
+        return [keys[key_id] for key_id in self.ids]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def values(self):
+        node = self.snapshot.node
+        return [node(offset) for offset in struct.unpack_from(
+            '<{0}Q'.format(self.count), self.snapshot.buffer, self.table)]
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    iteritems = items
+
+    def __eq__(self, other):
+        return decode(self) == decode(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __reduce__(self):
+        return dict, (decode(self),)
+
+    def __repr__(self):
+        return 'SnapshotDict({0} keys)'.format(self.count)
+
+
+path.register_container(SnapshotDict, SnapshotList)
+
+
+def decode(obj):
+    """Return obj with every snapshot proxy in it decoded."""
+    if isinstance(obj, SnapshotDict):
+        return dict([(k, decode(v)) for k, v in obj.items()])
+    elif isinstance(obj, SnapshotList):
+        return [decode(v) for v in obj]
+    elif isinstance(obj, dict):
+        return dict([(k, decode(v)) for k, v in iteritems(obj)])
+    elif isinstance(obj, list):
+        return [decode(v) for v in obj]
+    return obj
+
@@ -0,0 +1,113 @@
+"""Sort items on the values of fields.
+
+Sort keys are extracted once per item (decorate-sort-undecorate). A
+field prefixed with '-' sorts descending. Values of different types sort
+by type first: None, booleans, numbers, strings, lists, dictionaries,
+anything else. Items without a value for a field sort last, also when
+the field is descending.
+
+    >>> items = list(enumerate([{'a': 2}, {'a': 'x'}, {}, {'a': 1}]))
+    >>> [item[1] for item in sort_items(items, ['*.a'])]
+    [{'a': 1}, {'a': 2}, {'a': 'x'}, {}]
+    >>> [item[1] for item in sort_items(items, ['-*.a'], limit=2)]
+    [{'a': 'x'}, {'a': 2}]
+
+"""
+
+import heapq
+
+from .compat import NUMBER_TYPES, basestring
+from .normalize import normalize
+from .path import compile_path, is_container, is_mapping, is_sequence
+
+
+def _rank(value):
+    if value is None:
+        return 0
+    elif isinstance(value, bool):
+        return 1
+    elif isinstance(value, NUMBER_TYPES):
+        return 2
+    elif isinstance(value, basestring):
+        return 3
+    elif is_sequence(value):
+        return 4
+    elif is_mapping(value):
+        return 5
+    return 6
+
+
+class Descending(object):
+
+    """Wrap a sort key to reverse its order."""
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __gt__(self, other):
+        return other.key > self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __ne__(self, other):
+        return self.key != other.key
+
+    def __le__(self, other):
+        return other.key <= self.key
+
+    def __ge__(self, other):
+        return other.key >= self.key
+
+
+class SortKey(object):
+
+    """Callable that returns the sort key of an item."""
+
+    def __init__(self, fields, chars=None):
+        if isinstance(fields, basestring):
+            fields = [fields]
+        self.fields = []
+        for field in fields:
+            descending = field.startswith('-')
+            plan = compile_path(field[1:] if descending else field, chars)
+            self.fields.append((plan, descending))
+
+    def __call__(self, key, value):
+        out = []
+        for plan, descending in self.fields:
+            found = plan.values_item(key, value)
+            if not found:
+                out.append((1, None))
+                continue
+            first = found[0]
+            if is_container(first):
+                # Records and snapshot proxies inside compare as plain data.
+                first = normalize(first, share=True)
+            sort_value = (_rank(first), first)
+            out.append((0, Descending(sort_value) if descending
+                        else sort_value))
+        return tuple(out)
+
+
+def sort_items(items, fields, chars=None, limit=None):
+    """Return the (key, value) items sorted on the fields.
+
+    :param limit: Only the first limit items are needed, these are then
+                  selected with a heap instead of sorting everything.
+
+    """
+    sort_key = SortKey(fields, chars)
+    # The position keeps the sort stable and items are never compared.
+    decorated = ((sort_key(item[0], item[1]), position, item)
+                 for position, item in enumerate(items))
+    if limit is not None:
+        decorated = heapq.nsmallest(limit, decorated)
+    else:
+        decorated = sorted(decorated)
+    return [entry[2] for entry in decorated]
@@ -0,0 +1,391 @@
+"""Read the items of big JSON documents one at a time.
+
+JsonStream walks the top level array elements (or object members) of a
+JSON document, or the lines of a JSON Lines file, and decodes one item
+at a time. Only the current item and a small read buffer are kept in
+memory.
+
+    >>> from io import StringIO
+    >>> list(JsonStream(StringIO(u'[1, {"a": 2}]')))
+    [(0, 1), (1, {u'a': 2})]
+    >>> list(JsonStream(StringIO(u'{"a": 1, "b": [2]}')))
+    [(u'a', 1), (u'b', [2])]
+
+JsonFeed parses the same input pushed to it in chunks, for data that
+arrives from an event loop instead of a file.
+
+"""
+
+import codecs
+import json
+
+from .compat import basestring
+
+WHITESPACE = ' \t\n\r'
+NUMBER_CHARS = '0123456789.eE+-'
+LINES_EXTENSIONS = ('.jsonl', '.ndjson', '.jsonlines')
+
+_decoder = json.JSONDecoder()
+
+
+def _number_may_continue(buf, end):
+    """True when a value decoded up to end is a number more data may extend.
+
+    A number split in '12.5' or '3e4' decodes as 12 or 3 with the rest of
+    the buffer not used yet.
+
+    """
+    if not buf[end - 1].isdigit():
+        return False
+    for char in buf[end:]:
+        if char not in NUMBER_CHARS:
+            return False
+    return True
+
+
+class JsonStream(object):
+
+    """Iterator of (key, value) pairs of the top level of a JSON document.
+
+    Keys are list positions for arrays and JSON Lines, and member names
+    for objects. The kind attribute is 'list' or 'dict'.
+
+    :param fh: File handle or filename.
+    :param lines: True for JSON Lines, None guesses from the filename.
+    :param chunk_size: Number of characters read at a time.
+
+    """
+
+    def __init__(self, fh, lines=None, chunk_size=65536):
+        self.close_file = False
+        if isinstance(fh, basestring):
+            if lines is None:
+                lines = fh.lower().endswith(LINES_EXTENSIONS)
+            fh = open(fh, 'r')
+            self.close_file = True
+        self.fh = fh
+        self.lines = bool(lines)
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self._kind = None
+
+    def __iter__(self):
+        try:
+            if self.lines:
+                items = self._iter_lines()
+            elif self.kind == 'list':
+                items = self._iter_array()
+            else:
+                items = self._iter_object()
+            for item in items:
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        if self.close_file:
+            self.fh.close()
+            self.close_file = False
+
+    @property
+    def kind(self):
+        if self._kind is None:
+            if self.lines:
+                self._kind = 'list'
+            else:
+                start = self._peek()
+                if start == '[':
+                    self._kind = 'list'
+                elif start == '{':
+                    self._kind = 'dict'
+                else:
+                    raise ValueError('Expected a JSON array or object, '
+                                     'got {0!r}'.format(start))
+        return self._kind
+
+    def _fill(self, size=None):
+        data = self.fh.read(size or self.chunk_size)
+        if not data:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+
+    def _peek(self):
+        """Skip white space and return the next character, '' at the end."""
+        while True:
+            buf = self.buffer
+            pos = self.pos
+            end = len(buf)
+            while pos < end and buf[pos] in WHITESPACE:
+                pos += 1
+            self.pos = pos
+            if pos < end:
+                return buf[pos]
+            if self.eof:
+                return ''
+            self._fill()
+
+    def _expect(self, chars):
+        char = self._peek()
+        if char not in chars:
+            raise ValueError('Expected one of {0!r} at {1!r}'.format(
+                chars, self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+        return char
+
+    def _decode(self):
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
+                # Grow the reads with the item, so big items are not
+                # decoded over and over again.
+                self._fill(max(self.chunk_size, len(self.buffer) - self.pos))
+                continue
+            if not self.eof and _number_may_continue(self.buffer, end):
+                # A number at the end of the buffer may continue.
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def _iter_array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        position = 0
+        while True:
+            yield position, self._decode()
+            position += 1
+            if self._expect(',]') == ']':
+                return
+
+    def _iter_object(self):
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self._decode()
+            self._expect(':')
+            yield key, self._decode()
+            if self._expect(',}') == '}':
+                return
+
+    def _iter_lines(self):
+        position = 0
+        for line in self.fh:
+            line = line.strip()
+            if line:
+                yield position, json.loads(line)
+                position += 1
+
+
+class JsonFeed(object):
+
+    """Push parser for the same input as JsonStream.
+
+    Instead of reading a file, the data is given to feed() in chunks as
+    it arrives, eg. from a socket or an event loop, and feed() returns
+    the (key, value) items completed by the chunk. Nothing blocks.
+
+        >>> feed = JsonFeed()
+        >>> feed.feed(b'[1, {"a"'), feed.feed(b': 2}, 3'), feed.feed(b']')
+        ([(0, 1)], [(1, {u'a': 2})], [(2, 3)])
+        >>> feed.close()
+        []
+
+    """
+
+    def __init__(self, lines=False):
+        self.lines = bool(lines)
+        self.kind = 'list' if self.lines else None
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = u''
+        self.pos = 0
+        self.state = 'start'
+        self.position = 0
+        self.key = None
+        self.closed = False
+        self.retry_size = 0
+
+    def feed(self, data):
+        """Add a chunk of bytes (or text), return the completed items."""
+        if self.closed:
+            raise ValueError('feed() after close()')
+        if isinstance(data, bytes):
+            data = self.decoder.decode(data)
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return list(self._items(final=False))
+
+    def close(self):
+        """End of the data, return the last items."""
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(b'', True)
+        self.pos = 0
+        items = list(self._items(final=True))
+        self.closed = True
+        if not self.lines and self.state != 'end':
+            raise ValueError('Unexpected end of JSON data')
+        return items
+
+    def _peek(self):
+        buf = self.buffer
+        pos = self.pos
+        end = len(buf)
+        while pos < end and buf[pos] in WHITESPACE:
+            pos += 1
+        self.pos = pos
+        return buf[pos] if pos < end else ''
+
+    def _decode(self, final):
+        """Decode the next value, None (with state kept) for more data."""
+        size = len(self.buffer) - self.pos
+        if not final and size < self.retry_size:
+            return None
+        try:
+            value, end = _decoder.raw_decode(self.buffer, self.pos)
+        except ValueError:
+            if final:
+                raise
+            # Wait for the data to double, so a big item that arrives in
+            # small chunks is not decoded over and over again.
+            self.retry_size = 2 * size
+            return None
+        self.retry_size = 0
+        if not final and _number_may_continue(self.buffer, end):
+            # A number at the end of the data so far may continue.
+            return None
+        self.pos = end
+        return [value]
+
+    def _lines(self, final):
+        while True:
+            end = self.buffer.find(u'\n', self.pos)
+            if end == -1:
+                if not final:
+                    return
+                end = len(self.buffer)
+            line = self.buffer[self.pos:end].strip()
+            self.pos = min(end + 1, len(self.buffer))
+            if line:
+                yield self.position, json.loads(line)
+                self.position += 1
+            if end == len(self.buffer):
+                return
+
+    def _items(self, final):
+        if self.lines:
+            for item in self._lines(final):
+                yield item
+            return
+        while True:
+            char = self._peek()
+            if not char:
+                return
+            state = self.state
+            if state == 'start':
+                if char not in '[{':
+                    raise ValueError('Expected a JSON array or object, '
+                                     'got {0!r}'.format(char))
+                self.kind = 'list' if char == '[' else 'dict'
+                self.state = 'first'
+                self.pos += 1
+            elif state == 'first' and char in ']}':
+                self.state = 'end'
+                self.pos += 1
+            elif state == 'value' or (state == 'first' and
+                                      self.kind == 'list'):
+                found = self._decode(final)
+                if found is None:
+                    return
+                self.state = 'after'
+                if self.kind == 'list':
+                    yield self.position, found[0]
+                    self.position += 1
+                else:
+                    yield self.key, found[0]
+            elif state in ('first', 'key'):
+                found = self._decode(final)
+                if found is None:
+                    return
+                self.key = found[0]
+                self.state = 'colon'
+            elif state == 'colon':
+                if char != ':':
+                    raise ValueError('Expected : at {0!r}'.format(
+                        self.buffer[self.pos:self.pos + 20]))
+                self.state = 'value'
+                self.pos += 1
+            elif state == 'after':
+                close = ']' if self.kind == 'list' else '}'
+                if char == ',':
+                    self.state = 'value' if self.kind == 'list' else 'key'
+                elif char == close:
+                    self.state = 'end'
+                else:
+                    raise ValueError('Expected , or {0} at {1!r}'.format(
+                        close, self.buffer[self.pos:self.pos + 20]))
+                self.pos += 1
+            else:
+                raise ValueError('Extra data at {0!r}'.format(
+                    self.buffer[self.pos:self.pos + 20]))
+
+
+class JsonLoader(object):
+
+    """Store the items pushed through a JsonFeed in a Dfilter.
+
+    See Dfilter.json_loader(). A JSON array (or JSON Lines) replaces the
+    data of the Dfilter, the members of an object are added to it.
+
+    """
+
+    def __init__(self, dfilter, lines=False, query=None, fields=None):
+        self.dfilter = dfilter
+        self.parser = JsonFeed(lines)
+        self.query = query
+        self.fields = fields
+        self.started = False
+
+    def feed(self, data):
+        """Parse a chunk of data, return the number of items stored."""
+        return self._store(self.parser.feed(data))
+
+    def close(self):
+        """Parse the end of the data and return the Dfilter."""
+        self._store(self.parser.close())
+        return self.dfilter
+
+    def _store(self, items):
+        if not items:
+            return 0
+        dfilter = self.dfilter
+        if not self.started:
+            self.started = True
+            if self.parser.kind == 'list':
+                dfilter.data = []
+            elif not isinstance(dfilter.data, dict):
+                raise ValueError('The members of a JSON object can only be '
+                                 'added to a dictionary')
+            if self.query is not None:
+                self.query = dfilter.compile_query(self.query)
+            if self.fields is not None:
+                self.fields = dfilter._field_trie(self.fields)
+        count = 0
+        data = dfilter.data
+        for key, value in dfilter._iter_stream(items, self.query,
+                                               self.fields):
+            if self.parser.kind == 'list':
+                data.append(value)
+            else:
+                data[key] = value
+            count += 1
+        dfilter._data_changed()
+        return count
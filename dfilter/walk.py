@@ -0,0 +1,200 @@
+"""Iterative walkers over nested dictionaries and lists.
+
+The walkers use an explicit stack instead of recursion, so they work on
+trees of any depth, and children share the path of their parent instead
+of copying it at every level.
+
+"""
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from . import path
+from .compat import basestring, iteritems
+
+
+def _children(obj):
+    """Return an iterator of (key, value) pairs or None for leaves."""
+    if isinstance(obj, dict):
+        return iter(iteritems(obj))
+    elif isinstance(obj, list):
+        return enumerate(obj)
+    elif isinstance(obj, path.MAPPINGS):
+        return iter(obj.items())
+    elif isinstance(obj, path.SEQUENCES):
+        return enumerate(obj)
+    return None
+
+
+def iflatten(data):
+    """Iterate over (path, value) pairs of all leaves, path is a tuple.
+
+    >>> list(iflatten({'a': [1, {'b': 2}]}))
+    [(('a', 0), 1), (('a', 1, 'b'), 2)]
+
+    """
+    children = _children(data)
+    if children is None:
+        yield (), data
+        return
+    stack = [((), children)]
+    push = stack.append
+    pop = stack.pop
+    while stack:
+        prefix, children = stack[-1]
+        for key, value in children:
+            grand_children = _children(value)
+            if grand_children is None:
+                yield prefix + (key,), value
+            else:
+                push((prefix + (key,), grand_children))
+                break
+        else:
+            pop()
+
+
+def iflatten_keys(data, separator='.'):
+    """Iterate over (key, value) pairs of all leaves, key is a joined string.
+
+    >>> list(iflatten_keys({'a': [1, {'b': 2}]}))
+    [('a.0', 1), ('a.1.b', 2)]
+
+    """
+    children = _children(data)
+    if children is None:
+        yield '', data
+        return
+    stack = [(None, children)]
+    push = stack.append
+    pop = stack.pop
+    while stack:
+        prefix, children = stack[-1]
+        for key, value in children:
+            if not isinstance(key, basestring):
+                key = str(key)
+            if prefix is not None:
+                key = prefix + separator + key
+            grand_children = _children(value)
+            if grand_children is None:
+                yield key, value
+            else:
+                push((key, grand_children))
+                break
+        else:
+            pop()
+
+
+_MISSING = object()
+
+
+def _child(obj, key):
+    """Return the child of obj that iflatten_keys() names key."""
+    if isinstance(obj, path.MAPPINGS):
+        if key in obj:
+            return obj[key]
+        try:
+            number = int(key)
+        except ValueError:
+            return _MISSING
+        if number in obj and str(number) == key:
+            return obj[number]
+    elif isinstance(obj, path.SEQUENCES) and key.isdigit():
+        position = int(key)
+        if position < len(obj):
+            return obj[position]
+    return _MISSING
+
+
+def lookup_key(data, key, separator='.'):
+    """Return the leaf that iflatten_keys() names key.
+
+    Keys may hold the separator themselves, every way to split the key
+    is tried, shortest keys first.
+
+    >>> lookup_key({'a': [1, {'b.c': 2}]}, 'a.1.b.c')
+    2
+
+    """
+    if not isinstance(data, (path.MAPPINGS, path.SEQUENCES)):
+        if key == '':
+            return data
+        raise KeyError(key)
+    parts = key.split(separator)
+    stack = [(data, 0)]
+    while stack:
+        obj, start = stack.pop()
+        if start == len(parts):
+            if not isinstance(obj, (path.MAPPINGS, path.SEQUENCES)):
+                return obj
+            continue
+        if not isinstance(obj, (path.MAPPINGS, path.SEQUENCES)):
+            continue
+        found = []
+        for end in range(start + 1, len(parts) + 1):
+            child = _child(obj, separator.join(parts[start:end]))
+            if child is not _MISSING:
+                found.append((child, end))
+        stack.extend(reversed(found))
+    raise KeyError(key)
+
+
+class FlatView(Mapping):
+
+    """Read only mapping of the flattened keys of data, without a copy.
+
+    A lookup walks the data along the key, iteration streams the keys
+    from iflatten_keys(). dict(view) builds what flatten() returns.
+
+    >>> view = FlatView({'a': [1, {'b': 2}], 'c': 3})
+    >>> view['a.1.b'], view.get('a.5'), 'c' in view, len(view)
+    (2, None, True, 3)
+    >>> sorted(view.items())
+    [('a.0', 1), ('a.1.b', 2), ('c', 3)]
+
+    :param data: The data, or a function that returns it, so the view
+                 follows data that is replaced.
+
+    """
+
+    def __init__(self, data, separator='.'):
+        self.source = data
+        self.separator = separator
+
+    @property
+    def data(self):
+        if callable(self.source):
+            return self.source()
+        return self.source
+
+    def __getitem__(self, key):
+        if not isinstance(key, basestring):
+            raise KeyError(key)
+        return lookup_key(self.data, key, self.separator)
+
+    def __iter__(self):
+        for key, value in iflatten_keys(self.data, self.separator):
+            yield key
+
+    def __len__(self):
+        count = 0
+        for item in iflatten(self.data):
+            count += 1
+        return count
+
+    def iteritems(self):
+        return iflatten_keys(self.data, self.separator)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def itervalues(self):
+        for key, value in iflatten(self.data):
+            yield value
+
+    def values(self):
+        return list(self.itervalues())
+
+    def __repr__(self):
+        return 'FlatView({0!r})'.format(self.data)
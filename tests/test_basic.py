@@ -1,5 +1,9 @@
+import copy
+import json
+import pickle
 
-from dfilter import Dfilter
+from dfilter import Dfilter, explain
+from dfilter.pipeline import Pipeline
 
 
 class TestFunctional(object):
@@ -88,6 +92,348 @@ class TestFunctional(object):
         path = self.df._unpack_step('[*, 4]', list('abcdefghji'))
         assert path == range(10), '{0}'.format(path)
 
+    def test_spot_compiled(self):
+        spots = list(self.df.spot('*.friend.[0, 1]'))
+        assert ['foo', 'friend', 1] in [s[0] for s in spots], \
+            "Check that list steps are expanded"
+        df = Dfilter({'a': {'b': 1}}, separator='/')
+        assert df.fetch('a/b') == 1, "Check the configured separator is used"
+        assert df.fetch('a.b') is None, "Check the default separator is not"
+
+
+    def test_compiled_query(self):
+        query = self.df.compile_query({'*.age': {'$lte': 40}})
+        assert sorted(self.df.filter(query).keys()) == ['foo', 'qux']
+        other = Dfilter({'x': {'age': 40}, 'y': {'age': 41}})
+        assert other.filter(query).keys() == ['x'], \
+            "Check that a compiled query can be reused"
+        items = self.df.filter({'$or': [{'*.name': 'foo'},
+                                        {'*.age': {'$gt': 60}}]})
+        assert sorted(items.keys()) == ['bar', 'foo']
+        items = self.df.filter({'*.friend': {'$all': ['bar', 'qux']}})
+        assert items.keys() == ['foo']
+        items = self.df.filter({'*.friend.*': {'$nin': ['bar']}})
+        assert sorted(items.keys()) == ['bar', 'foo']
+        items = self.df.filter({'*.age': {'$exists': False}})
+        assert sorted(items.keys()) == ['a', 'b']
+        items = self.df.filter({'*.age': {'$gt': 5, '$lt': 50}})
+        assert sorted(items.keys()) == ['foo', 'qux']
+
+    def test_flatten_deep(self):
+        deep = leaf = {}
+        for n in range(5000):
+            leaf['n'] = {}
+            leaf = leaf['n']
+        leaf['end'] = [1, 2]
+        items = Dfilter(deep).flatten()
+        assert len(items) == 2, "Check that deep data can be flattened"
+        assert items.get('.'.join(['n'] * 5000 + ['end', '1'])) == 2
+
+    def test_fold(self):
+        folded = self.df.fold()
+        assert sorted(folded.get('qux')) == [['foo', 'friend', 1], ['qux', 'name']]
+        folded = self.df.fold(as_str=True)
+        assert folded.get(70) == 'bar.age', "Check single path is a string"
+
+    def test_locate(self):
+        assert sorted(self.df.locate('qux')) == [['foo', 'friend', 1],
+                                                 ['qux', 'name']]
+        assert self.df.locate(70, as_str=True) == ['bar.age'], \
+            "Check a single path is still a list"
+        assert self.df.locate(True) == [], "Check True is not 1"
+        assert Dfilter({'x': set([1, 2])}).locate(set([2, 1])) == [['x']]
+        df = Dfilter({'y': (1, [2])})
+        assert df.locate((1, [2])) == [['y']]
+        df.clean()
+        assert df.locate(2) == [['y', 1, 0]], "Check index is rebuilt"
+
+    def test_mutate(self):
+        source = self.df
+        df = source.copy()
+        df.create_index('*.age')
+        df.create_index('*.age', kind='sorted')
+        df.filter({'*.age': 10})
+        assert df.locate('foo')
+        version = df.version
+        df.set('*.age', 20).set('qux.tags', ['x'])
+        df.update('[foo, bar].age', lambda age: age + 1)
+        df.delete('*.friend.0').set('new', {'age': 21})
+        assert df.version == version + 5, "Check version counts changes"
+        assert df['foo'] == {'name': 'foo', 'friend': ['qux'], 'age': 21}
+        assert df['qux']['tags'] == ['x'] and df['bar']['friend'] == []
+        assert source['foo']['age'] == 10, "Check source is unchanged"
+        assert source['foo']['friend'] == ['bar', 'qux']
+        for query in ({'*.age': 21}, {'*.age': {'$lt': 21}}):
+            assert sorted(df.filter(query).keys()) == \
+                sorted(Dfilter(df.data).filter(query).keys()), query
+        rebuilt = Dfilter(df.data)
+        for value in ('qux', 'x', 21, 20, 'bar'):
+            assert sorted(df.locate(value)) == sorted(rebuilt.locate(value))
+        df.delete('[a, new]')
+        assert sorted(df.keys()) == ['b', 'bar', 'foo', 'qux']
+        assert sorted(df.filter({'*.age': 21}).keys()) == ['bar', 'foo']
+        assert df.locate(1) == [], "Check top level delete"
+
+    def test_fields_shared_prefix(self):
+        fields = self.df.fields(['*.name', '[foo, bar].friend.0', 'foo',
+                                 '*.friend.1', '*.missing'])
+        assert fields['foo'] is self.df['foo'], "Check whole values win"
+        assert fields['bar'] == {'name': 'bar', 'friend': {0: 'foo'}}
+        assert fields['qux'] == {'name': 'qux'}
+        assert 'a' not in fields.data, "Check items without fields"
+        found = self.df.fetch_many(['*.age', '*.friend.0', 'x'], default=-1)
+        assert sorted(found['*.age'].values()) == [10, 40, 70]
+        assert sorted(found['*.friend.0'].values()) == ['bar', 'bar', 'foo']
+        assert found['x'] == -1
+
+    def test_lazy(self):
+        lazy = self.df.lazy().filter({'*.age': {'$lt': 50}}).fields('*.name')
+        items = lazy.collect()
+        assert items.get('foo') == {'name': 'foo'}
+        assert sorted(items.keys()) == ['foo', 'qux']
+        assert lazy.limit(1).count() == 1, "Check that limit is applied"
+        assert lazy.skip(1).count() == 1, "Check that skip is applied"
+        seen = []
+
+        def source():
+            for n in range(1000):
+                seen.append(n)
+                yield n, {'n': n}
+        lazy = Pipeline(self.df, source, 'list')
+        items = lazy.filter({'*.n': {'$mod': [2, 0]}}).first(3).collect()
+        assert items.values() == [{'n': 0}, {'n': 2}, {'n': 4}]
+        assert len(seen) == 5, "Check that the source is not read further"
+
+    def test_clean(self):
+        data = {1: ('a', {2.5: None}), 'b': [True]}
+        df = Dfilter().clean(data)
+        assert df.data == {u'1': [u'a', {u'2.5': None}], u'b': [True]}
+        assert df.data['b'] is not data['b'], "Check that data is copied"
+        normal = {u'x': [1, {u'y': 2}]}
+        df = Dfilter().clean(normal, share=True)
+        assert df.data['x'] is normal['x'], "Check normal data is shared"
+
+    def test_copy_on_write(self):
+        items = self.df.filter({'*.age': {'$gt': 50}})
+        assert items['bar'] is self.df['bar'], "Check subtrees are shared"
+        items._writable(['bar', 'friend']).append('qux')
+        assert items['bar']['friend'] == ['foo', 'qux']
+        assert self.df['bar']['friend'] == ['foo'], "Check source is unchanged"
+        copied = self.df.copy()
+        copied._writable(['foo'])['age'] = 11
+        assert self.df['foo']['age'] == 10
+        assert copied['qux'] is self.df['qux']
+        found = self.df.filter({'*.age': {'$lt': 50}})
+        fields = self.df.fields('*.friend')
+        assert found.equals({'foo': self.df['foo'], 'qux': self.df['qux']})
+        self.df.set('foo.age', 99).delete('foo.friend.0')
+        assert found['foo']['age'] == 10, "Check results keep their data"
+        assert found['foo']['friend'] == ['bar', 'qux']
+        assert fields['foo']['friend'] == ['bar', 'qux']
+        assert not found.equals({'foo': self.df['foo'],
+                                 'qux': self.df['qux']})
+        assert self.df['foo'] == {'name': 'foo', 'friend': ['qux'], 'age': 99}
+        value = {'x': [1]}
+        self.df.set('*.v', value)
+        value['x'].append(2)
+        assert self.df['foo']['v'] == {'x': [1]}, "Set stores a copy"
+        self.df.set('foo.v.x.0', 5)
+        assert value == {'x': [1, 2]} and self.df['bar']['v'] == {'x': [1]}
+
+    def test_sort(self):
+        df = Dfilter([{'age': 30, 'name': 'b'}, {'name': 'x'},
+                      {'age': 'old', 'name': 'c'}, {'age': 30, 'name': 'a'},
+                      {'age': 5, 'name': 'd'}])
+        items = df.sort(['*.age', '-*.name']).values()
+        names = [item['name'] for item in items]
+        assert names == ['d', 'b', 'a', 'c', 'x'], "Check mixed and missing"
+        names = [item['name'] for item in df.sort('-*.age').values()]
+        assert names == ['c', 'b', 'a', 'd', 'x'], "Check missing sort last"
+        top = df.sort(['*.age', '*.name'], limit=2)
+        assert [item['name'] for item in top.values()] == ['d', 'a']
+        lazy = df.lazy().sort('*.name').skip(1).limit(2)
+        assert [item[1]['name'] for item in lazy] == ['b', 'c']
+        assert self.df.sort().keys() == ['a', 'b', 'bar', 'foo', 'qux']
+        data = dict([('k{0:02d}'.format(n), {'n': (n * 7) % 20})
+                     for n in range(20)])
+        df = Dfilter(data)
+        ordered = df.sort('*.n')
+        assert [item['n'] for item in ordered.values()] == list(range(20))
+        assert ordered.keys()[:3] == ['k00', 'k03', 'k06']
+        keys = df.sort().keys()
+        assert keys == sorted(data), "Check sorted keys stay in order"
+        ordered.set('k00.n', -1)
+        assert ordered.keys()[:3] == ['k00', 'k03', 'k06'], "After a copy"
+        assert df.sort('-*.n', limit=2).keys() == ['k17', 'k14']
+        lazy = df.lazy().sort('*.n').collect()
+        assert lazy.keys() == ordered.keys(), "Lazy sort keeps the order"
+        assert df.lazy().sort('-*.n').limit(2).collect().keys() == \
+            ['k17', 'k14']
+
+    def test_group_unwind(self):
+        groups = self.df.group('*.friend.0', {
+            'n': {'$count': {}}, 'ages': {'$sum': '*.age'},
+            'avg': {'$avg': '*.age'}, 'young': {'$min': '*.age'},
+            'names': {'$push': '*.name'}})
+        groups = dict([(g['_id'], g) for g in groups.values()])
+        assert sorted(groups, key=str) == [None, 'bar', 'foo']
+        assert groups[None]['n'] == 2 and groups[None]['ages'] == 0
+        assert groups[None]['avg'] is None, "Check avg without numbers"
+        assert groups['bar']['ages'] == 50 and groups['bar']['avg'] == 25
+        assert groups['bar']['young'] == 10
+        assert sorted(groups['bar']['names']) == ['foo', 'qux']
+        unwound = self.df.unwind('*.friend')
+        assert sorted(unwound.keys()) == ['bar.0', 'foo.0', 'foo.1', 'qux.0']
+        assert unwound['foo.1']['friend'] == 'qux'
+        assert self.df['foo']['friend'] == ['bar', 'qux'], "Check the source"
+        counts = self.df.aggregate([
+            {'$unwind': '*.friend'},
+            {'$group': {'_id': '*.friend', 'n': {'$sum': 1}}},
+            {'$sort': ['-*.n', '*._id']}, {'$limit': 2}])
+        assert counts.values() == [{'_id': 'bar', 'n': 2},
+                                   {'_id': 'foo', 'n': 1}], counts.values()
+
+    def test_explain(self):
+        report = self.df.explain({'$or': [{'*.age': {'$lt': 20}},
+                                          {'*.friend.*': 'qux'}]})
+        assert report['matched'] == 1 and report['items'] == 5
+        plan = report['plan']
+        assert plan['node'] == 'Or' and plan['evaluated'] == 5
+        age, friend = plan['children']
+        assert age['predicate_calls'] == 3, "Only items with an age"
+        assert [s['candidates'] for s in friend['steps']] == [4, 2, 2]
+        assert friend['evaluated'] == 4, "Check the Or short circuit"
+        self.df.create_index('*.name')
+        reports = []
+        explain.add_hook(reports.append, trace=True)
+        try:
+            assert self.df.filter({'*.name': 'bar'}).keys() == ['bar']
+        finally:
+            explain.remove_hook(reports.append)
+        assert not explain.hooks
+        assert reports[0]['used_index'] and reports[0]['candidates'] == 1
+        assert reports[0]['items'] == 5, "All items, not the candidates"
+        assert reports[0]['plan']['evaluated'] == 1
+
+    def test_merkle(self):
+        values = Dfilter([{'a': [1]}, [2], {'a': [1.0]}, [2], 3])
+        assert sorted(values.unique_values(), key=str) == [3, [2], {'a': [1]}]
+        copied = self.df.copy()
+        digest = copied.digest()
+        assert copied.equals(self.df) and digest == self.df.digest()
+        copied.set('foo.friend.1', 'bar')
+        assert not copied.equals(self.df) and copied.digest() != digest
+        assert self.df.digest() == digest, "Check the source is unchanged"
+        copied.delete('a').set('bar.new', [1])
+        changes = sorted([(c['op'], c['path']) for c in
+                          self.df.diff(copied, as_str=True)])
+        assert changes == [('add', 'bar.new'), ('change', 'foo.friend.1'),
+                           ('remove', 'a')], changes
+        copied.set('foo.friend.1', 'qux').delete('bar.new')
+        assert copied.diff(self.df.data) == [
+            {'path': ['a'], 'op': 'add', 'new': 1}]
+        for number in range(3):
+            copied.set('qux', {'name': 'qux', 'friend': [number]}).digest()
+            copied.set('foo.friend.0', number).digest()
+        # top, foo, bar, qux and their friend lists.
+        assert len(copied._hashes.table) == 7, "Check replaced are dropped"
+
+    def test_compact(self):
+        df = Dfilter(self.df.data).compact()
+        assert df['foo'].schema is df['bar'].schema, "Check the shared keys"
+        assert df.data == self.df.data and df.equals(self.df)
+        assert sorted(df.filter({'*.age': {'$lt': 50}}).keys()) == \
+            ['foo', 'qux']
+        assert df.fetch('*.friend.0').data == self.df.fetch('*.friend.0').data
+        assert sorted(df.fields('*.name').values(), key=str) == \
+            sorted(self.df.fields('*.name').values(), key=str)
+        assert json.loads(str(df)) == json.loads(str(self.df))
+        foo = df.fetch('foo')
+        assert isinstance(foo, Dfilter) and foo.data == self.df['foo']
+        assert foo.fetch('friend').data == ['bar', 'qux'], "Fetch on a record"
+        assert foo.fetch('friend').fetch('1') == 'qux'
+        foo.set('age', 12)
+        assert df['foo']['age'] == 10, "Check the record is not changed"
+        df.set('foo.age', 11)
+        assert df['foo'] == dict(self.df['foo'], age=11)
+        shared = df.filter({'*.age': {'$gt': 50}})
+        shared.create_index('*.age')
+        for copied in (pickle.loads(pickle.dumps(shared, 2)),
+                       copy.deepcopy(shared)):
+            assert copied.data == shared.data and copied.equals(shared)
+            assert copied.filter({'*.age': 70}).keys() == ['bar']
+            copied.set('bar.age', 1)
+            assert shared['bar']['age'] == 70, "Check the copy is apart"
+        try:
+            self.df.unknown_name
+        except AttributeError:
+            pass
+        else:
+            raise AssertionError('Unknown attributes raise AttributeError')
+        assert self.df['foo']['age'] == 10 and df['bar']['age'] == 70
+
+    def test_result_cache(self):
+        assert self.df.cache_info() is None
+        self.df.enable_cache(maxsize=2)
+        query = {'*.age': {'$gt': 30}}
+        first = self.df.filter(query)
+        again = self.df.filter({'*.age': {'$gt': 30}})
+        assert self.df.cache_info()['hits'] == 1
+        assert sorted(again.keys()) == ['bar', 'qux']
+        again.set('bar.age', 1).delete('qux')
+        assert sorted(self.df.filter(query).keys()) == ['bar', 'qux'], \
+            "Check that changing a result does not change the cache"
+        assert self.df['bar']['age'] == 70 and first['bar']['age'] == 70
+        assert self.df.fetch('foo.age') == 10 and self.df.fetch('foo.age') == 10
+        self.df.set('foo.age', 50)
+        assert self.df.fetch('foo.age') == 50, "Check the version is used"
+        assert sorted(self.df.filter(query).keys()) == ['bar', 'foo', 'qux']
+        info = self.df.cache_info()
+        assert info['hits'] == 3 and info['size'] <= 2 and info['evictions']
+        self.df.clean()
+        assert self.df.cache_info()['size'] == 0
+
+    def test_flat_view(self):
+        view = self.df.flat_view()
+        flat = self.df.flatten().data
+        assert dict(view) == flat and len(view) == len(flat)
+        assert sorted(view) == sorted(flat) and view['foo.friend.1'] == 'qux'
+        assert 'foo.friend' not in view and view.get('foo.friend.7') is None
+        self.df.set('foo.new', {'x.y': [5]})
+        assert view['foo.new.x.y.0'] == 5, "Check the view follows the data"
+        assert Dfilter([1, 2]).flat_view()['1'] == 2
+
+    def test_descendant(self):
+        df = Dfilter(tds1)
+        ids = df.fetch('**.id').values()
+        assert len(ids) == 20 and 'Open' in ids and 'CopyAgain' in ids
+        assert self.df.fetch('**.friend.0').values() == \
+            self.df.fetch('*.friend.0').values()
+        walked = list(df.spot('**.label'))
+        df.create_key_index()
+        assert list(df.spot('**.label')) == walked, "Check the key index"
+        assert df.fetch('**.id').values() == ids
+        df.delete('menu.hidden')
+        assert len(df.fetch('**.id').values()) == 18
+        assert df.filter({'**.id': 'Mute'}).keys() == ['menu']
+        assert sorted(self.df.filter({'**.*': 'qux'}).keys()) == \
+            ['foo', 'qux']
+        found = self.df.fields('**.age')
+        assert found.values() == self.df.fields('*.age').values()
+        assert self.df._unpack_step('**', {'a': {'b': 1}, 'c': [2]}) in \
+            ([['a'], ['a', 'b'], ['c'], ['c', 0]],
+             [['c'], ['c', 0], ['a'], ['a', 'b']])
+
+    def test_descendant_nested(self):
+        data = {'x': {'a': {'a': 1}}, 'y': [[1, 2], [3]]}
+        df = Dfilter(copy.deepcopy(data)).delete('**.a')
+        assert df.data == {'x': {}, 'y': [[1, 2], [3]]}
+        df = Dfilter(copy.deepcopy(data)).delete('**.0')
+        assert df.data == {'x': {'a': {'a': 1}}, 'y': [[]]}
+        df = Dfilter(copy.deepcopy(data)).set('**.a', 5)
+        assert df.data['x'] == {'a': 5}, "Outer match wins"
+        df = Dfilter(copy.deepcopy(data)).update('**.a', lambda v: [v])
+        assert df.data['x'] == {'a': [{'a': [1]}]}, "Inner match first"
 
 
 #TestDataSample1
@@ -0,0 +1,41 @@
+
+from nose.plugins.skip import SkipTest
+
+from dfilter import Dfilter
+from dfilter import columnar
+
+
+class TestColumnar(object):
+
+    def setup(self):
+        if columnar.numpy is None:
+            raise SkipTest('numpy is not installed')
+        self.df = Dfilter()
+        self.df.read_json('tests/countries.json')
+        self.cols = self.df.columnar()
+
+    def test_01_same_as_filter(self):
+        queries = [{'*.population': {'$gt': 10 ** 7}},
+                   {'*.population': {'$lte': 0}},
+                   {'*.region': 'Europe', '*.population': {'$lt': 10 ** 6}},
+                   {'*.region': {'$in': ['Africa', 'Oceania']}},
+                   {'*.region': {'$nin': ['Africa', 'Oceania']}},
+                   {'*.population': {'$mod': [2, 1]}},
+                   {'*.language': {'$exists': True}},
+                   {'*.name': {'$contains': 'South'}},
+                   {'$or': [{'*.cca2': 'ZA'}, {'*.population': {'$gt': 10 ** 9}}]},
+                   {'*.subregion': {'$not': {'$eq': 'Southern Africa'}}}]
+        for query in queries:
+            expected = self.df.filter(query).values()
+            found = self.cols.filter(query).values()
+            assert expected == found, "Columnar result differs for {0}".format(query)
+
+    def test_02_masks(self):
+        mask = (self.cols['*.population'] > 10 ** 8) & \
+            (self.cols['*.region'] == 'Asia')
+        names = sorted([c['name'] for c in self.cols.select(mask).values()])
+        expected = self.df.filter({'*.population': {'$gt': 10 ** 8},
+                                   '*.region': 'Asia'})
+        assert names == sorted([c['name'] for c in expected.values()])
+        assert self.cols['*.population'].numeric, "Check numbers are numeric"
+        assert not self.cols['*.region'].numeric
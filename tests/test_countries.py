@@ -24,4 +24,59 @@ class TestCountries(object):
                "Filter result must match request"
         sa_name = sa.fields('*.name').fetch('*.name')
         assert 'South Africa' == sa_name
+
+    def test_03_index(self):
+        queries = [{'*.region': 'Africa'},
+                   {'*.region': {'$in': ['Africa', 'Oceania']}},
+                   {'*.population': {'$gt': 50000000}},
+                   {'*.population': {'$lte': 1000}, '*.region': 'Europe'},
+                   {'*.language.*': 'French', '*.population': {'$lt': 10 ** 6}}]
+        names = lambda df: [c['name'] for c in df.values()]
+        expected = [names(self.df.filter(q)) for q in queries]
+        self.df.create_index('*.region')
+        self.df.create_index('*.language.*')
+        self.df.create_index('*.population', kind='sorted')
+        for query, wanted in zip(queries, expected):
+            found = names(self.df.filter(query))
+            assert found and found == wanted, "Index changed result of {0}".format(query)
+
+    def test_04_workers(self):
+        query = {'*.region': {'$in': ['Africa', 'Asia']}}
+        found = self.df.filter(query, workers=2)
+        assert found.values() == self.df.filter(query).values(), \
+            "Parallel filter must keep the list order"
+        found = self.df.fields(['*.name', '*.cca2'], workers=3)
+        assert found.values() == self.df.fields(['*.name', '*.cca2']).values()
+        found = self.df.fetch('*.name', workers=2)
+        assert found.values() == self.df.fetch('*.name').values()
+        people = Dfilter(dict([('p{0}'.format(n), {'age': n})
+                               for n in range(50)]))
+        found = people.filter({'*.age': {'$lt': 10}}, workers=2)
+        assert sorted(found.keys()) == ['p{0}'.format(n) for n in range(10)]
+
+    def test_05_text(self):
+        names = lambda df: sorted([c['name'] for c in df.values()])
+        found = self.df.filter({'*.name': {'$regex': '^south', '$options': 'i'}})
+        assert names(found) == ['South Africa', 'South Georgia',
+                                'South Korea', 'South Sudan'], names(found)
+        query = {'*.name': {'$text': 'SOUTH africa'}}
+        assert names(self.df.filter(query)) == ['South Africa']
+        scanned = names(self.df.filter({'*.name': {'$text': 'islands'}}))
+        self.df.create_text_index('*.name')
+        assert names(self.df.filter(query)) == ['South Africa']
+        assert names(self.df.filter({'*.name': {'$text': 'islands'}})) == \
+            scanned
+        assert self.df.explain(query)['candidates'] == 1
+        chad = self.df.locate('Chad', as_str=True)[0]
+        self.df.set(chad, 'Chad, south of Africa')
+        assert names(self.df.filter(query)) == ['Chad, south of Africa',
+                                                'South Africa']
+
+    def test_06_fold(self):
+        folded = self.df.fold(as_str=True)
+        asia = self.df.filter({'*.region': 'Asia'})
+        assert len(folded['Asia']) == len(asia), "Every path of the value"
+        assert '44.region' in folded['Africa']
+        assert sorted(folded['Chad']) == ['44.name', '44.translations.en']
+        assert folded['Chadian'] == '44.demonym', "One path stays a string"
 #
@@ -0,0 +1,67 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from dfilter import Dfilter
+from dfilter.shard import SIDECAR, ShardedDfilter
+
+
+class TestShard(object):
+
+    def setup(self):
+        self.tmp = tempfile.mkdtemp()
+        self.df = Dfilter().read_json('tests/countries.json')
+        for region in ('Africa', 'Americas', 'Asia', 'Europe'):
+            items = self.df.filter({'*.region': region}).values()
+            fh = open(os.path.join(self.tmp, region + '.json'), 'w')
+            json.dump(items, fh)
+            fh.close()
+        items = self.df.filter({'*.region': {'$nin': ['Africa', 'Americas',
+                                                      'Asia', 'Europe']}})
+        fh = open(os.path.join(self.tmp, 'rest.jsonl'), 'w')
+        for item in items.values():
+            fh.write(json.dumps(item) + '\n')
+        fh.close()
+        self.sharded = ShardedDfilter(self.tmp,
+                                      ['*.region', '*.population'])
+
+    def teardown(self):
+        shutil.rmtree(self.tmp)
+
+    def names(self, df):
+        return sorted([item['name'] for item in df.values()])
+
+    def test_01_skip(self):
+        assert len(self.sharded.refresh().shards) == 5, "Not the sidecar"
+        assert os.path.exists(os.path.join(self.tmp, SIDECAR))
+        query = {'*.region': 'Asia', '*.population': {'$gt': 10 ** 8}}
+        assert self.sharded.plan(query) == ['Asia.json']
+        found = self.sharded.filter(query)
+        assert self.names(found) == self.names(self.df.filter(query))
+        assert self.sharded.loaded() == ['Asia.json'], "Check lazy loading"
+        plan = self.sharded.plan({'*.region': {'$in': ['Oceania', 'Polar']}})
+        assert plan == ['rest.jsonl']
+        assert self.sharded.plan({'*.population': {'$lt': -1}}) == []
+
+    def test_02_all(self):
+        for query in ({'*.population': {'$lte': 10000}},
+                      {'*.name': {'$regex': '^S'}},
+                      {'$or': [{'*.region': 'Asia'}, {'*.population': 0}]}):
+            found = self.sharded.filter(query, workers=3)
+            assert self.names(found) == self.names(self.df.filter(query)), \
+                query
+
+    def test_03_refresh(self):
+        name = os.path.join(self.tmp, 'Europe.json')
+        fh = open(name, 'w')
+        json.dump([{'name': 'Nowhere', 'region': 'Moon',
+                    'population': -5}], fh)
+        fh.close()
+        # Make sure the modification time changes.
+        os.utime(name, (time.time() + 10, time.time() + 10))
+        sharded = ShardedDfilter(self.tmp, ['*.region', '*.population'])
+        assert sharded.plan({'*.region': 'Moon'}) == ['Europe.json']
+        assert self.sharded.refresh().plan({'*.population': {'$lt': -1}}) == \
+            ['Europe.json']
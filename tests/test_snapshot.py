@@ -0,0 +1,76 @@
+import os
+import pickle
+import shutil
+import tempfile
+
+from dfilter import Dfilter
+from dfilter.snapshot import SnapshotDict, decode
+
+
+class TestSnapshot(object):
+
+    def setup(self):
+        self.tmp = tempfile.mkdtemp()
+        self.name = os.path.join(self.tmp, 'countries.snap')
+        self.df = Dfilter().read_json('tests/countries.json')
+        self.df.save_snapshot(self.name)
+        self.snap = Dfilter().open_snapshot(self.name)
+
+    def teardown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_01_round_trip(self):
+        assert isinstance(self.snap.data[0], SnapshotDict), "Check lazy"
+        assert decode(self.snap.data) == self.df.data
+        for path in ('*.name', '*.language.*', '*.translations.de'):
+            assert self.snap.fetch(path).values() == \
+                self.df.fetch(path).values(), path
+        query = {'*.region': 'Africa', '*.population': {'$gt': 10 ** 7}}
+        assert decode(self.snap.filter(query).values()) == \
+            self.df.filter(query).values()
+        assert decode(self.snap.fields('*.tld').values()) == \
+            self.df.fields('*.tld').values()
+        assert self.snap.locate('Pretoria') == self.df.locate('Pretoria')
+
+    def test_02_copy_on_write(self):
+        self.snap.set('0.name', 'Changed').delete('1.tld')
+        assert self.snap[0]['name'] == 'Changed'
+        assert 'tld' not in self.snap[1]
+        assert Dfilter().open_snapshot(self.name)[0]['name'] == \
+            'Afghanistan', "Check the file is not changed"
+        name = os.path.join(self.tmp, 'changed.snap')
+        self.snap.save_snapshot(name)
+        assert decode(Dfilter().open_snapshot(name).data) == \
+            decode(self.snap.data)
+
+    def test_03_values(self):
+        data = {'deep': [[[[{'x': -2 ** 70}]]]], 'f': 1.5, 'b': [True, None],
+                1: u'\xe9', 'empty': [{}, []]}
+        Dfilter(data).save_snapshot(self.name)
+        snap = Dfilter().open_snapshot(self.name)
+        assert decode(snap.data) == Dfilter().clean(data).data
+        assert pickle.loads(pickle.dumps(snap['deep'])) == data['deep']
+        found = list(snap.spot('deep.*.*.*.*.x'))
+        assert found == [[['deep', 0, 0, 0, 0, 'x'], -2 ** 70]], found
+
+    def test_04_proxies(self):
+        for proxy in (self.snap[0], self.snap[0]['tld']):
+            try:
+                hash(proxy)
+            except TypeError:
+                pass
+            else:
+                raise AssertionError('Snapshot proxies are not hashable')
+        country = self.snap.fetch('0')
+        assert isinstance(country, Dfilter), "Fetch wraps a proxy"
+        assert decode(country.fetch('tld').data) == self.df[0]['tld']
+        query = {'*.region': 'Oceania'}
+        assert decode(self.snap.filter(query).unwind('*.tld').values()) == \
+            self.df.filter(query).unwind('*.tld').values()
+        spec = {'n': {'$count': {}}}
+        assert self.snap.group('*.borders', spec).values() == \
+            self.df.group('*.borders', spec).values()
+        assert decode(self.snap.sort('*.latlng').values()) == \
+            self.df.sort('*.latlng').values()
+        assert self.snap.locate(self.df[0]['latlng']) == \
+            self.df.locate(self.df[0]['latlng'])
@@ -0,0 +1,103 @@
+
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from dfilter import Dfilter
+from dfilter.stream import JsonFeed, JsonStream
+
+
+class TestStream(object):
+
+    def setup(self):
+        self.tmp = tempfile.mkdtemp()
+        self.df = Dfilter().read_json('tests/countries.json')
+
+    def teardown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_01_stream_matches_filter(self):
+        query = {'*.region': 'Africa', '*.population': {'$gt': 10 ** 7}}
+        streamed = Dfilter().read_json('tests/countries.json', query=query)
+        assert streamed.values() == self.df.filter(query).values(), \
+            "Streamed filter must match filter on loaded data"
+        streamed = Dfilter().read_json('tests/countries.json', query=query,
+                                       fields=['*.name', '*.capital'])
+        names = self.df.filter(query).fields(['*.name', '*.capital'])
+        assert streamed.values() == names.values()
+
+    def test_02_small_chunks(self):
+        with open('tests/countries.json') as fh:
+            items = [item[1] for item in JsonStream(fh, chunk_size=7)]
+        assert items == self.df.data, "Check items split over chunks"
+        fh = open(os.path.join(self.tmp, 'object.json'), 'w')
+        fh.write('{"a": 12345, "b": {"c": [1, 2.5e3]}, "d": "x\\u00e9"}')
+        fh.close()
+        items = list(JsonStream(os.path.join(self.tmp, 'object.json'),
+                                chunk_size=2))
+        assert sorted(items) == [('a', 12345), ('b', {'c': [1, 2500.0]}),
+                                 ('d', u'x\xe9')], items
+
+    def test_03_json_lines(self):
+        name = os.path.join(self.tmp, 'countries.jsonl')
+        fh = open(name, 'w')
+        for country in self.df.values():
+            fh.write(json.dumps(country) + '\n')
+        fh.close()
+        loaded = Dfilter().read_json(name)
+        assert loaded.count() == 250, "Check all lines are read"
+        names = [item[1] for item in Dfilter().stream_json(
+            name, query={'*.cca2': {'$in': ['ZA', 'NA']}}, fields='*.name')]
+        assert names == [{'name': 'Namibia'}, {'name': 'South Africa'}], names
+
+    def test_04_group_stream(self):
+        spec = {'n': {'$count': {}}, 'people': {'$sum': '*.population'},
+                'biggest': {'$max': '*.population'}}
+        grouped = self.df.group('*.region', spec)
+        streamed = Dfilter().lazy_json('tests/countries.json').group(
+            '*.region', spec).collect()
+        assert streamed.values() == grouped.values(), \
+            "Streamed group must match group on loaded data"
+        assert sum([group['n'] for group in grouped.values()]) == 250
+
+    def test_05_json_loader(self):
+        with open('tests/countries.json', 'rb') as fh:
+            raw = fh.read()
+        query = {'*.region': 'Europe'}
+        loader = Dfilter().json_loader(query=query, fields='*.name')
+        stored = 0
+        for start in range(0, len(raw), 4093):
+            stored += loader.feed(raw[start:start + 4093])
+        loaded = loader.close()
+        expected = self.df.filter(query).fields('*.name')
+        assert loaded.values() == expected.values()
+        assert stored == len(expected)
+        batches = list(self.df.ifilter(query, batch=100))
+        assert len(batches) == 3, "One list per 100 items looked at"
+        assert sum(batches, []) == list(self.df.ifilter(query))
+        assert [item[1] for item in sum(batches, [])] == \
+            self.df.filter(query).values()
+
+    def test_06_split_numbers(self):
+        text = u'[12.5, 3e4, 7, -0.25E-2, 1e+3, {"n": 45.0}, 6]'
+        for chunk_size in range(1, 9):
+            items = [item[1] for item in JsonStream(io.StringIO(text),
+                                                    chunk_size=chunk_size)]
+            assert items == json.loads(text), chunk_size
+
+    def test_07_feed_split_numbers(self):
+        feed = JsonFeed()
+        assert feed.feed(b'[12.') == []
+        assert feed.feed(b'5, 3e') == [(0, 12.5)]
+        assert feed.feed(b'-2, 7') == [(1, 3e-2)]
+        assert feed.feed(b']') == [(2, 7)]
+        assert feed.close() == []
+        loader = Dfilter([1, 2]).json_loader()
+        try:
+            loader.feed(b'{"a": 1}')
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('An object feed needs dictionary data')